@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+聚合后端基准测试
+对比逐条 dict 累加与 NumPy 分组归约：按模型汇总、按天序列、单次请求 token 分位数
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import cycle, islice
+from pathlib import Path
+
+from stats import (HAS_NUMPY, ColumnarAggregator, UsageRecord, aggregate_hourly,
+                   rollup_hourly, token_percentiles)
+
+MODELS = ('claude-opus-4-6', 'claude-sonnet-4-5', 'claude-haiku-4-5', 'glm-5', 'deepseek-v3')
+# 循环使用的不同记录数，避免生成阶段本身成为瓶颈
+POOL_SIZE = 100_003
+
+
+def _record_pool() -> list:
+    """约 90 天、按时间递增的合成记录"""
+    rng = random.Random(42)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    step = timedelta(days=90) / POOL_SIZE
+    return [
+        UsageRecord(
+            rng.choice(MODELS),
+            (start + step * i).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            rng.randint(1, 5_000),
+            rng.randint(1, 4_000),
+            rng.randint(0, 200_000),
+            rng.randint(0, 10_000),
+            f'session-{i // 500}',
+        )
+        for i in range(POOL_SIZE)
+    ]
+
+
+def records(pool: list, n: int):
+    return islice(cycle(pool), n)
+
+
+def timed(label: str, n: int, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<34} {elapsed:8.2f}s  {n / elapsed:>12,.0f} records/s")
+    return result, elapsed
+
+
+def bench(pool: list, n: int, export_dir: Path):
+    print(f"{n:,} records")
+
+    def summarize(backend: str):
+        hourly = aggregate_hourly(records(pool, n), backend=backend)
+        return rollup_hourly(hourly), rollup_hourly(hourly, 'day')
+
+    baseline, base_time = timed('dict: sums + day series', n, lambda: summarize('dict'))
+    base_pct, base_pct_time = timed('dict: token percentiles', n,
+                                    lambda: token_percentiles(records(pool, n), backend='dict'))
+    if not HAS_NUMPY:
+        print("  numpy not installed, skipping vectorised backend")
+        return
+
+    result, fast_time = timed('numpy: sums + day series', n, lambda: summarize('numpy'))
+    pct, fast_pct_time = timed('numpy: token percentiles', n,
+                               lambda: token_percentiles(records(pool, n), backend='numpy'))
+    assert result == baseline and pct == base_pct, "backends disagree"
+
+    # 已经是列式的数据（--export 的二进制导出）直接归约，不经过 Python 记录对象
+    from usage_export import export_usage, load_columns
+
+    path = export_dir / f'usage_{n}.bin'
+    export_usage((('bench', r) for r in records(pool, n)), path, fmt='binary')
+
+    def from_columns():
+        dictionaries, columns = load_columns(path)
+        tokens = [columns[name] for name in ('input_tokens', 'output_tokens',
+                                             'cache_read_tokens', 'cache_creation_tokens')]
+        aggregator = ColumnarAggregator(keep_totals=True).add_columns(
+            dictionaries['model'], columns['model'], columns['timestamp'], tokens)
+        hourly = aggregator.hourly()
+        return rollup_hourly(hourly), rollup_hourly(hourly, 'day'), aggregator.percentiles()
+
+    columnar, columnar_time = timed('numpy from export: all three', n, from_columns)
+    assert columnar == baseline + (base_pct,), "columnar export disagrees"
+    path.unlink()
+
+    print(f"  speedup: sums+series {base_time / fast_time:.1f}x, "
+          f"percentiles {base_pct_time / fast_pct_time:.1f}x, "
+          f"from export {(base_time + base_pct_time) / columnar_time:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark usage aggregation backends')
+    parser.add_argument('--records', type=int, nargs='+', default=[1_000_000, 10_000_000],
+                        help='Record counts to benchmark')
+    args = parser.parse_args()
+
+    print("Building record pool...", file=sys.stderr)
+    pool = _record_pool()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.records:
+            bench(pool, n, Path(tmp))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+session 文件解析基准测试
+生成合成 JSONL 日志，对比逐行 json 解析与字节预过滤的吞吐量（lines/sec）
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import stats
+from stats import JSON_BACKEND, SessionFileReader, aggregate_records
+
+
+def _sample_lines() -> list:
+    """构造一组接近真实 session 日志的行：user / tool_result / assistant"""
+    user = {
+        'type': 'user',
+        'timestamp': '2026-01-20T10:11:12.345Z',
+        'sessionId': 'bench',
+        'message': {'role': 'user', 'content': '请帮我重构这个模块 ' * 20},
+    }
+    tool_result = {
+        'type': 'user',
+        'timestamp': '2026-01-20T10:11:13.345Z',
+        'sessionId': 'bench',
+        'message': {'role': 'user', 'content': [
+            {'type': 'tool_result', 'tool_use_id': 'toolu_01', 'content': 'line of output\n' * 80},
+        ]},
+    }
+    assistant = {
+        'type': 'assistant',
+        'timestamp': '2026-01-20T10:11:14.345Z',
+        'sessionId': 'bench',
+        'message': {
+            'model': 'claude-opus-4-6',
+            'role': 'assistant',
+            'content': [{'type': 'text', 'text': '好的，下面是修改方案。' * 10}],
+            'usage': {
+                'input_tokens': 12,
+                'output_tokens': 345,
+                'cache_read_input_tokens': 45678,
+                'cache_creation_input_tokens': 901,
+            },
+        },
+    }
+    summary = {'type': 'summary', 'summary': 'Refactor stats module', 'leafUuid': 'x'}
+    return [json.dumps(d, ensure_ascii=False) + '\n'
+            for d in (user, tool_result, user, assistant, tool_result, summary)]
+
+
+def generate_log(path: Path, size_mb: int) -> int:
+    """写入约 size_mb MB 的合成日志，返回行数"""
+    block = ''.join(_sample_lines()).encode('utf-8')
+    lines_per_block = len(_sample_lines())
+    target = size_mb * 1024 * 1024
+    # 每次写入一大段，避免生成阶段成为瓶颈
+    repeat = max(1, (8 * 1024 * 1024) // len(block))
+    chunk = block * repeat
+    written = 0
+    lines = 0
+    with open(path, 'wb') as f:
+        while written < target:
+            f.write(chunk)
+            written += len(chunk)
+            lines += lines_per_block * repeat
+    return lines
+
+
+def run(path: Path, lines: int, prefilter: bool, backend: str) -> float:
+    loads = stats.json_loads
+    if backend == 'json':
+        stats.json_loads = json.loads
+    try:
+        start = time.perf_counter()
+        result = aggregate_records(SessionFileReader(path, prefilter=prefilter))
+        elapsed = time.perf_counter() - start
+    finally:
+        stats.json_loads = loads
+    mode = f"{'prefilter' if prefilter else 'full-parse'} + {backend}"
+    count = sum(d['count'] for d in result.values())
+    print(f"{mode:<24} {elapsed:8.2f}s  {lines / elapsed:>12,.0f} lines/s  ({count:,} records)")
+    return lines / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark session file parsing')
+    parser.add_argument('--size-mb', type=int, default=1024, help='Synthetic log size in MB')
+    parser.add_argument('--file', type=Path, help='Use an existing JSONL file instead')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.file:
+            path = args.file
+            with open(path, 'rb') as f:
+                lines = sum(1 for _ in f)
+        else:
+            path = Path(tmp) / 'bench.jsonl'
+            print(f"Generating {args.size_mb} MB synthetic log...", file=sys.stderr)
+            lines = generate_log(path, args.size_mb)
+
+        print(f"{lines:,} lines")
+        # 基线是原来的实现：标准库 json 逐行解析
+        baseline = run(path, lines, prefilter=False, backend='json')
+        fast = run(path, lines, prefilter=True, backend='json')
+        if JSON_BACKEND != 'json':
+            run(path, lines, prefilter=False, backend=JSON_BACKEND)
+            fast = run(path, lines, prefilter=True, backend=JSON_BACKEND)
+        print(f"speedup: {fast / baseline:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
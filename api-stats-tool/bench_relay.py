@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+代理转发引擎基准测试
+在 loopback 上通过代理下载/上传数据，对比各转发引擎的吞吐量和代理进程 CPU 占用
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from proxy_stats import RELAY_ENGINES, SpliceRelay, StreamRelay, TCPProxy
+
+# 原实现：StreamReader.read(4096) + drain()
+BASELINE = 'stream-4k'
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _serve_proxy(engine: str, port: int):
+    """子进程入口：按指定引擎启动代理"""
+    proxy = TCPProxy(listen_port=port, db_path=Path(tempfile.gettempdir()) / f'bench_relay_{port}.db',
+                     relay='stream' if engine == BASELINE else engine)
+    if engine == BASELINE:
+        proxy.relay = StreamRelay(buffer_size=4096)
+    asyncio.run(proxy.start())
+
+
+def _target_server(total: int, mode: str) -> socket.socket:
+    """目标服务器：download 模式发送 total 字节后关闭，upload 模式读到 EOF 后关闭"""
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    payload = b'x' * (1024 * 1024)
+
+    def run():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                if mode == 'download':
+                    sent = 0
+                    while sent < total:
+                        conn.sendall(payload)
+                        sent += len(payload)
+                else:
+                    buf = bytearray(1024 * 1024)
+                    while conn.recv_into(buf):
+                        pass
+
+    threading.Thread(target=run, daemon=True).start()
+    return server
+
+
+def _cpu_seconds(pid: int) -> float:
+    """读取进程 CPU 时间（Linux /proc）"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except OSError:
+        return float('nan')
+
+
+def _run_client(proxy_port: int, target_port: int, total: int, mode: str) -> float:
+    with socket.create_connection(('127.0.0.1', proxy_port)) as sock:
+        sock.sendall(f'CONNECT 127.0.0.1:{target_port} HTTP/1.1\r\n'
+                     f'Host: 127.0.0.1:{target_port}\r\n\r\n'.encode())
+        header = b''
+        while not header.endswith(b'\r\n\r\n'):
+            chunk = sock.recv(1)
+            if not chunk:
+                raise RuntimeError('proxy closed connection during CONNECT')
+            header += chunk
+
+        start = time.perf_counter()
+        if mode == 'download':
+            buf = bytearray(1024 * 1024)
+            received = 0
+            while True:
+                n = sock.recv_into(buf)
+                if not n:
+                    break
+                received += n
+            if received < total:
+                raise RuntimeError(f'short read: {received} < {total}')
+        else:
+            payload = b'x' * (1024 * 1024)
+            sent = 0
+            while sent < total:
+                sock.sendall(payload)
+                sent += len(payload)
+            sock.shutdown(socket.SHUT_WR)
+            while sock.recv(65536):
+                pass
+        return time.perf_counter() - start
+
+
+def bench(engine: str, total: int, mode: str):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, __file__, '--serve', engine, '--port', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    server = _target_server(total, mode)
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError(f'proxy with {engine} relay did not start')
+                time.sleep(0.05)
+
+        cpu_before = _cpu_seconds(proc.pid)
+        elapsed = _run_client(port, server.getsockname()[1], total, mode)
+        cpu = _cpu_seconds(proc.pid) - cpu_before
+        mb = total / (1024 * 1024)
+        print(f"{engine:<10} {mode:<9} {mb / elapsed:>10,.0f} MB/s   proxy CPU {cpu / mb * 1024:6.2f} s/GB")
+    finally:
+        server.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark proxy relay engines on loopback')
+    parser.add_argument('--size-mb', type=int, default=2048, help='Bytes to transfer per run (MB)')
+    parser.add_argument('--engines', nargs='+',
+                        default=[BASELINE] + sorted(RELAY_ENGINES),
+                        help='Engines to compare')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve_proxy(args.serve, args.port)
+        return
+
+    total = args.size_mb * 1024 * 1024
+    for engine in args.engines:
+        if engine == 'splice' and not SpliceRelay.available():
+            print(f"{engine:<10} skipped (os.splice not available)")
+            continue
+        for mode in ('download', 'upload'):
+            bench(engine, total, mode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+模型价格表与费用计算
+按模型系列（模型名前缀）给出每百万 token 的美元价格，区分输入、输出、缓存读取和缓存写入。
+
+- 内置表为 Anthropic 公开价格（缓存写入按 5 分钟 TTL 计），可在 ~/.claude/api_stats_prices.json
+  中覆盖或补充（同名前缀替换内置项），格式与 DEFAULT_PRICES 相同
+- 费用在聚合时逐条记录计算：部分模型在单次请求提示超过阈值时整体按长上下文价格计费，
+  事后按汇总 token 无法还原
+- 费用以 nano-USD 整数累加（1 USD = COST_UNIT），各种聚合顺序下结果完全一致
+"""
+
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+COST_UNIT = 1_000_000_000
+
+PRICE_FIELDS = ('input', 'output', 'cache_read', 'cache_write')
+
+PRICES_PATH = Path.home() / ".claude" / "api_stats_prices.json"
+
+# USD / 百万 token；模型名取最长匹配前缀
+DEFAULT_PRICES: Dict[str, dict] = {
+    'claude-opus-4': {'input': 15, 'output': 75, 'cache_read': 1.5, 'cache_write': 18.75},
+    'claude-opus-4-5': {'input': 5, 'output': 25, 'cache_read': 0.5, 'cache_write': 6.25},
+    'claude-opus-4-6': {'input': 5, 'output': 25, 'cache_read': 0.5, 'cache_write': 6.25},
+    'claude-sonnet-4': {
+        'input': 3, 'output': 15, 'cache_read': 0.3, 'cache_write': 3.75,
+        # 提示（输入 + 缓存读写）超过 20 万 token 的请求整体按长上下文价格计费
+        'long_context': {'threshold': 200_000, 'input': 6, 'output': 22.5,
+                         'cache_read': 0.6, 'cache_write': 7.5},
+    },
+    'claude-haiku-4-5': {'input': 1, 'output': 5, 'cache_read': 0.1, 'cache_write': 1.25},
+    'claude-3-7-sonnet': {'input': 3, 'output': 15, 'cache_read': 0.3, 'cache_write': 3.75},
+    'claude-3-5-sonnet': {'input': 3, 'output': 15, 'cache_read': 0.3, 'cache_write': 3.75},
+    'claude-3-5-haiku': {'input': 0.8, 'output': 4, 'cache_read': 0.08, 'cache_write': 1},
+    'claude-3-opus': {'input': 15, 'output': 75, 'cache_read': 1.5, 'cache_write': 18.75},
+    'claude-3-haiku': {'input': 0.25, 'output': 1.25, 'cache_read': 0.03, 'cache_write': 0.3},
+}
+
+# (输入, 输出, 缓存读, 缓存写) 每 token 的 nano-USD
+Rates = Tuple[int, int, int, int]
+
+
+def _entry_error(entry) -> Optional[str]:
+    """检查用户价格项，有问题时返回原因"""
+    if not isinstance(entry, dict):
+        return f"expected an object, got {type(entry).__name__}"
+    long_context = entry.get('long_context')
+    if long_context is not None and not isinstance(long_context, dict):
+        return f"long_context: expected an object, got {type(long_context).__name__}"
+    for name, values, fields in (('', entry, PRICE_FIELDS),
+                                 ('long_context.', long_context or {}, PRICE_FIELDS + ('threshold',))):
+        for field in fields:
+            value = values.get(field, 0)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                return f"{name}{field}: expected a non-negative number, got {value!r}"
+    return None
+
+
+def _rates(entry: dict) -> Rates:
+    # USD / 百万 token -> nano-USD / token
+    return tuple(round(float(entry.get(field, 0)) * 1000) for field in PRICE_FIELDS)
+
+
+class PriceTable:
+    """模型 -> 费率，按最长前缀匹配，结果按模型名缓存"""
+
+    def __init__(self, prices: Dict[str, dict]):
+        self.prices = {prefix.lower(): entry for prefix, entry in prices.items()}
+        self.fingerprint = hashlib.sha1(
+            json.dumps(self.prices, sort_keys=True).encode()).hexdigest()[:16]
+        self._cache: Dict[str, tuple] = {}
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> 'PriceTable':
+        """内置价格叠加用户价格文件；文件不存在时只用内置价格，格式不对的价格项跳过"""
+        path = path or PRICES_PATH
+        prices = dict(DEFAULT_PRICES)
+        try:
+            with open(path) as f:
+                user = json.load(f)
+            if not isinstance(user, dict):
+                raise ValueError("expected an object of {model prefix: prices}")
+            for prefix, entry in user.items():
+                error = _entry_error(entry)
+                if error:
+                    print(f"Ignoring price for {prefix!r} in {path}: {error}", file=sys.stderr)
+                else:
+                    prices[prefix] = entry
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring price table {path}: {e}", file=sys.stderr)
+        return cls(prices)
+
+    def _resolve(self, model: str) -> tuple:
+        name = model.lower()
+        match = max((prefix for prefix in self.prices if name.startswith(prefix)),
+                    key=len, default=None)
+        if match is None:
+            resolved = ()
+        else:
+            entry = self.prices[match]
+            long_context = entry.get('long_context') or {}
+            resolved = (_rates(entry), int(long_context.get('threshold', 0)),
+                        _rates(long_context) if long_context else None)
+        self._cache[model] = resolved
+        return resolved
+
+    def tiers(self, model: str) -> Tuple[Rates, int, Rates]:
+        """(基础费率, 长上下文阈值（0 表示没有）, 长上下文费率)；没有价格时费率全为 0"""
+        resolved = self._cache.get(model)
+        if resolved is None:
+            resolved = self._resolve(model)
+        if not resolved:
+            return (0, 0, 0, 0), 0, (0, 0, 0, 0)
+        base, threshold, long_rates = resolved
+        return base, threshold, long_rates or base
+
+    def cost_terms(self, model: str) -> Tuple[tuple, int, tuple]:
+        """供聚合循环内联计费：(基础系数, 阈值, 长上下文系数)
+
+        系数为 (输入, 输出, 缓存读, 缓存写, 缓存读节省, 缓存写溢价) 每 token 的 nano-USD。
+        提示（输入 + 缓存读写）超过阈值的请求整体按长上下文系数计费；
+        节省 = 缓存读取按普通输入计价的差额 - 缓存写入相对普通输入的溢价。
+        """
+        base, threshold, long_rates = self.tiers(model)
+        terms = [rates + (rates[0] - rates[2], rates[3] - rates[0]) for rates in (base, long_rates)]
+        return terms[0], threshold, terms[1]
+
+    def is_priced(self, model: str) -> bool:
+        resolved = self._cache.get(model)
+        return bool(resolved if resolved is not None else self._resolve(model))
+
+
+_price_table: Optional[PriceTable] = None
+
+
+def get_price_table() -> PriceTable:
+    """进程内共享的价格表（首次使用时加载）"""
+    global _price_table
+    if _price_table is None:
+        _price_table = PriceTable.load()
+    return _price_table
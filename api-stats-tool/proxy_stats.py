@@ -5,13 +5,24 @@ Lightweight TCP Proxy for API Statistics
 """
 
 import asyncio
+import fcntl
 import json
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import socket
 import sqlite3
+import sys
+import threading
 import time
 from pathlib import Path
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 import logging
 
 # 尝试使用 rich 库
@@ -29,11 +40,14 @@ logger = logging.getLogger(__name__)
 @dataclass
 class ConnectionRecord:
     """连接记录"""
-    timestamp: str
+    timestamp: int         # Unix 时间戳（秒）
     target_host: str
     target_port: int
     client_ip: str
     connect_time: float
+    bytes_up: int = 0      # 客户端 -> 目标
+    bytes_down: int = 0    # 目标 -> 客户端
+    duration: float = 0.0  # 隧道存活时间（秒）
 
     def to_dict(self):
         return {
@@ -42,79 +56,1051 @@ class ConnectionRecord:
             'target_port': self.target_port,
             'client_ip': self.client_ip,
             'connect_time': self.connect_time,
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+            'duration': self.duration,
         }
 
 
+@dataclass(eq=False)
+class TunnelCounters:
+    """隧道字节计数，由转发引擎在转发过程中累加"""
+    bytes_up: int = 0
+    bytes_down: int = 0
+
+
+# 隧道时长直方图：bucket b 覆盖 (HIST_MIN * HIST_BASE**(b-1), HIST_MIN * HIST_BASE**b]，
+# 相对误差约 9%，小时汇总只需保存每个 bucket 的计数
+HIST_MIN = 0.001
+HIST_BASE = 2 ** 0.25
+
+
+def duration_bucket(duration: float) -> int:
+    """时长（秒）所在的直方图 bucket"""
+    if duration <= HIST_MIN:
+        return 0
+    return math.ceil(math.log(duration / HIST_MIN, HIST_BASE))
+
+
+def bucket_value(bucket: int) -> float:
+    """bucket 的代表值（区间的几何中点）"""
+    if bucket <= 0:
+        return 0.0
+    return HIST_MIN * HIST_BASE ** (bucket - 0.5)
+
+
+def rollup_connections(rows) -> Tuple[dict, dict]:
+    """把 (timestamp, host, bytes_up, bytes_down, duration) 行聚合为小时汇总
+
+    返回 ({(hour, host): [count, bytes_up, bytes_down, duration]},
+          {(hour, host, bucket): count})
+    """
+    hourly: Dict[tuple, list] = {}
+    hist: Dict[tuple, int] = defaultdict(int)
+    for timestamp, host, bytes_up, bytes_down, duration in rows:
+        hour = timestamp // 3600 * 3600
+        totals = hourly.get((hour, host))
+        if totals is None:
+            totals = hourly[(hour, host)] = [0, 0, 0, 0.0]
+        totals[0] += 1
+        totals[1] += bytes_up or 0
+        totals[2] += bytes_down or 0
+        totals[3] += duration or 0.0
+        hist[(hour, host, duration_bucket(duration or 0.0))] += 1
+    return hourly, hist
+
+
 class StatsDatabase:
-    """统计数据库"""
+    """统计数据库
+
+    写入由后台线程完成：record() 只把记录放进内存队列，writer 线程持有一个长连接，
+    按条数或时间阈值用 executemany 批量提交，事件循环不会等待磁盘 fsync。
+
+    每批写入的同一事务中更新按 (小时, 主机) 的汇总表和时长直方图，
+    get_stats 只读取汇总表，不扫描原始连接记录。
+    """
+
+    # 2: timestamp 改为 Unix 时间戳，新增 host_hourly / host_hourly_hist
+    SCHEMA_VERSION = 2
 
-    def __init__(self, db_path: Path):
+    _STOP = object()
+
+    # 写入失败（例如 --compact 的 VACUUM 持有写锁）时保留这一批，退避后重试；
+    # 连续失败这么多次才丢弃并记录日志
+    FLUSH_ATTEMPTS = 8
+    FLUSH_BACKOFF_MAX = 30.0
+
+    def __init__(self, db_path: Path, batch_size: int = 256, flush_interval: float = 0.5):
         self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
         self._init_db()
 
     def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
         c = conn.cursor()
+        # 只对新建的数据库生效；旧数据库由 --compact 做一次完整 VACUUM 后切换
+        c.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        c.execute('PRAGMA journal_mode=WAL')
+        c.execute('BEGIN IMMEDIATE')
+        version = c.execute('PRAGMA user_version').fetchone()[0]
+        legacy = version < 2 and c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'connections'"
+        ).fetchone()
+        if legacy:
+            c.execute('ALTER TABLE connections RENAME TO connections_v1')
         c.execute('''
             CREATE TABLE IF NOT EXISTS connections (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
                 target_host TEXT NOT NULL,
                 target_port INTEGER NOT NULL,
                 client_ip TEXT,
-                connect_time REAL
+                connect_time REAL,
+                bytes_up INTEGER DEFAULT 0,
+                bytes_down INTEGER DEFAULT 0,
+                duration REAL DEFAULT 0
             )
         ''')
+        # 按 (小时, 主机) 的汇总和时长直方图，hour 为整点的 Unix 时间戳
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS host_hourly (
+                hour INTEGER NOT NULL,
+                target_host TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                bytes_up INTEGER NOT NULL,
+                bytes_down INTEGER NOT NULL,
+                duration REAL NOT NULL,
+                PRIMARY KEY (hour, target_host)
+            ) WITHOUT ROWID
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS host_hourly_hist (
+                hour INTEGER NOT NULL,
+                target_host TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (hour, target_host, bucket)
+            ) WITHOUT ROWID
+        ''')
+        if legacy:
+            self._migrate_v1(c)
         c.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON connections(timestamp)')
         c.execute('CREATE INDEX IF NOT EXISTS idx_host ON connections(target_host)')
-        conn.commit()
+        # 运行中代理的内存计数器快照（DNS 缓存、连接池命中率等）
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL,
+                updated TEXT NOT NULL
+            )
+        ''')
+        c.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        c.execute('COMMIT')
         conn.close()
 
+    def _migrate_v1(self, c: sqlite3.Cursor):
+        """旧版本的 timestamp 是本地时间 isoformat 文本：转换为 Unix 时间戳并回填汇总表"""
+        columns = {row[1] for row in c.execute('PRAGMA table_info(connections_v1)')}
+        for column in ('bytes_up', 'bytes_down', 'duration'):
+            if column not in columns:
+                c.execute(f'ALTER TABLE connections_v1 ADD COLUMN {column} DEFAULT 0')
+        # 'utc' 修饰符按本地时区换算；无法解析的时间戳丢弃
+        c.execute('''
+            INSERT INTO connections (id, timestamp, target_host, target_port, client_ip,
+                                     connect_time, bytes_up, bytes_down, duration)
+            SELECT id, CAST(strftime('%s', timestamp, 'utc') AS INTEGER), target_host, target_port,
+                   client_ip, connect_time, bytes_up, bytes_down, duration
+            FROM connections_v1
+            WHERE strftime('%s', timestamp, 'utc') IS NOT NULL
+        ''')
+        c.execute('DROP TABLE connections_v1')
+        rows = c.execute(
+            'SELECT timestamp, target_host, bytes_up, bytes_down, duration FROM connections'
+        ).fetchall()
+        self._write_rollups(c, *rollup_connections(rows))
+        logger.info(f"Migrated {len(rows)} connection records to epoch timestamps")
+
+    @staticmethod
+    def _write_rollups(conn, hourly: dict, hist: dict):
+        conn.executemany('''
+            INSERT INTO host_hourly (hour, target_host, count, bytes_up, bytes_down, duration)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (hour, target_host) DO UPDATE SET
+                count = count + excluded.count,
+                bytes_up = bytes_up + excluded.bytes_up,
+                bytes_down = bytes_down + excluded.bytes_down,
+                duration = duration + excluded.duration
+        ''', [key + tuple(totals) for key, totals in hourly.items()])
+        conn.executemany('''
+            INSERT INTO host_hourly_hist (hour, target_host, bucket, count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (hour, target_host, bucket) DO UPDATE SET count = count + excluded.count
+        ''', [key + (count,) for key, count in hist.items()])
+
     def record(self, record: ConnectionRecord):
+        """记录一次连接（非阻塞，只入队）"""
+        if self._writer is None:
+            self._start_writer()
+        self._queue.put(record)
+
+    def save_counters(self, counters: dict):
+        """保存计数器快照（非阻塞，随下一批记录一起写入）"""
+        if self._writer is None:
+            self._start_writer()
+        self._queue.put(dict(counters))
+
+    def get_counters(self) -> dict:
+        """读取最近一次保存的计数器快照"""
         conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO connections (timestamp, target_host, target_port, client_ip, connect_time)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (record.timestamp, record.target_host, record.target_port,
-              record.client_ip, record.connect_time))
-        conn.commit()
+        try:
+            return {name: value for name, value in
+                    conn.execute('SELECT name, value FROM counters ORDER BY name')}
+        finally:
+            conn.close()
+
+    def _lock_path(self) -> Path:
+        return Path(str(self.db_path) + '.writer.lock')
+
+    def writer_running(self) -> bool:
+        """是否有其他进程的 writer 线程正在写这个数据库（代理在运行）"""
+        with open(self._lock_path(), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                # writer 存活期间持有共享锁，供 --compact 判断代理是否在运行
+                self._writer_lock = open(self._lock_path(), 'a')
+                fcntl.flock(self._writer_lock, fcntl.LOCK_SH)
+                self._writer = threading.Thread(
+                    target=self._writer_loop, name='stats-writer', daemon=True
+                )
+                self._writer.start()
+
+    def _writer_loop(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        batch = []
+        deadline = 0.0
+        failures = 0
+        stopping = False
+
+        while not stopping or batch:
+            if batch:
+                timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+            else:
+                # 空闲时一直阻塞，不占 CPU
+                item = self._queue.get()
+
+            if item is self._STOP:
+                stopping = True
+            elif item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            # 退避期间只按 deadline 重试，新记录并入同一批
+            due = time.monotonic() >= deadline
+            if batch and (due or (not failures and (stopping or len(batch) >= self.batch_size))):
+                try:
+                    self._flush(conn, batch)
+                except sqlite3.Error as e:
+                    failures += 1
+                    records = sum(1 for item in batch if not isinstance(item, dict))
+                    if failures >= self.FLUSH_ATTEMPTS:
+                        logger.error(f"Dropping {records} stats records after {failures} failed writes: {e}")
+                        batch, failures = [], 0
+                    else:
+                        delay = min(self.FLUSH_BACKOFF_MAX, self.flush_interval * 2 ** failures)
+                        logger.warning(f"Failed to write {records} stats records ({e}), "
+                                       f"retrying in {delay:g}s")
+                        deadline = time.monotonic() + delay
+                else:
+                    batch, failures = [], 0
+
         conn.close()
 
-    def get_stats(self, since_hours: int = 24) -> dict:
-        """获取统计数据"""
+    def _flush(self, conn: sqlite3.Connection, batch: list):
+        """一个事务写入一批记录；失败时回滚并抛出 sqlite3.Error，由调用方保留这一批重试"""
+        counters = {}
+        records = []
+        for item in batch:
+            if isinstance(item, dict):
+                counters.update(item)
+            else:
+                records.append(item)
+        try:
+            if counters:
+                now = datetime.now().isoformat()
+                conn.executemany(
+                    'INSERT OR REPLACE INTO counters (name, value, updated) VALUES (?, ?, ?)',
+                    [(name, value, now) for name, value in counters.items()]
+                )
+            conn.executemany('''
+                INSERT INTO connections (timestamp, target_host, target_port, client_ip, connect_time,
+                                         bytes_up, bytes_down, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(r.timestamp, r.target_host, r.target_port, r.client_ip, r.connect_time,
+                   r.bytes_up, r.bytes_down, r.duration)
+                  for r in records])
+            self._write_rollups(conn, *rollup_connections(
+                (r.timestamp, r.target_host, r.bytes_up, r.bytes_down, r.duration) for r in records
+            ))
+            conn.commit()
+        except sqlite3.Error:
+            # 不回滚的话，已执行的部分会随下一批一起提交，计数器与记录对不上
+            conn.rollback()
+            raise
+
+    def close(self):
+        """刷新队列中剩余的记录并停止 writer 线程"""
+        self._closed.set()
+        with self._lock:
+            writer = self._writer
+            self._writer = None
+        if writer is not None:
+            self._queue.put(self._STOP)
+            writer.join()
+        if self._writer_lock is not None:
+            self._writer_lock.close()
+            self._writer_lock = None
+
+    def compact(self, retention_days: Optional[float] = None, batch_size: int = 1000,
+                pause: float = 0.05, vacuum_pages: int = 256) -> dict:
+        """删除超过保留期的原始连接记录（小时汇总永久保留），并增量回收空闲页
+
+        retention_days 为空时不删除记录，只回收空闲页。
+        每批删除/回收都是一个短事务，批次之间让出写锁，writer 线程的批量写入
+        最多等待一个批次；close() 后在批次之间退出。
+        """
+        deleted = 0
+        freed = 0
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cutoff = int(time.time() - retention_days * 86400) if retention_days else None
+            while cutoff is not None and not self._closed.is_set():
+                cursor = conn.execute(
+                    'DELETE FROM connections WHERE id IN '
+                    '(SELECT id FROM connections WHERE timestamp < ? LIMIT ?)',
+                    (cutoff, batch_size)
+                )
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+                time.sleep(pause)
+
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                while not self._closed.is_set():
+                    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                    if not free:
+                        break
+                    pages = min(free, vacuum_pages)
+                    # execute() 每次只推进一页，executescript 会执行到结束
+                    conn.executescript(f'PRAGMA incremental_vacuum({pages})')
+                    freed += pages
+                    time.sleep(pause)
+        finally:
+            conn.close()
+        page_size = self._pragma('page_size')
+        return {'deleted': deleted, 'freed_bytes': freed * page_size}
+
+    def enable_incremental_vacuum(self) -> bool:
+        """旧数据库切换为 auto_vacuum=INCREMENTAL（需要一次完整 VACUUM），已切换时返回 False
+
+        完整 VACUUM 期间整个数据库被锁住，代理在运行时拒绝执行（RuntimeError）。
+        """
+        if self._pragma('auto_vacuum') == 2:
+            return False
+        if self.writer_running():
+            raise RuntimeError("the proxy is writing to this database; stop it and rerun --compact "
+                               "to convert it to incremental auto-vacuum")
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+        return True
+
+    def checkpoint(self):
+        """把 WAL 写回主库并截断 WAL 文件"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        finally:
+            conn.close()
+
+    def _pragma(self, name: str) -> int:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(f'PRAGMA {name}').fetchone()[0]
+        finally:
+            conn.close()
+
+    def get_stats(self, since_hours: float = 24) -> dict:
+        """获取统计数据
+
+        按主机返回请求数、上下行字节数、吞吐量和隧道时长的 p50/p95/p99。
+        完整的小时读汇总表，只有窗口起点所在的不足一小时部分读原始记录；
+        分位数由时长直方图估算。
+        """
+        cutoff = int(time.time() - since_hours * 3600)
+        first_hour = -(-cutoff // 3600) * 3600  # 窗口内第一个完整小时
+
         conn = sqlite3.connect(self.db_path)
         c = conn.cursor()
 
-        since_time = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        totals: Dict[str, list] = {}
+        hist: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        c.execute('''
+            SELECT target_host, SUM(count), SUM(bytes_up), SUM(bytes_down), SUM(duration)
+            FROM host_hourly
+            WHERE hour >= ?
+            GROUP BY target_host
+        ''', (first_hour,))
+        for host, *values in c.fetchall():
+            totals[host] = values
+        c.execute('''
+            SELECT target_host, bucket, SUM(count)
+            FROM host_hourly_hist
+            WHERE hour >= ?
+            GROUP BY target_host, bucket
+        ''', (first_hour,))
+        for host, bucket, count in c.fetchall():
+            hist[host][bucket] += count
 
-        # 按主机统计
         c.execute('''
-            SELECT target_host, COUNT(*) as count
+            SELECT timestamp, target_host, bytes_up, bytes_down, duration
             FROM connections
-            WHERE timestamp >= datetime('now', ?)
-            GROUP BY target_host
-            ORDER BY count DESC
-        ''', (f'-{since_hours} hours',))
+            WHERE timestamp >= ? AND timestamp < ?
+        ''', (cutoff, first_hour))
+        head, head_hist = rollup_connections(c.fetchall())
+        conn.close()
+        for (_, host), values in head.items():
+            merged = totals.setdefault(host, [0, 0, 0, 0.0])
+            for i, value in enumerate(values):
+                merged[i] += value
+        for (_, host, bucket), count in head_hist.items():
+            hist[host][bucket] += count
 
         host_stats = {}
-        for row in c.fetchall():
-            host_stats[row[0]] = {'count': row[1]}
-
-        conn.close()
+        for host, (count, bytes_up, bytes_down, duration) in sorted(
+                totals.items(), key=lambda item: item[1][0], reverse=True):
+            host_stats[host] = {
+                'count': count,
+                'bytes_up': bytes_up,
+                'bytes_down': bytes_down,
+                'throughput': (bytes_up + bytes_down) / duration if duration else 0.0,
+            }
+            host_stats[host].update(histogram_percentiles(hist[host]))
         return host_stats
 
 
+def histogram_percentiles(hist: Dict[int, int]) -> dict:
+    """时长直方图 {bucket: count} 的 p50/p95/p99（最近秩法）"""
+    buckets = sorted(hist.items())
+    total = sum(count for _, count in buckets)
+    result = {}
+    for p in (50, 95, 99):
+        key = f'p{p}'
+        result[key] = 0.0
+        if not total:
+            continue
+        rank = max(1, math.ceil(p / 100 * total))
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen >= rank:
+                result[key] = bucket_value(bucket)
+                break
+    return result
+
+
+class RelayEngine:
+    """隧道转发引擎基类
+
+    CONNECT 握手完成后，由引擎负责在客户端和目标服务器之间双向转发数据，
+    并把两个方向的字节数累加到 counters。
+    """
+
+    name = ''
+
+    async def relay(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter,
+                    target_reader: asyncio.StreamReader, target_writer: asyncio.StreamWriter,
+                    counters: TunnelCounters):
+        raise NotImplementedError
+
+
+def _take_buffered(reader: asyncio.StreamReader) -> bytes:
+    """取出 StreamReader 中已缓冲但未读取的数据（切换到底层 socket/transport 前调用）"""
+    # StreamReader 没有公开接口查看缓冲区
+    buffered = bytes(reader._buffer)
+    reader._buffer.clear()
+    return buffered
+
+
+class StreamRelay(RelayEngine):
+    """基于 StreamReader/StreamWriter 的转发，跨平台，每次复制一块数据"""
+
+    name = 'stream'
+
+    def __init__(self, buffer_size: int = 64 * 1024):
+        self.buffer_size = buffer_size
+
+    async def relay(self, client_reader, client_writer, target_reader, target_writer, counters):
+        await asyncio.gather(
+            self._forward(client_reader, target_writer, counters, 'bytes_up'),
+            self._forward(target_reader, client_writer, counters, 'bytes_down'),
+            return_exceptions=True
+        )
+
+    async def _forward(self, src: asyncio.StreamReader, dst: asyncio.StreamWriter,
+                       counters: TunnelCounters, field: str):
+        try:
+            while True:
+                data = await src.read(self.buffer_size)
+                if not data:
+                    break
+                setattr(counters, field, getattr(counters, field) + len(data))
+                dst.write(data)
+                await dst.drain()
+            # 半关闭：另一方向继续转发
+            if dst.can_write_eof():
+                dst.write_eof()
+        except (ConnectionResetError, BrokenPipeError):
+            dst.close()
+
+
+class _RelayProtocol(asyncio.BufferedProtocol):
+    """一侧 transport 的 BufferedProtocol：数据直接读入可复用的大缓冲区，再写给对端"""
+
+    def __init__(self, buffer_size: int, transport: asyncio.Transport, done: asyncio.Future,
+                 counters: TunnelCounters, upstream: bool):
+        self.buffer_size = buffer_size
+        self.counters = counters
+        self.upstream = upstream  # True: 客户端 -> 目标方向
+        self.view = memoryview(bytearray(buffer_size))
+        self.transport = transport
+        # 原来的 StreamReaderProtocol，断开时通知它，StreamWriter.wait_closed() 才能返回
+        self.stream_protocol = transport.get_protocol()
+        self.done = done
+        self.peer: Optional['_RelayProtocol'] = None
+        self.eof = False
+
+    def get_buffer(self, sizehint: int):
+        return self.view
+
+    def buffer_updated(self, nbytes: int):
+        if self.upstream:
+            self.counters.bytes_up += nbytes
+        else:
+            self.counters.bytes_down += nbytes
+        peer_transport = self.peer.transport
+        peer_transport.write(self.view[:nbytes])
+        if peer_transport.get_write_buffer_size():
+            # 对端 transport 可能仍引用这块内存，换一块新缓冲区
+            self.view = memoryview(bytearray(self.buffer_size))
+
+    def eof_received(self):
+        self.eof = True
+        if self.peer.eof:
+            self.transport.close()
+            self.peer.transport.close()
+            return False
+        if self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+        # 保持半关闭，继续转发另一方向
+        return True
+
+    def connection_lost(self, exc):
+        self.peer.transport.close()
+        self.stream_protocol.connection_lost(exc)
+        if not self.done.done():
+            self.done.set_result(None)
+
+    def pause_writing(self):
+        # 本侧写缓冲区满，暂停读取对端
+        self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        self.peer.transport.resume_reading()
+
+
+class ProtocolRelay(RelayEngine):
+    """把两侧 transport 切换为 BufferedProtocol 直接对接
+
+    数据由事件循环直接 recv_into 到可复用的大缓冲区，不经过 StreamReader 的
+    缓冲和 await 切换，流控由 transport 的 pause/resume 回调完成。
+    """
+
+    name = 'protocol'
+
+    def __init__(self, buffer_size: int = 256 * 1024):
+        self.buffer_size = buffer_size
+
+    async def relay(self, client_reader, client_writer, target_reader, target_writer, counters):
+        client_transport = client_writer.transport
+        target_transport = target_writer.transport
+        if client_transport.is_closing() or target_transport.is_closing():
+            return
+
+        loop = asyncio.get_running_loop()
+        client_proto = _RelayProtocol(self.buffer_size, client_transport, loop.create_future(),
+                                      counters, upstream=True)
+        target_proto = _RelayProtocol(self.buffer_size, target_transport, loop.create_future(),
+                                      counters, upstream=False)
+        client_proto.peer, target_proto.peer = target_proto, client_proto
+
+        client_pending = _take_buffered(client_reader)
+        target_pending = _take_buffered(target_reader)
+        client_transport.set_protocol(client_proto)
+        target_transport.set_protocol(target_proto)
+
+        counters.bytes_up += len(client_pending)
+        counters.bytes_down += len(target_pending)
+        if client_pending:
+            target_transport.write(client_pending)
+        if target_pending:
+            client_transport.write(target_pending)
+        for proto, reader in ((client_proto, client_reader), (target_proto, target_reader)):
+            if reader.at_eof():
+                # 切换前已经收到 EOF，transport 不会再回调
+                proto.eof_received()
+            else:
+                proto.transport.resume_reading()
+
+        await asyncio.gather(client_proto.done, target_proto.done)
+
+
+class SpliceRelay(RelayEngine):
+    """Linux os.splice 零拷贝转发：数据经由 pipe 在内核中搬运，不进入用户态"""
+
+    name = 'splice'
+
+    def __init__(self, chunk_size: int = 1024 * 1024):
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(os, 'splice')
+
+    async def relay(self, client_reader, client_writer, target_reader, target_writer, counters):
+        client_sock = client_writer.get_extra_info('socket')
+        target_sock = target_writer.get_extra_info('socket')
+
+        # 已缓冲在 StreamReader 中的数据先转发出去，并等两侧写缓冲区清空
+        for reader, writer, field in ((client_reader, target_writer, 'bytes_up'),
+                                      (target_reader, client_writer, 'bytes_down')):
+            pending = _take_buffered(reader)
+            if pending:
+                setattr(counters, field, getattr(counters, field) + len(pending))
+                writer.write(pending)
+            writer.transport.set_write_buffer_limits(high=0)
+            await writer.drain()
+
+        # 停止 transport 的读取，由 splice 接管 socket
+        client_writer.transport.pause_reading()
+        target_writer.transport.pause_reading()
+
+        await asyncio.gather(
+            self._splice(client_sock, target_sock, counters, 'bytes_up'),
+            self._splice(target_sock, client_sock, counters, 'bytes_down'),
+            return_exceptions=True
+        )
+
+    async def _wait(self, fd: int, writable: bool):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        add, remove = ((loop.add_writer, loop.remove_writer) if writable
+                       else (loop.add_reader, loop.remove_reader))
+        add(fd, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            remove(fd)
+
+    async def _splice(self, src, dst, counters: TunnelCounters, field: str):
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        # transport 仍占用原 fd，等待就绪时用 dup 出来的 fd 注册
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        src_wait, dst_wait = os.dup(src_fd), os.dup(dst_fd)
+        pipe_r, pipe_w = os.pipe()
+        try:
+            fcntl.fcntl(pipe_w, fcntl.F_SETPIPE_SZ, self.chunk_size)
+        except OSError:
+            pass
+        try:
+            while True:
+                try:
+                    n = os.splice(src_fd, pipe_w, self.chunk_size, flags=flags)
+                except BlockingIOError:
+                    await self._wait(src_wait, writable=False)
+                    continue
+                if n == 0:
+                    break
+                setattr(counters, field, getattr(counters, field) + n)
+                while n:
+                    try:
+                        n -= os.splice(pipe_r, dst_fd, n, flags=flags)
+                    except BlockingIOError:
+                        await self._wait(dst_wait, writable=True)
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            # 任一方向出错，整条隧道结束
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        finally:
+            for fd in (src_wait, dst_wait, pipe_r, pipe_w):
+                os.close(fd)
+
+
+RELAY_ENGINES = {
+    'stream': StreamRelay,
+    'protocol': ProtocolRelay,
+    'splice': SpliceRelay,
+}
+
+
+def create_relay(name: str) -> RelayEngine:
+    """按名称创建转发引擎，splice 不可用时回退到 protocol"""
+    if name == 'splice' and not SpliceRelay.available():
+        logger.warning("os.splice not available, falling back to protocol relay")
+        name = 'protocol'
+    return RELAY_ENGINES[name]()
+
+
+class DNSCache:
+    """异步 DNS 解析缓存
+
+    getaddrinfo 不返回记录的 TTL，统一按 ttl 秒缓存；同一主机的并发解析合并为一次。
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache: Dict[Tuple[str, int], Tuple[float, List[Tuple[str, int]]]] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, host: str, port: int) -> List[Tuple[str, int]]:
+        """解析为 [(ip, port), ...]"""
+        key = (host, port)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._lookup(host, port))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(fut)
+
+    async def _lookup(self, host: str, port: int) -> List[Tuple[str, int]]:
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addrs = list(dict.fromkeys(info[4][:2] for info in infos))
+        if len(self._cache) >= self.max_entries:
+            now = time.monotonic()
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        self._cache[(host, port)] = (time.monotonic() + self.ttl, addrs)
+        return addrs
+
+    def invalidate(self, host: str, port: int):
+        self._cache.pop((host, port), None)
+
+    async def open_connection(self, host: str, port: int):
+        """用缓存的地址建立连接，依次尝试各地址，全部失败时清除缓存"""
+        last_error: Optional[Exception] = None
+        for ip, addr_port in await self.resolve(host, port):
+            try:
+                return await asyncio.open_connection(ip, addr_port)
+            except OSError as e:
+                last_error = e
+        self.invalidate(host, port)
+        raise last_error or OSError(f"No address found for {host}:{port}")
+
+
+class UpstreamPool:
+    """热点目标主机的预热 TCP 连接池
+
+    CONNECT 隧道优先取一条已完成握手的空闲连接，取走后在后台补充。
+    size 为 0 时不预热，只走 DNS 缓存直连。
+    """
+
+    def __init__(self, dns: DNSCache, size: int = 0, max_idle: float = 30.0,
+                 hot_window: float = 600.0):
+        self.dns = dns
+        self.size = size
+        self.max_idle = max_idle
+        self.hot_window = hot_window
+        self._idle: Dict[Tuple[str, int], deque] = defaultdict(deque)
+        self._last_used: Dict[Tuple[str, int], float] = {}
+        self._pinned: set = set()
+        self._filling: set = set()
+        self._tasks: set = set()
+        self.hits = 0
+        self.misses = 0
+
+    async def acquire(self, host: str, port: int):
+        """取一条到目标的连接，返回 (reader, writer)"""
+        if not self.size:
+            return await self.dns.open_connection(host, port)
+
+        key = (host, port)
+        self._last_used[key] = time.monotonic()
+        idle = self._idle[key]
+        while idle:
+            created, reader, writer = idle.popleft()
+            if self._usable(created, reader, writer):
+                self.hits += 1
+                self._schedule_refill(key)
+                return reader, writer
+            writer.close()
+
+        self.misses += 1
+        self._schedule_refill(key)
+        return await self.dns.open_connection(host, port)
+
+    def warm(self, host: str, port: int):
+        """预热指定主机，并在后续维护中始终保持"""
+        key = (host, port)
+        self._pinned.add(key)
+        if self.size:
+            self._schedule_refill(key)
+
+    def maintain(self):
+        """清理过期的空闲连接，并为热点主机补足连接"""
+        if not self.size:
+            return
+        now = time.monotonic()
+        for key, idle in list(self._idle.items()):
+            fresh = deque(item for item in idle if self._usable(*item))
+            for item in idle:
+                if item not in fresh:
+                    item[2].close()
+            self._idle[key] = fresh
+            hot = key in self._pinned or now - self._last_used.get(key, 0) < self.hot_window
+            if hot:
+                self._schedule_refill(key)
+            elif not fresh:
+                del self._idle[key]
+
+    def _usable(self, created: float, reader: asyncio.StreamReader,
+                writer: asyncio.StreamWriter) -> bool:
+        return (time.monotonic() - created < self.max_idle
+                and not reader.at_eof() and not writer.is_closing())
+
+    def _schedule_refill(self, key: Tuple[str, int]):
+        if key in self._filling:
+            return
+        self._filling.add(key)
+        task = asyncio.ensure_future(self._refill(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refill(self, key: Tuple[str, int]):
+        try:
+            idle = self._idle[key]
+            while len(idle) < self.size:
+                reader, writer = await self.dns.open_connection(*key)
+                idle.append((time.monotonic(), reader, writer))
+        except Exception as e:
+            logger.warning(f"Failed to prewarm {key[0]}:{key[1]}: {e}")
+        finally:
+            self._filling.discard(key)
+
+    def counters(self) -> dict:
+        return {
+            'dns_cache_hits': self.dns.hits,
+            'dns_cache_misses': self.dns.misses,
+            'pool_hits': self.hits,
+            'pool_misses': self.misses,
+        }
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        for idle in self._idle.values():
+            for _, _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class ProxyMetrics:
+    """运行中代理的内存指标，以 Prometheus 文本格式导出
+
+    所有计数都在内存中维护，抓取时不访问数据库。速率和事件循环延迟由
+    采样任务每秒更新一次；活跃隧道的字节数在采样时读取，转发路径上没有额外开销。
+    """
+
+    def __init__(self):
+        self.connects_total = 0
+        self.host_connects: Dict[str, int] = defaultdict(int)
+        self.active: set = set()
+        self.closed_bytes_up = 0
+        self.closed_bytes_down = 0
+        self.connects_per_sec = 0.0
+        self.bytes_up_per_sec = 0.0
+        self.bytes_down_per_sec = 0.0
+        self.loop_lag = 0.0
+        self._last_sample = (time.monotonic(), 0, 0, 0)
+
+    def tunnel_opened(self, host: str, counters: TunnelCounters):
+        self.connects_total += 1
+        self.host_connects[host] += 1
+        self.active.add(counters)
+
+    def tunnel_closed(self, counters: TunnelCounters):
+        self.active.discard(counters)
+        self.closed_bytes_up += counters.bytes_up
+        self.closed_bytes_down += counters.bytes_down
+
+    def bytes_total(self) -> Tuple[int, int]:
+        up = self.closed_bytes_up + sum(c.bytes_up for c in self.active)
+        down = self.closed_bytes_down + sum(c.bytes_down for c in self.active)
+        return up, down
+
+    def sample(self, loop_lag: float):
+        """更新速率和事件循环延迟"""
+        now = time.monotonic()
+        up, down = self.bytes_total()
+        last_time, last_connects, last_up, last_down = self._last_sample
+        elapsed = now - last_time
+        if elapsed > 0:
+            self.connects_per_sec = (self.connects_total - last_connects) / elapsed
+            self.bytes_up_per_sec = (up - last_up) / elapsed
+            self.bytes_down_per_sec = (down - last_down) / elapsed
+        self._last_sample = (now, self.connects_total, up, down)
+        self.loop_lag = loop_lag
+
+    def render(self, extra_counters: Optional[dict] = None) -> str:
+        """输出 Prometheus 文本格式"""
+        up, down = self.bytes_total()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        metric('proxy_active_tunnels', 'gauge', 'Currently open CONNECT tunnels',
+               [('', len(self.active))])
+        metric('proxy_connects_total', 'counter', 'CONNECT tunnels accepted',
+               [('', self.connects_total)])
+        metric('proxy_connects_per_second', 'gauge', 'CONNECT rate over the last sample interval',
+               [('', round(self.connects_per_sec, 3))])
+        metric('proxy_bytes_total', 'counter', 'Bytes relayed',
+               [('{direction="up"}', up), ('{direction="down"}', down)])
+        metric('proxy_bytes_per_second', 'gauge', 'Relay throughput over the last sample interval',
+               [('{direction="up"}', round(self.bytes_up_per_sec, 1)),
+                ('{direction="down"}', round(self.bytes_down_per_sec, 1))])
+        metric('proxy_host_connects_total', 'counter', 'CONNECT tunnels per target host',
+               [(f'{{host="{_escape_label(host)}"}}', count)
+                for host, count in sorted(self.host_connects.items())])
+        metric('proxy_event_loop_lag_seconds', 'gauge', 'Event loop scheduling delay',
+               [('', round(self.loop_lag, 6))])
+        for name, value in sorted((extra_counters or {}).items()):
+            metric(f'proxy_{name}_total', 'counter', name.replace('_', ' ').capitalize(),
+                   [('', value)])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
 class TCPProxy:
-    """轻量 TCP 代理"""
+    """轻量 TCP 代理
 
-    def __init__(self, listen_port: int = 8080, db_path: Path = None):
+    生命周期：serve_forever 直到收到 SIGINT/SIGTERM 或 stop()，随后停止接受新连接，
+    在 drain_timeout 内等待进行中的隧道结束，超时后取消剩余隧道。
+    同时活跃的隧道数受 max_tunnels 限制，超出的连接排队等待，等待超过
+    queue_timeout 返回 503；idle_timeout 秒内两个方向都没有数据的隧道会被关闭。
+    """
+
+    COUNTERS_INTERVAL = 10.0
+    METRICS_INTERVAL = 1.0
+    COMPACT_INTERVAL = 3600.0
+
+    def __init__(self, listen_port: int = 8080, db_path: Path = None, relay: str = 'protocol',
+                 dns_ttl: float = 300.0, pool_size: int = 0, prewarm: Optional[List[str]] = None,
+                 metrics_port: int = 0, reuse_port: bool = False, db=None,
+                 max_tunnels: int = 1024, queue_timeout: float = 30.0,
+                 idle_timeout: float = 600.0, drain_timeout: float = 10.0,
+                 retention_days: float = 0):
         self.listen_port = listen_port
-        self.db = StatsDatabase(db_path or Path.home() / '.claude' / 'proxy_stats.db')
-        self.running = False
+        self.retention_days = retention_days
+        self.max_tunnels = max_tunnels
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+        self.drain_timeout = drain_timeout
+        self.metrics_port = metrics_port
+        self.reuse_port = reuse_port
+        self.metrics = ProxyMetrics()
+        # db 可以是 StatsDatabase，也可以是多进程模式下的 QueueStatsSink
+        self.db = db or StatsDatabase(db_path or Path.home() / '.claude' / 'proxy_stats.db')
+        self.relay = create_relay(relay)
+        self.upstream = UpstreamPool(DNSCache(ttl=dns_ttl), size=pool_size)
+        self.prewarm = prewarm or []
+        self._stop_event: Optional[asyncio.Event] = None
+        self._tunnel_slots: Optional[asyncio.Semaphore] = None
+        self._clients: set = set()
+        self._tunnels: Dict[TunnelCounters, asyncio.Task] = {}
 
     async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """处理客户端连接"""
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            if self._tunnel_slots is None:
+                await self._handle_client(reader, writer)
+                return
+            try:
+                await asyncio.wait_for(self._tunnel_slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                # 背压：活跃隧道已满且排队超时
+                writer.write(b'HTTP/1.1 503 Service Unavailable\r\n\r\nToo many active tunnels')
+                await writer.drain()
+                writer.close()
+                return
+            try:
+                await self._handle_client(reader, writer)
+            finally:
+                self._tunnel_slots.release()
+        except asyncio.CancelledError:
+            # 空闲超时或停机时被取消，资源已在下层 finally 中释放
+            pass
+        except Exception as e:
+            logger.error(f"Error handling client: {e}")
+        finally:
+            self._clients.discard(task)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """解析 CONNECT 请求并建立隧道"""
         client_ip = writer.get_extra_info('peername')[0] if writer.get_extra_info('peername') else 'unknown'
         start_time = time.time()
 
@@ -136,53 +1122,35 @@ class TCPProxy:
                         target_port = int(target_port)
 
             if target_host and target_port:
-                # 记录连接
+                # 读完剩余的请求头，避免把它们转发给目标服务器
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+
                 record = ConnectionRecord(
-                    timestamp=datetime.now().isoformat(),
+                    timestamp=int(time.time()),
                     target_host=target_host,
                     target_port=target_port,
                     client_ip=client_ip,
                     connect_time=time.time() - start_time
                 )
-                self.db.record(record)
                 logger.info(f"Connect: {target_host}:{target_port}")
 
-                # 发送 200 Connection Established
-                writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
-                await writer.drain()
-
-                # 连接到目标服务器
+                # 隧道结束时再记录，带上字节数和存活时间
+                counters = TunnelCounters()
+                tunnel_start = time.monotonic()
+                self.metrics.tunnel_opened(target_host, counters)
+                self._tunnels[counters] = asyncio.current_task()
                 try:
-                    target_reader, target_writer = await asyncio.open_connection(
-                        target_host, target_port
-                    )
-
-                    # 双向转发数据
-                    async def forward(src, dst):
-                        try:
-                            while True:
-                                data = await src.read(4096)
-                                if not data:
-                                    break
-                                dst.write(data)
-                                await dst.drain()
-                        except (ConnectionResetError, BrokenPipeError):
-                            pass
-                        finally:
-                            try:
-                                dst.close()
-                                await dst.wait_closed()
-                            except:
-                                pass
-
-                    # 并行转发
-                    await asyncio.gather(
-                        forward(reader, target_reader),
-                        forward(target_reader, writer),
-                        return_exceptions=True
-                    )
-                except Exception as e:
-                    logger.error(f"Target connection failed: {e}")
+                    await self._tunnel(reader, writer, target_host, target_port, counters)
+                finally:
+                    del self._tunnels[counters]
+                    self.metrics.tunnel_closed(counters)
+                    record.bytes_up = counters.bytes_up
+                    record.bytes_down = counters.bytes_down
+                    record.duration = time.monotonic() - tunnel_start
+                    self.db.record(record)
             else:
                 # 不是 CONNECT 请求，返回错误
                 writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\nOnly CONNECT method supported')
@@ -197,25 +1165,343 @@ class TCPProxy:
             except:
                 pass
 
-    async def start(self):
-        """启动代理服务器"""
-        self.running = True
+    async def _tunnel(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                      target_host: str, target_port: int, counters: TunnelCounters):
+        """建立到目标的隧道并转发，直到两侧都关闭"""
+        # 发送 200 Connection Established
+        writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+        await writer.drain()
+
+        # 连接到目标服务器
+        try:
+            target_reader, target_writer = await self.upstream.acquire(target_host, target_port)
+        except Exception as e:
+            logger.error(f"Target connection failed: {e}")
+            return
+
+        # 双向转发数据
+        try:
+            await self.relay.relay(reader, writer, target_reader, target_writer, counters)
+        except Exception as e:
+            logger.error(f"Relay to {target_host}:{target_port} failed: {e}")
+        finally:
+            target_writer.close()
+
+    async def start(self, handle_signals: bool = True):
+        """启动代理服务器，直到 stop() 或收到 SIGINT/SIGTERM"""
+        loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if self.max_tunnels:
+            self._tunnel_slots = asyncio.Semaphore(self.max_tunnels)
         server = await asyncio.start_server(
             self.handle_client,
             '127.0.0.1',
-            self.listen_port
+            self.listen_port,
+            reuse_port=self.reuse_port or None,
+            start_serving=False
         )
 
         addr = server.sockets[0].getsockname()
         logger.info(f"Proxy listening on {addr[0]}:{addr[1]}")
         logger.info(f"Set environment: export HTTPS_PROXY=http://{addr[0]}:{addr[1]}")
 
-        async with server:
-            while self.running:
-                await asyncio.sleep(1)
+        signals = []
+        if handle_signals:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(signum, self.stop)
+                    signals.append(signum)
+                except (NotImplementedError, RuntimeError):
+                    # 非主线程或平台不支持
+                    pass
+
+        for target in self.prewarm:
+            host, _, port = target.rpartition(':')
+            self.upstream.warm(host, int(port))
+
+        background = [
+            asyncio.ensure_future(self._maintenance_loop()),
+            asyncio.ensure_future(self._sample_metrics_loop()),
+        ]
+        if self.idle_timeout:
+            background.append(asyncio.ensure_future(self._idle_sweeper()))
+        if self.retention_days:
+            background.append(asyncio.ensure_future(self._retention_loop()))
+        metrics_server = None
+        if self.metrics_port:
+            metrics_server = await asyncio.start_server(
+                self.handle_metrics, '127.0.0.1', self.metrics_port
+            )
+            logger.info(f"Metrics at http://127.0.0.1:{self.metrics_port}/metrics")
+
+        serving = asyncio.ensure_future(server.serve_forever())
+        try:
+            await self._stop_event.wait()
+        finally:
+            # 停止接受新连接（取消 serve_forever 会关闭监听 socket）
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+            for signum in signals:
+                loop.remove_signal_handler(signum)
+            if metrics_server is not None:
+                metrics_server.close()
+            await self._drain()
+            for task in background:
+                task.cancel()
+            await self.upstream.close()
+            self.db.save_counters(self.upstream.counters())
+            self.db.close()
+
+    async def _drain(self):
+        """等待进行中的连接结束，超过 drain_timeout 后取消"""
+        if not self._clients:
+            return
+        logger.info(f"Draining {len(self._clients)} connections (up to {self.drain_timeout:.0f}s)...")
+        _, pending = await asyncio.wait(set(self._clients), timeout=self.drain_timeout)
+        if pending:
+            logger.warning(f"Cancelling {len(pending)} connections still open after drain timeout")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _retention_loop(self):
+        """定期清理过期的原始记录（在线程池中执行，不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                result = await loop.run_in_executor(None, self.db.compact, self.retention_days)
+                if result['deleted']:
+                    logger.info(f"Pruned {result['deleted']} records older than "
+                                f"{self.retention_days:g} days, freed {format_bytes(result['freed_bytes'])}")
+            except sqlite3.Error as e:
+                logger.warning(f"Compaction failed: {e}")
+            await asyncio.sleep(self.COMPACT_INTERVAL)
+
+    async def _idle_sweeper(self):
+        """关闭两个方向都长时间没有数据的隧道（按字节计数是否变化判断，转发路径无额外开销）"""
+        seen: Dict[TunnelCounters, Tuple[int, float]] = {}
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 4))
+            now = time.monotonic()
+            for counters, task in list(self._tunnels.items()):
+                total = counters.bytes_up + counters.bytes_down
+                last = seen.get(counters)
+                if last is None or last[0] != total:
+                    seen[counters] = (total, now)
+                elif now - last[1] >= self.idle_timeout:
+                    logger.info(f"Closing tunnel idle for {now - last[1]:.0f}s")
+                    task.cancel()
+            seen = {c: v for c, v in seen.items() if c in self._tunnels}
+
+    async def _maintenance_loop(self):
+        """定期维护连接池，并把内存计数器快照写入数据库供 --stats 查看"""
+        while True:
+            await asyncio.sleep(self.COUNTERS_INTERVAL)
+            self.upstream.maintain()
+            self.db.save_counters(self.upstream.counters())
+
+    async def _sample_metrics_loop(self):
+        """每秒采样速率，顺便测量事件循环延迟（sleep 实际耗时超出的部分）"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.METRICS_INTERVAL)
+            self.metrics.sample(max(0.0, loop.time() - start - self.METRICS_INTERVAL))
+
+    async def handle_metrics(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """极简 HTTP 端点：GET /metrics 返回 Prometheus 文本格式"""
+        try:
+            request_line = await reader.readline()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body = self.metrics.render(self.upstream.counters()).encode()
+                status = b'200 OK'
+                content_type = b'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                body = b'Not Found\n'
+                status = b'404 Not Found'
+                content_type = b'text/plain'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: ' + content_type
+                         + b'\r\nContent-Length: ' + str(len(body)).encode()
+                         + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
 
     def stop(self):
-        self.running = False
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+
+class QueueStatsSink:
+    """worker 进程中的统计出口：记录和计数器经 multiprocessing 队列发给主进程的 writer
+
+    Queue.put 由后台 feeder 线程负责序列化和写管道，不会阻塞事件循环。
+    """
+
+    def __init__(self, stats_queue):
+        self.queue = stats_queue
+
+    def record(self, record: ConnectionRecord):
+        self.queue.put(record)
+
+    def save_counters(self, counters: dict):
+        self.queue.put(dict(counters))
+
+    def close(self):
+        # None 通知主进程该 worker 的数据已发送完毕
+        self.queue.put(None)
+        self.queue.close()
+        self.queue.join_thread()
+
+
+def _run_worker(listen_port: int, stats_queue, options: dict):
+    """worker 进程入口：SO_REUSEPORT 共享监听端口，收到 SIGTERM 后退出"""
+    # Ctrl-C 由主进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    proxy = TCPProxy(listen_port=listen_port, reuse_port=True,
+                     db=QueueStatsSink(stats_queue), **options)
+
+    async def run():
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, proxy.stop)
+        await proxy.start(handle_signals=False)
+
+    asyncio.run(run())
+
+
+class ProxySupervisor:
+    """多进程代理：N 个 worker 通过 SO_REUSEPORT 共享端口，统计数据由主进程单一 writer 写入
+
+    每个 worker 拥有自己的队列，主进程为每个队列开一个收集线程转交给 StatsDatabase。
+    """
+
+    def __init__(self, workers: int, listen_port: int = 8080, db_path: Path = None,
+                 shutdown_timeout: Optional[float] = None, **proxy_options):
+        self.workers = workers
+        self.listen_port = listen_port
+        self.db_path = db_path or Path.home() / '.claude' / 'proxy_stats.db'
+        # 给 worker 留出排空隧道的时间
+        self.shutdown_timeout = shutdown_timeout or proxy_options.get('drain_timeout', 10.0) + 5.0
+        # 多进程时由主进程统一清理，worker 不访问数据库
+        self.retention_days = proxy_options.pop('retention_days', 0)
+        self.proxy_options = proxy_options
+        self._stop = threading.Event()
+        self._counters: Dict[int, dict] = {}
+        self._counters_lock = threading.Lock()
+
+    def run(self):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+
+        ctx = multiprocessing.get_context('spawn')
+        db = StatsDatabase(self.db_path)
+        processes = []
+        queues = []
+        collectors = []
+
+        for index in range(self.workers):
+            stats_queue = ctx.Queue()
+            options = dict(self.proxy_options)
+            if options.get('metrics_port'):
+                # 每个 worker 单独一个指标端口
+                options['metrics_port'] += index
+            process = ctx.Process(target=_run_worker, name=f'proxy-worker-{index}',
+                                  args=(self.listen_port, stats_queue, options))
+            process.start()
+            collector = threading.Thread(target=self._collect, name=f'stats-collector-{index}',
+                                         args=(index, stats_queue, db), daemon=True)
+            collector.start()
+            processes.append(process)
+            queues.append(stats_queue)
+            collectors.append(collector)
+        logger.info(f"Started {self.workers} workers on 127.0.0.1:{self.listen_port}")
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self._stop.set())
+        if self.retention_days:
+            threading.Thread(target=self._compact_loop, args=(db,),
+                             name='stats-compactor', daemon=True).start()
+
+        try:
+            while not self._stop.wait(1):
+                if not any(p.is_alive() for p in processes):
+                    logger.error("All workers exited")
+                    break
+        finally:
+            logger.info("Stopping workers...")
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            deadline = time.monotonic() + self.shutdown_timeout
+            for process in processes:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    logger.warning(f"{process.name} did not exit in time, killing")
+                    process.kill()
+                    process.join()
+            # worker 被强杀时不会发送结束标记，由主进程补上
+            for stats_queue in queues:
+                stats_queue.put(None)
+            for collector in collectors:
+                collector.join()
+            db.close()
+
+    def _compact_loop(self, db: StatsDatabase):
+        while not self._stop.is_set():
+            try:
+                result = db.compact(self.retention_days)
+                if result['deleted']:
+                    logger.info(f"Pruned {result['deleted']} records older than "
+                                f"{self.retention_days:g} days, freed {format_bytes(result['freed_bytes'])}")
+            except sqlite3.Error as e:
+                logger.warning(f"Compaction failed: {e}")
+            self._stop.wait(TCPProxy.COMPACT_INTERVAL)
+
+    def _collect(self, index: int, stats_queue, db: StatsDatabase):
+        while True:
+            item = stats_queue.get()
+            if item is None:
+                break
+            if isinstance(item, dict):
+                # 计数器按 worker 保存最新快照，写入所有 worker 的合计
+                with self._counters_lock:
+                    self._counters[index] = item
+                    total = defaultdict(int)
+                    for counters in self._counters.values():
+                        for name, value in counters.items():
+                            total[name] += value
+                db.save_counters(total)
+            else:
+                db.record(item)
+
+
+def format_bytes(n: float) -> str:
+    """格式化字节数"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == 'B' else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def _db_size(db_path: Path) -> int:
+    """数据库文件及 WAL 的总大小"""
+    return sum(p.stat().st_size for p in (db_path, Path(f'{db_path}-wal')) if p.exists())
+
+
+def format_duration(seconds: float) -> str:
+    """格式化时长"""
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    return f"{seconds / 60:.1f}m"
 
 
 def print_stats(stats: dict, title: str = "Proxy Statistics"):
@@ -226,76 +1512,182 @@ def print_stats(stats: dict, title: str = "Proxy Statistics"):
 
     sorted_hosts = sorted(stats.items(), key=lambda x: x[1]['count'], reverse=True)
     total = sum(d['count'] for _, d in sorted_hosts)
+    total_up = sum(d.get('bytes_up', 0) for _, d in sorted_hosts)
+    total_down = sum(d.get('bytes_down', 0) for _, d in sorted_hosts)
 
     if HAS_RICH:
         console = Console()
         table = Table(title=title, show_header=True, header_style="bold cyan")
-        table.add_column("Target Host", style="green", width=50)
-        table.add_column("Requests", justify="right", style="yellow", width=12)
+        table.add_column("Target Host", style="green", width=36)
+        table.add_column("Requests", justify="right", style="yellow", width=9)
+        table.add_column("Up", justify="right", style="blue", width=9)
+        table.add_column("Down", justify="right", style="magenta", width=9)
+        table.add_column("Rate", justify="right", style="cyan", width=10)
+        table.add_column("p50", justify="right", width=7)
+        table.add_column("p95", justify="right", width=7)
+        table.add_column("p99", justify="right", width=7)
 
         for host, data in sorted_hosts:
-            table.add_row(host, f"{data['count']:,}")
+            table.add_row(
+                host,
+                f"{data['count']:,}",
+                format_bytes(data.get('bytes_up', 0)),
+                format_bytes(data.get('bytes_down', 0)),
+                f"{format_bytes(data.get('throughput', 0))}/s",
+                format_duration(data.get('p50', 0)),
+                format_duration(data.get('p95', 0)),
+                format_duration(data.get('p99', 0)),
+            )
 
-        table.add_row("[bold]TOTAL[/bold]", f"[bold]{total:,}[/bold]")
+        table.add_row(
+            "[bold]TOTAL[/bold]",
+            f"[bold]{total:,}[/bold]",
+            f"[bold]{format_bytes(total_up)}[/bold]",
+            f"[bold]{format_bytes(total_down)}[/bold]",
+            "", "", "", "",
+        )
         console.print(table)
     else:
-        print("=" * 65)
-        print(f"{'Target Host':<50} {'Requests':>12}")
-        print("=" * 65)
+        print("=" * 104)
+        print(f"{'Target Host':<36} {'Requests':>10} {'Up':>9} {'Down':>9} {'Rate':>11} "
+              f"{'p50':>7} {'p95':>7} {'p99':>7}")
+        print("=" * 104)
 
         for host, data in sorted_hosts:
-            print(f"{host:<50} {data['count']:>12,}")
+            print(f"{host:<36} {data['count']:>10,} {format_bytes(data.get('bytes_up', 0)):>9} "
+                  f"{format_bytes(data.get('bytes_down', 0)):>9} "
+                  f"{format_bytes(data.get('throughput', 0)) + '/s':>11} "
+                  f"{format_duration(data.get('p50', 0)):>7} {format_duration(data.get('p95', 0)):>7} "
+                  f"{format_duration(data.get('p99', 0)):>7}")
+
+        print("=" * 104)
+        print(f"{'TOTAL':<36} {total:>10,} {format_bytes(total_up):>9} {format_bytes(total_down):>9}")
+        print("=" * 104)
+
+
+def print_counters(counters: dict):
+    """打印运行中代理最近一次保存的计数器"""
+    if not counters:
+        return
+
+    def ratio(hits: int, misses: int) -> str:
+        total = hits + misses
+        return f"{hits:,} hits / {misses:,} misses ({hits / total:.0%})" if total else "n/a"
+
+    print(f"DNS cache:     {ratio(counters.get('dns_cache_hits', 0), counters.get('dns_cache_misses', 0))}")
+    print(f"Upstream pool: {ratio(counters.get('pool_hits', 0), counters.get('pool_misses', 0))}")
+
 
-        print("=" * 65)
-        print(f"{'TOTAL':<50} {total:>12,}")
-        print("=" * 65)
+def _model_stats(days: int) -> dict:
+    """扫描本地 session 日志得到模型统计（在子进程中运行）"""
+    from stats import APIStatsAnalyzer
+    return APIStatsAnalyzer().analyze(days=days)
+
+
+async def show_stats(db_path: Path, hours: int, include_models: bool = True):
+    """URL 统计和模型统计并行生成：SQLite 查询在线程中，日志扫描在子进程中"""
+    loop = asyncio.get_running_loop()
+    db = StatsDatabase(db_path)
+    days = hours // 24 if hours >= 24 else 1
+
+    model_future = None
+    pool = None
+    if include_models:
+        script_dir = str(Path(__file__).parent)
+        if script_dir not in sys.path:
+            sys.path.insert(0, script_dir)
+        pool = ProcessPoolExecutor(max_workers=1)
+        model_future = loop.run_in_executor(pool, _model_stats, days)
+
+    try:
+        stats, counters = await asyncio.gather(
+            loop.run_in_executor(None, db.get_stats, hours),
+            loop.run_in_executor(None, db.get_counters),
+        )
+        print_stats(stats, title=f"Proxy Statistics (Last {hours} hours)")
+        print_counters(counters)
+
+        if model_future is not None:
+            try:
+                from stats import print_stats_table
+                model_stats = await model_future
+            except Exception as e:
+                logger.warning(f"Model statistics unavailable: {type(e).__name__}: {e}")
+                return
+            if model_stats:
+                print()  # 空行分隔
+                print_stats_table(model_stats, title=f"Model Statistics (Last {days} days)")
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
 
 
 async def main():
     import argparse
-    import sys
 
     parser = argparse.ArgumentParser(description='API Stats TCP Proxy')
     parser.add_argument('--start', action='store_true', help='Start proxy server')
     parser.add_argument('--stats', action='store_true', help='Show statistics')
+    parser.add_argument('--compact', action='store_true',
+                        help='Reclaim free pages (and prune raw records past --retention-days)')
     parser.add_argument('--port', type=int, default=8080, help='Proxy port')
     parser.add_argument('--hours', type=int, default=24, help='Stats: last N hours')
     parser.add_argument('--url-only', action='store_true', help='Show URL stats only')
+    parser.add_argument('--relay', choices=sorted(RELAY_ENGINES), default='protocol',
+                        help='Tunnel relay engine')
+    parser.add_argument('--dns-ttl', type=float, default=300.0, help='DNS cache TTL in seconds')
+    parser.add_argument('--pool-size', type=int, default=0,
+                        help='Prewarmed upstream connections per hot target host (0 = off)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics on 127.0.0.1:PORT/metrics (0 = off)')
+    parser.add_argument('--max-tunnels', type=int, default=1024,
+                        help='Max concurrently active tunnels; extra connections wait (0 = unlimited)')
+    parser.add_argument('--idle-timeout', type=float, default=600.0,
+                        help='Close tunnels with no traffic for N seconds (0 = never)')
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help='On shutdown, wait up to N seconds for open tunnels')
+    parser.add_argument('--retention-days', type=float, default=None,
+                        help='Prune raw connection records older than N days; hourly rollups are kept '
+                             'forever (default: keep everything)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Run N worker processes sharing the port via SO_REUSEPORT')
+    parser.add_argument('--prewarm', action='append', default=[], metavar='HOST:PORT',
+                        help='Target to keep prewarmed from startup (repeatable)')
 
     args = parser.parse_args()
 
     db_path = Path.home() / '.claude' / 'proxy_stats.db'
 
     if args.stats:
-        # 显示 URL 统计
-        db = StatsDatabase(db_path)
-        stats = db.get_stats(since_hours=args.hours)
-        title = f"Proxy Statistics (Last {args.hours} hours)"
-        print_stats(stats, title=title)
+        await show_stats(db_path, args.hours, include_models=not args.url_only)
 
-        # 合并显示模型统计
-        if not args.url_only:
-            try:
-                # 导入 stats 模块
-                script_dir = Path(__file__).parent
-                if str(script_dir) not in sys.path:
-                    sys.path.insert(0, str(script_dir))
-
-                from stats import APIStatsAnalyzer, print_stats_table, format_number, format_tokens
-
-                # 分析本地日志
-                analyzer = APIStatsAnalyzer()
-                model_stats = analyzer.analyze(days=args.hours // 24 if args.hours >= 24 else 1)
-
-                if model_stats:
-                    print()  # 空行分隔
-                    model_title = f"Model Statistics (Last {args.hours // 24 if args.hours >= 24 else 1} days)"
-                    print_stats_table(model_stats, title=model_title)
-            except Exception as e:
-                pass  # 静默失败，不影响 URL 统计
+    elif args.compact:
+        db = StatsDatabase(db_path)
+        size_before = _db_size(db_path)
+        try:
+            if db.enable_incremental_vacuum():
+                print("Converted database to incremental auto-vacuum")
+        except RuntimeError as e:
+            print(f"Skipping full VACUUM: {e}", file=sys.stderr)
+        # 代理可能在运行：使用默认批次，批次之间让出写锁；未指定保留期时只回收空闲页
+        result = db.compact(args.retention_days)
+        if args.retention_days:
+            print(f"Pruned {result['deleted']:,} records older than {args.retention_days:g} days")
+        print(f"Reclaimed {format_bytes(result['freed_bytes'])} of free pages")
+        db.checkpoint()
+        print(f"Database size: {format_bytes(size_before)} -> {format_bytes(_db_size(db_path))}")
 
     elif args.start:
-        proxy = TCPProxy(listen_port=args.port, db_path=db_path)
+        options = dict(relay=args.relay, dns_ttl=args.dns_ttl, pool_size=args.pool_size,
+                       prewarm=args.prewarm, metrics_port=args.metrics_port,
+                       max_tunnels=args.max_tunnels, idle_timeout=args.idle_timeout,
+                       drain_timeout=args.drain_timeout, retention_days=args.retention_days or 0)
+        if args.workers > 1:
+            # 主进程只负责管理 worker 和写数据库，阻塞直到退出
+            ProxySupervisor(args.workers, listen_port=args.port, db_path=db_path, **options).run()
+            return
+
+        proxy = TCPProxy(listen_port=args.port, db_path=db_path, **options)
         try:
             await proxy.start()
         except KeyboardInterrupt:
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+session 目录变更监听
+供 stats.py --watch 使用：报告 ~/.claude/projects 下被追加、新建或删除的 *.jsonl 文件。
+
+- Linux 下通过 ctypes 调用 inotify，空闲时阻塞在 select 上，不占 CPU
+- 其他平台，或 inotify 不可用（watch 数量超出 max_user_watches 等）时回退到定期 stat 轮询，
+  没有变化时轮询间隔逐步加倍
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+SUFFIX = '.jsonl'
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    """返回支持 inotify 的 libc，不支持时返回 None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    """递归监听目录树的 inotify 封装
+
+    wait() 返回变化的 *.jsonl 路径集合；事件队列溢出时返回 None，调用方需要全量重新同步。
+    新建的子目录会自动加入监听。
+    """
+
+    kind = 'inotify'
+
+    def __init__(self, root: Path):
+        self.libc = _load_libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.root = root
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, Path] = {}
+        try:
+            self._watch_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory: Path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch {directory}: {os.strerror(err)}")
+        self._dirs[wd] = directory
+
+    def _watch_tree(self, root: Path, found: Optional[Set[Path]] = None):
+        """监听 root 及其所有子目录；found 不为 None 时收集其中已有的 session 文件"""
+        self._add_watch(root)
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in dirnames:
+                try:
+                    self._add_watch(Path(dirpath) / name)
+                except FileNotFoundError:
+                    continue
+            if found is not None:
+                found.update(Path(dirpath) / name for name in filenames if name.endswith(SUFFIX))
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Set[Path]]:
+        """阻塞到有事件或超时（None 表示一直等），返回变化的 session 文件"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        changed: Set[Path] = set()
+        if not ready:
+            return changed
+        overflow = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buf, pos)
+                pos += EVENT_HEADER.size
+                name = buf[pos:pos + length].rstrip(b'\0')
+                pos += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                directory = self._dirs.get(wd)
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                if directory is None or not name:
+                    continue
+                path = directory / os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # 新目录里可能在加入监听前就已经写入了文件
+                        try:
+                            self._watch_tree(path, changed)
+                        except OSError:
+                            overflow = True
+                    continue
+                if path.suffix == SUFFIX:
+                    changed.add(path)
+        return None if overflow else changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """定期 stat 目录树，比较 (inode, size, mtime)
+
+    没有变化时轮询间隔从 interval 逐步加倍到 max_interval，发现变化后恢复。
+    """
+
+    kind = 'polling'
+
+    def __init__(self, root: Path, interval: float = 2.0, max_interval: float = 16.0):
+        self.root = root
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self._delay = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[Path, Tuple[int, int, int]]:
+        snapshot = {}
+        stack = [self.root]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith(SUFFIX):
+                            st = entry.stat()
+                            snapshot[Path(entry.path)] = (st.st_ino, st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        return snapshot
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Set[Path]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self._delay
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+            snapshot = self._scan()
+            old = self._snapshot
+            self._snapshot = snapshot
+            changed = {path for path, key in snapshot.items() if old.get(path) != key}
+            changed.update(path for path in old if path not in snapshot)
+            if changed:
+                self._delay = self.interval
+                return changed
+            self._delay = min(self._delay * 2, self.max_interval)
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(root: Path, poll_interval: float = 2.0):
+    """优先使用 inotify，不可用时回退到轮询"""
+    try:
+        return InotifyWatcher(root)
+    except OSError:
+        return PollingWatcher(root, poll_interval)
@@ -5,27 +5,728 @@ Claude Code API Usage Statistics Tool
 """
 
 import json
+import os
+import sqlite3
 import sys
+import time
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from collections import defaultdict
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial as partial_func
+from itertools import chain, count as count_from, islice
+from operator import itemgetter
+
+from pricing import COST_UNIT, get_price_table
 
 # 尝试使用 rich 库，如果不可用则使用简单表格
 try:
     from rich.console import Console
+    from rich.live import Live
     from rich.table import Table
     from rich import print as rprint
     HAS_RICH = True
 except ImportError:
     HAS_RICH = False
 
+# 可选的快速 JSON 后端：orjson > msgspec > 标准库
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+    JSON_ERRORS = (ValueError,)
+except ImportError:
+    try:
+        import msgspec
+        json_loads = msgspec.json.Decoder().decode
+        JSON_BACKEND = 'msgspec'
+        JSON_ERRORS = (ValueError, msgspec.DecodeError)
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = 'json'
+        JSON_ERRORS = (ValueError,)
+
+# 可选的 NumPy 向量化聚合后端
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_creation_tokens')
+# 逐条记录计算并累加的费用和缓存节省（nano-USD，见 pricing.py）
+COST_FIELDS = ('cost', 'savings')
+COUNTER_FIELDS = USAGE_FIELDS + COST_FIELDS
+
+# 单次聚合的记录数超过该值后，剩余记录交给 NumPy 后端（需要安装 numpy）
+VECTOR_THRESHOLD = 200_000
+VECTOR_CHUNK = 1 << 16
+
+
+class UsageRecord(NamedTuple):
+    """单条 API 使用记录（紧凑元组）"""
+    model: str
+    timestamp: Optional[str]
+    input_tokens: int
+    output_tokens: int
+    cache_read_tokens: int
+    cache_creation_tokens: int
+    session_id: Optional[str] = None
+
+
+class SessionFileReader:
+    """流式读取 session 文件，逐条产出 UsageRecord
+
+    从指定字节偏移开始读取，迭代过程中 offset 随之推进。
+    末尾未写完的半行不计入偏移，下次从该处继续。
+
+    prefilter 模式下先在字节层面检查，不含 "usage" 或 "assistant" 的行
+    直接跳过，不做 JSON 解析（大部分行都是这种）。
+    """
+
+    def __init__(self, file_path: Path, offset: int = 0, prefilter: bool = True):
+        self.file_path = file_path
+        self.offset = offset
+        self.prefilter = prefilter
+
+    def __iter__(self) -> Iterator[UsageRecord]:
+        prefilter = self.prefilter
+        try:
+            with open(self.file_path, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    # 半行可能还没写完，不能按前缀过滤
+                    if prefilter and line.endswith(b'\n') and (
+                            b'"usage"' not in line or b'"assistant"' not in line):
+                        self.offset += len(line)
+                        continue
+                    try:
+                        data = json_loads(line)
+                    except JSON_ERRORS:
+                        if not line.endswith(b'\n'):
+                            # 文件正在被写入，留到下次再解析
+                            break
+                        self.offset += len(line)
+                        continue
+                    self.offset += len(line)
+                    if not isinstance(data, dict):
+                        continue
+                    if data.get('type') == 'assistant' and data.get('message', {}).get('usage'):
+                        usage = data['message']['usage']
+                        # 只统计有实际 token 消耗的请求
+                        if usage.get('input_tokens', 0) > 0:
+                            yield UsageRecord(
+                                data['message'].get('model', 'unknown'),
+                                data.get('timestamp'),
+                                usage.get('input_tokens', 0),
+                                usage.get('output_tokens', 0),
+                                usage.get('cache_read_input_tokens', 0),
+                                usage.get('cache_creation_input_tokens', 0),
+                                data.get('sessionId'),
+                            )
+        except Exception as e:
+            print(f"Error reading {self.file_path}: {e}", file=sys.stderr)
+
+
+class UsageIndex:
+    """session 文件增量索引（SQLite sidecar）
+
+    记录每个文件的 inode/size/mtime 和已解析的字节偏移，以及已提取用量的
+    按 (模型, 小时) 汇总表，之后的运行只解析新文件和追加的字节，
+    按时间范围的查询直接读汇总表。
+
+    汇总表中的费用按建立索引时的价格表逐条计算，价格表变化后整个索引重建。
+
+    另外缓存 projects 目录树的列表（每个目录的 mtime、*.jsonl 文件名和子目录名），
+    目录 mtime 不变时直接使用缓存，不再 scandir。
+    """
+
+    # mtime 距列出时间小于该值（纳秒）的目录不缓存：同一时钟粒度内随后新建的文件不会改变 mtime
+    RACY_DIR_NS = 2_000_000_000
+
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        c = self.conn
+        c.execute('PRAGMA journal_mode=WAL')
+        c.execute('PRAGMA synchronous=NORMAL')
+        version = c.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            # 旧版本索引没有小时粒度或费用，直接重建
+            c.execute('DROP TABLE IF EXISTS usage')
+            c.execute('DROP TABLE IF EXISTS rollups')
+            c.execute('DROP TABLE IF EXISTS files')
+            c.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                offset INTEGER NOT NULL
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS rollups (
+                path TEXT NOT NULL,
+                model TEXT NOT NULL,
+                hour TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                cache_read_tokens INTEGER NOT NULL,
+                cache_creation_tokens INTEGER NOT NULL,
+                cost INTEGER NOT NULL,
+                savings INTEGER NOT NULL,
+                PRIMARY KEY (path, model, hour)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_rollups_hour ON rollups(hour)')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                files TEXT NOT NULL,
+                subdirs TEXT NOT NULL
+            )
+        ''')
+        prices = get_price_table().fingerprint
+        row = c.execute("SELECT value FROM meta WHERE key = 'prices'").fetchone()
+        if row is None or row[0] != prices:
+            # 费用是逐条记录计算的，价格变化后只能重新解析
+            c.execute('DELETE FROM rollups')
+            c.execute('DELETE FROM files')
+            c.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('prices', ?)", (prices,))
+        c.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def list_session_files(self, root: Path) -> List[str]:
+        """列出 root 下所有 *.jsonl 文件的路径（与 rglob 相同），目录未变化时使用缓存的列表
+
+        新建、删除、重命名文件会改变所在目录的 mtime；向已有文件追加内容不会，
+        由 sync 按文件 stat 检测。返回字符串路径，避免为每个文件构造 Path。
+        """
+        c = self.conn
+        cached = {row[0]: row[1:] for row in c.execute('SELECT path, mtime_ns, files, subdirs FROM dirs')}
+        racy_before = time.time_ns() - self.RACY_DIR_NS
+        result = []
+        seen = set()
+        updates = []
+        stack = [str(root)]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(directory)
+            entry = cached.get(directory)
+            if entry is not None and entry[0] == mtime_ns:
+                # 文件名不会包含 NUL，用它分隔
+                files = entry[1].split('\0') if entry[1] else []
+                subdirs = entry[2].split('\0') if entry[2] else []
+            else:
+                files, subdirs = [], []
+                try:
+                    with os.scandir(directory) as entries:
+                        for item in entries:
+                            try:
+                                if item.is_dir(follow_symlinks=False):
+                                    subdirs.append(item.name)
+                                elif item.name.endswith('.jsonl'):
+                                    files.append(item.name)
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+                updates.append((directory, mtime_ns if mtime_ns < racy_before else -1,
+                                '\0'.join(files), '\0'.join(subdirs)))
+            prefix = directory + os.sep
+            result.extend(prefix + name for name in files)
+            stack.extend(prefix + name for name in subdirs)
+
+        if updates:
+            c.executemany('INSERT OR REPLACE INTO dirs (path, mtime_ns, files, subdirs) VALUES (?, ?, ?, ?)',
+                          updates)
+        stale = [(path,) for path in cached if path not in seen]
+        if stale:
+            c.executemany('DELETE FROM dirs WHERE path = ?', stale)
+        c.commit()
+        return result
+
+    def sync(self, files: Iterable, jobs: int = 1, prefilter: bool = True) -> Tuple[int, int]:
+        """同步索引（files 为 Path 或字符串路径），返回 (重新解析的文件数, 新提取的记录数)
+
+        解析不持有写锁；结果在一个写事务中写入，写入前重新读取每个文件的索引记录，
+        已被并发运行的另一个 sync 更新过的文件跳过，同一段追加内容不会被累加两次。
+        """
+        c = self.conn
+        known = {row[0]: row[1:] for row in
+                 c.execute('SELECT path, inode, size, mtime, offset FROM files')}
+        tasks = []
+        pending = {}
+
+        for file_path in files:
+            key = str(file_path)
+            try:
+                st = os.stat(key)
+            except OSError:
+                continue
+            entry = known.pop(key, None)
+            offset = 0
+            reset = False
+            if entry is not None:
+                inode, size, mtime, offset = entry
+                if inode == st.st_ino and size == st.st_size and mtime == st.st_mtime:
+                    continue
+                if inode != st.st_ino or st.st_size < offset:
+                    # 文件被替换或截断，丢弃旧数据重新解析
+                    reset = True
+                    offset = 0
+            tasks.append((key, offset))
+            pending[key] = (entry, st, reset)
+
+        results = list(scan_session_files(tasks, jobs, prefilter))
+
+        new_records = 0
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            for key, offset, partial in results:
+                entry, st, reset = pending[key]
+                current = c.execute('SELECT inode, size, mtime, offset FROM files WHERE path = ?',
+                                    (key,)).fetchone()
+                if current != entry:
+                    # 解析期间另一个 sync 已经写入了这个文件
+                    continue
+                if reset:
+                    c.execute('DELETE FROM rollups WHERE path = ?', (key,))
+                new_records += sum(data['count'] for data in partial.values())
+                if partial:
+                    c.executemany('''
+                        INSERT INTO rollups (path, model, hour, count, input_tokens, output_tokens,
+                                             cache_read_tokens, cache_creation_tokens, cost, savings)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(path, model, hour) DO UPDATE SET
+                            count = count + excluded.count,
+                            input_tokens = input_tokens + excluded.input_tokens,
+                            output_tokens = output_tokens + excluded.output_tokens,
+                            cache_read_tokens = cache_read_tokens + excluded.cache_read_tokens,
+                            cache_creation_tokens = cache_creation_tokens + excluded.cache_creation_tokens,
+                            cost = cost + excluded.cost,
+                            savings = savings + excluded.savings
+                    ''', [(key, model, hour, data['count'], *(data[k] for k in COUNTER_FIELDS))
+                          for (model, hour), data in partial.items()])
+                c.execute('''
+                    INSERT OR REPLACE INTO files (path, inode, size, mtime, offset)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (key, st.st_ino, st.st_size, st.st_mtime, offset))
+
+            # 已删除的 session 文件
+            for key in known:
+                c.execute('DELETE FROM rollups WHERE path = ?', (key,))
+                c.execute('DELETE FROM files WHERE path = ?', (key,))
+            c.commit()
+        except BaseException:
+            c.rollback()
+            raise
+        return len(tasks), new_records
+
+    def aggregate(self, since_hour: str = '') -> Dict:
+        """从汇总表按模型统计"""
+        rows = self.conn.execute('''
+            SELECT model, SUM(count), SUM(input_tokens), SUM(output_tokens),
+                   SUM(cache_read_tokens), SUM(cache_creation_tokens), SUM(cost), SUM(savings)
+            FROM rollups
+            WHERE hour >= ?
+            GROUP BY model
+            ORDER BY MIN(rowid)
+        ''', (since_hour,))
+        return {
+            row[0]: dict(zip(('count',) + COUNTER_FIELDS, row[1:]))
+            for row in rows
+        }
+
+    def offsets(self) -> Dict[str, Tuple[int, int]]:
+        """每个已索引文件的 (inode, 已解析偏移)"""
+        return {row[0]: (row[1], row[2]) for row in
+                self.conn.execute('SELECT path, inode, offset FROM files')}
+
+    def hourly(self, since_hour: str = '') -> Dict:
+        """从汇总表读取 (模型, 小时) 粒度的数据"""
+        rows = self.conn.execute('''
+            SELECT model, hour, SUM(count), SUM(input_tokens), SUM(output_tokens),
+                   SUM(cache_read_tokens), SUM(cache_creation_tokens), SUM(cost), SUM(savings)
+            FROM rollups
+            WHERE hour >= ?
+            GROUP BY model, hour
+            ORDER BY MIN(rowid)
+        ''', (since_hour,))
+        return {
+            (row[0], row[1]): dict(zip(('count',) + COUNTER_FIELDS, row[2:]))
+            for row in rows
+        }
+
+    def file_hourly(self, since_hour: str = '') -> Iterator[Tuple[str, Dict]]:
+        """逐个文件产出 (路径, {(模型, 小时): counters})"""
+        rows = self.conn.execute('''
+            SELECT path, model, hour, count, input_tokens, output_tokens,
+                   cache_read_tokens, cache_creation_tokens, cost, savings
+            FROM rollups
+            WHERE hour >= ?
+            ORDER BY path
+        ''', (since_hour,))
+        path, hourly = None, {}
+        for row in rows:
+            if row[0] != path:
+                if hourly:
+                    yield path, hourly
+                path, hourly = row[0], {}
+            hourly[(row[1], row[2])] = dict(zip(('count',) + COUNTER_FIELDS, row[3:]))
+        if hourly:
+            yield path, hourly
+
+
+def _new_counters() -> Dict:
+    return {
+        'count': 0,
+        'input_tokens': 0,
+        'output_tokens': 0,
+        'cache_read_tokens': 0,
+        'cache_creation_tokens': 0,
+        'cost': 0,
+        'savings': 0,
+    }
+
+
+def since_hour_for_days(days: Optional[int]) -> str:
+    """N 天前所在的 UTC 小时（与记录的小时桶格式相同），用于记录级时间过滤"""
+    if not days:
+        return ''
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    return since.strftime('%Y-%m-%dT%H')
+
+
+def aggregate_hourly(records: Iterable[UsageRecord], backend: str = 'auto') -> Dict:
+    """按 (模型, UTC 小时) 聚合记录（流式折叠，不保留记录本身）
+
+    小时取自记录 timestamp 的前 13 个字符（YYYY-MM-DDTHH），没有时间戳的记录归入 ''。
+    backend: 'dict' 逐条累加；'numpy' 按列分块归约；'auto' 先逐条累加，
+    超过 VECTOR_THRESHOLD 条且安装了 numpy 时剩余部分切换到 NumPy。
+    """
+    if backend == 'numpy':
+        return ColumnarAggregator().add_records(records).hourly()
+
+    stats = defaultdict(_new_counters)
+    vectorize = backend == 'auto' and HAS_NUMPY
+    records = iter(records)
+    prices = get_price_table()
+    tiers = {}
+
+    for n, record in enumerate(records, 1):
+        model, timestamp, input_tokens, output_tokens, cache_read, cache_creation = record[:6]
+        data = stats[(model, timestamp[:13] if timestamp else '')]
+        data['count'] += 1
+        data['input_tokens'] += input_tokens
+        data['output_tokens'] += output_tokens
+        data['cache_read_tokens'] += cache_read
+        data['cache_creation_tokens'] += cache_creation
+        # 逐条计费（见 PriceTable.cost_terms），费率按模型缓存在局部字典中
+        tier = tiers.get(model)
+        if tier is None:
+            tier = tiers[model] = prices.cost_terms(model)
+        base, threshold, long_context = tier
+        p_in, p_out, p_read, p_write, s_read, s_write = (
+            long_context if threshold and input_tokens + cache_read + cache_creation > threshold else base)
+        data['cost'] += (input_tokens * p_in + output_tokens * p_out +
+                         cache_read * p_read + cache_creation * p_write)
+        data['savings'] += cache_read * s_read - cache_creation * s_write
+        if vectorize and n >= VECTOR_THRESHOLD:
+            return merge_stats(dict(stats), ColumnarAggregator().add_records(records).hourly())
+
+    return dict(stats)
+
+
+def token_percentiles(records: Iterable[UsageRecord], backend: str = 'auto',
+                      percentiles: Tuple[int, ...] = (50, 95, 99)) -> Dict:
+    """每个模型单次请求总 token 数（输入 + 输出 + 缓存读写）的分位数（最近秩法）
+
+    返回 {model: {'p50': ..., 'p95': ..., 'p99': ...}}；backend 同 aggregate_hourly。
+    两种后端都要保留每条记录的总数，'auto' 先读入 VECTOR_THRESHOLD 条判断规模。
+    """
+    if backend == 'auto' and HAS_NUMPY:
+        records = iter(records)
+        head = list(islice(records, VECTOR_THRESHOLD))
+        backend = 'numpy' if len(head) == VECTOR_THRESHOLD else 'dict'
+        records = chain(head, records)
+    if backend == 'numpy':
+        aggregator = ColumnarAggregator(keep_totals=True, group=False)
+        return aggregator.add_records(records).percentiles(percentiles)
+
+    totals = defaultdict(list)
+    for record in records:
+        totals[record.model].append(record.input_tokens + record.output_tokens +
+                                    record.cache_read_tokens + record.cache_creation_tokens)
+    result = {}
+    for model, values in totals.items():
+        values.sort()
+        result[model] = {
+            f'p{p}': values[max(1, -(-p * len(values) // 100)) - 1] for p in percentiles
+        }
+    return result
+
+
+class ColumnarAggregator:
+    """NumPy 分组归约后端
+
+    记录按 VECTOR_CHUNK 条一块转换为列（模型编码、小时编码、四列 token），
+    按模型费率向量化计算每条记录的费用和缓存节省，
+    每块按 (模型, 小时) 分组求和后只保留归约结果，内存与分组数而不是记录数成正比。
+    keep_totals 时额外保留每条记录的 (模型编码, 总 token) 用于计算分位数；
+    只需要分位数时 group=False 跳过分组归约。
+    也可以通过 add_columns 直接接收已经是列式的数据（例如 --export 的导出文件）。
+    """
+
+    def __init__(self, keep_totals: bool = False, group: bool = True):
+        self.keep_totals = keep_totals
+        self.group = group
+        self._model_codes = defaultdict(count_from().__next__)
+        self._hour_codes = defaultdict(count_from().__next__)
+        self._groups = []
+        self._totals = []
+        # 按模型编码排列的费率 (模型, 档位, 4) 和长上下文阈值，出现新模型时重建
+        self._rates = np.zeros((0, 2, 4), dtype=np.int64)
+        self._thresholds = np.zeros(0, dtype=np.int64)
+
+    def add_records(self, records: Iterable[UsageRecord]) -> 'ColumnarAggregator':
+        records = iter(records)
+        while True:
+            batch = list(islice(records, VECTOR_CHUNK))
+            if not batch:
+                return self
+            size = len(batch)
+            models = np.fromiter(map(self._model_codes.__getitem__, map(itemgetter(0), batch)),
+                                 dtype=np.int64, count=size)
+            tokens = np.stack([np.fromiter(map(itemgetter(i), batch), dtype=np.int64, count=size)
+                               for i in range(2, 6)])
+            hours = None
+            if self.group:
+                timestamps = list(map(itemgetter(1), batch))
+                if None in timestamps:
+                    timestamps = [t or '' for t in timestamps]
+                try:
+                    # 定长字节串在构造时即截断为 YYYY-MM-DDTHH
+                    labels = np.array(timestamps, dtype='S13')
+                except UnicodeEncodeError:
+                    labels = np.array([t[:13] for t in timestamps], dtype=object)
+                # 日志按时间顺序写入，相邻记录大多同一小时：按连续段编码，不需要排序
+                change = np.empty(size, dtype=bool)
+                change[0] = True
+                np.not_equal(labels[1:], labels[:-1], out=change[1:])
+                starts = np.flatnonzero(change)
+                runs = [h.decode() if isinstance(h, bytes) else h for h in labels[starts].tolist()]
+                hours = np.repeat(self._hour_index(runs), np.diff(np.append(starts, size)))
+            self._add(models, hours, tokens)
+
+    def add_columns(self, model_names: List[str], model_codes, timestamps_ms, tokens) -> 'ColumnarAggregator':
+        """直接添加列式数据（--export 的导出格式）
+
+        model_codes 索引 model_names；timestamps_ms 为 Unix 毫秒（0 表示未知）；tokens 形状 (4, n)。
+        """
+        remap = np.array([self._model_codes[name] for name in model_names], dtype=np.int64)
+        hours = np.asarray(timestamps_ms, dtype=np.int64) // 3_600_000
+        if len(hours):
+            # 小时是连续的小整数区间，用 bincount 找出出现过的小时，避免对全部记录排序
+            first = int(hours.min())
+            offsets = hours - first
+            present = np.flatnonzero(np.bincount(offsets))
+            labels = np.datetime_as_string((present + first).astype('datetime64[h]'), unit='h').tolist()
+            labels = ['' if hour == 0 else label
+                      for hour, label in zip((present + first).tolist(), labels)]
+            lookup = np.zeros(int(present[-1]) + 1, dtype=np.int64)
+            lookup[present] = self._hour_index(labels)
+            hours = lookup[offsets]
+        self._add(remap[np.asarray(model_codes, dtype=np.int64)], hours,
+                  np.asarray(tokens, dtype=np.int64))
+        return self
+
+    def _hour_index(self, labels: List[str]):
+        """小时标签 -> 全局小时编码"""
+        return np.fromiter(map(self._hour_codes.__getitem__, labels), dtype=np.int64, count=len(labels))
+
+    def _costs(self, models, tokens):
+        """每条记录的 (费用, 缓存节省)，与 aggregate_hourly 逐条累加的结果相同"""
+        if len(self._thresholds) != len(self._model_codes):
+            tiers = [get_price_table().tiers(name) for name in self._model_codes]
+            self._rates = np.array([(base, long) for base, _, long in tiers],
+                                   dtype=np.int64).reshape(-1, 2, 4)
+            self._thresholds = np.array([threshold for _, threshold, _ in tiers], dtype=np.int64)
+        threshold = self._thresholds[models]
+        prompt = tokens[0] + tokens[2] + tokens[3]
+        tier = ((threshold > 0) & (prompt > threshold)).astype(np.intp)
+        rates = self._rates[models, tier].T
+        cost = (rates * tokens).sum(axis=0)
+        savings = tokens[2] * (rates[0] - rates[2]) - tokens[3] * (rates[3] - rates[0])
+        return cost, savings
+
+    def _add(self, models, hours, tokens):
+        if self.group and len(models):
+            tokens = np.vstack([tokens, *self._costs(models, tokens)])
+            # 模型和小时编码都是稠密的小整数，组合成稠密下标后直接 bincount，不需要排序
+            width = len(self._hour_codes)
+            index = models * width + hours
+            counts = np.bincount(index)
+            present = np.flatnonzero(counts)
+            # bincount 以 float64 累加，单组 token 总数和费用（nano-USD）低于 2**53 时结果精确
+            sums = np.stack([np.bincount(index, weights=column)[present] for column in tokens])
+            keys = ((present // width) << 32) | (present % width)
+            self._groups.append((keys, counts[present], sums.astype(np.int64)))
+        if self.keep_totals:
+            self._totals.append((models, tokens[:4].sum(axis=0)))
+
+    def hourly(self) -> Dict:
+        """与 aggregate_hourly 相同结构的 {(model, hour): counters}"""
+        if not self._groups:
+            return {}
+        # 各块的归约结果再合并一次（分组数远小于记录数）
+        keys, inverse = np.unique(np.concatenate([g[0] for g in self._groups]), return_inverse=True)
+        size = len(keys)
+        counts = np.bincount(inverse, weights=np.concatenate([g[1] for g in self._groups]),
+                             minlength=size).astype(np.int64)
+        partial = np.concatenate([g[2] for g in self._groups], axis=1)
+        sums = np.stack([np.bincount(inverse, weights=column, minlength=size)
+                         for column in partial]).astype(np.int64)
+        models = list(self._model_codes)
+        hours = list(self._hour_codes)
+        result = {}
+        for i, key in enumerate(keys.tolist()):
+            data = {'count': int(counts[i])}
+            data.update(zip(COUNTER_FIELDS, sums[:, i].tolist()))
+            result[(models[key >> 32], hours[key & 0xFFFFFFFF])] = data
+        return result
+
+    def percentiles(self, percentiles: Tuple[int, ...] = (50, 95, 99)) -> Dict:
+        """每个模型单次请求总 token 的分位数（最近秩法）"""
+        if not self._totals:
+            return {}
+        models = np.concatenate([t[0] for t in self._totals])
+        totals = np.concatenate([t[1] for t in self._totals])
+        result = {}
+        for code, name in enumerate(self._model_codes):
+            values = totals[models == code]
+            n = len(values)
+            if not n:
+                continue
+            # 只需要几个秩上的值，np.partition 是 O(n)，不必整体排序
+            ranks = [max(1, -(-p * n // 100)) - 1 for p in percentiles]
+            values = np.partition(values, ranks)
+            result[name] = {f'p{p}': int(values[rank]) for p, rank in zip(percentiles, ranks)}
+        return result
+
+
+def aggregate_records(records: Iterable[UsageRecord], since_hour: str = '') -> Dict:
+    """按模型聚合记录，可按记录时间过滤"""
+    return rollup_hourly(aggregate_hourly(records), since_hour=since_hour)
+
+
+def _local_period(hour: str, bucket: str) -> str:
+    """把 UTC 小时桶转换为本地时间的小时/天标签"""
+    if not hour:
+        return 'unknown'
+    local = datetime.strptime(hour, '%Y-%m-%dT%H').replace(tzinfo=timezone.utc).astimezone()
+    return local.strftime('%Y-%m-%d %H:00' if bucket == 'hour' else '%Y-%m-%d')
+
+
+def rollup_hourly(hourly: Dict, bucket: Optional[str] = None, since_hour: str = '') -> Dict:
+    """把 (模型, 小时) 汇总折叠为按模型统计，或按本地小时/天的时间序列
+
+    bucket 为 None 时返回 {model: counters}，
+    为 'hour' / 'day' 时返回 {period: {model: counters}}，period 按时间排序。
+    """
+    stats = {}
+    periods = {}
+    for (model, hour), data in hourly.items():
+        if since_hour and hour < since_hour:
+            continue
+        if bucket:
+            period = periods.get(hour)
+            if period is None:
+                period = periods[hour] = _local_period(hour, bucket)
+            target = stats.setdefault(period, {})
+        else:
+            target = stats
+        total = target.get(model)
+        if total is None:
+            target[model] = dict(data)
+        else:
+            for key, value in data.items():
+                total[key] += value
+
+    if bucket:
+        return dict(sorted(stats.items()))
+    return stats
+
+
+def merge_stats(stats: Dict, partial: Dict) -> Dict:
+    """把部分聚合结果合并进 stats（原地修改）"""
+    for key, data in partial.items():
+        total = stats.get(key)
+        if total is None:
+            stats[key] = dict(data)
+        else:
+            for field, value in data.items():
+                total[field] += value
+    return stats
+
+
+def _scan_task(task: Tuple[str, int], prefilter: bool = True) -> Tuple[str, int, Dict]:
+    """解析任务（可在子进程中运行），只返回按 (模型, 小时) 的部分聚合，不回传原始记录"""
+    path, offset = task
+    reader = SessionFileReader(Path(path), offset, prefilter=prefilter)
+    partial = aggregate_hourly(reader)
+    return path, reader.offset, partial
+
+
+def scan_session_files(tasks: List[Tuple[str, int]], jobs: int = 1, prefilter: bool = True):
+    """解析一组 (路径, 起始偏移)，逐个产出 (路径, 新偏移, 部分聚合)
+
+    jobs > 1 时分发到进程池，json 解析可以用满多核。
+    """
+    scan = partial_func(_scan_task, prefilter=prefilter)
+    if jobs <= 1 or len(tasks) < 2:
+        for task in tasks:
+            yield scan(task)
+        return
+
+    chunksize = max(1, len(tasks) // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(scan, tasks, chunksize=chunksize)
+
 
 class APIStatsAnalyzer:
-    def __init__(self, claude_dir: Path = None):
+    def __init__(self, claude_dir: Path = None, use_index: bool = True, jobs: int = 1,
+                 prefilter: bool = True):
         self.claude_dir = claude_dir or Path.home() / ".claude"
         self.projects_dir = self.claude_dir / "projects"
+        self.index_path = self.claude_dir / "api_stats_index.db"
+        self.use_index = use_index
+        self.jobs = jobs
+        self.prefilter = prefilter
 
     def find_session_files(self, since_date: Optional[datetime] = None) -> List[Path]:
         """查找所有 session jsonl 文件"""
@@ -38,70 +739,218 @@ class APIStatsAnalyzer:
             files.append(jsonl_file)
         return files
 
-    def parse_session_file(self, file_path: Path) -> List[Dict]:
-        """解析单个 session 文件，提取 API 使用记录"""
-        records = []
+    def parse_session_file(self, file_path: Path) -> Iterator[UsageRecord]:
+        """解析单个 session 文件，逐条产出 API 使用记录"""
+        return iter(SessionFileReader(file_path, prefilter=self.prefilter))
+
+    def project_of(self, file_path: Path) -> str:
+        """session 文件所属项目（projects 下的第一级目录名）"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        data = json.loads(line.strip())
-                        if data.get('type') == 'assistant' and data.get('message', {}).get('usage'):
-                            usage = data['message']['usage']
-                            # 只统计有实际 token 消耗的请求
-                            if usage.get('input_tokens', 0) > 0:
-                                records.append({
-                                    'model': data['message'].get('model', 'unknown'),
-                                    'timestamp': data.get('timestamp'),
-                                    'input_tokens': usage.get('input_tokens', 0),
-                                    'output_tokens': usage.get('output_tokens', 0),
-                                    'cache_read_tokens': usage.get('cache_read_input_tokens', 0),
-                                    'cache_creation_tokens': usage.get('cache_creation_input_tokens', 0),
-                                })
-                    except json.JSONDecodeError:
-                        continue
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}", file=sys.stderr)
-        return records
-
-    def aggregate_stats(self, records: List[Dict]) -> Dict:
-        """聚合统计数据"""
-        stats = defaultdict(lambda: {
-            'count': 0,
-            'input_tokens': 0,
-            'output_tokens': 0,
-            'cache_read_tokens': 0,
-            'cache_creation_tokens': 0,
-        })
-
-        for record in records:
-            model = record['model']
-            stats[model]['count'] += 1
-            stats[model]['input_tokens'] += record['input_tokens']
-            stats[model]['output_tokens'] += record['output_tokens']
-            stats[model]['cache_read_tokens'] += record['cache_read_tokens']
-            stats[model]['cache_creation_tokens'] += record['cache_creation_tokens']
-
-        return dict(stats)
-
-    def analyze(self, days: Optional[int] = None) -> Dict:
-        """分析 API 使用统计"""
-        since_date = None
-        if days:
-            since_date = datetime.now() - timedelta(days=days)
+            return file_path.relative_to(self.projects_dir).parts[0]
+        except (ValueError, IndexError):
+            return file_path.parent.name
+
+    def session_of(self, file_path: Path) -> str:
+        """session 文件所属 session
+
+        projects/<项目>/<session>.jsonl 取文件名；子 agent 等写在 projects/<项目>/<session>/ 下的文件
+        归入该目录名对应的 session。
+        """
+        try:
+            parts = file_path.relative_to(self.projects_dir).parts
+        except ValueError:
+            return file_path.stem
+        return parts[1] if len(parts) > 2 else file_path.stem
+
+    def iter_records(self, days: Optional[int] = None) -> Iterator[Tuple[str, UsageRecord]]:
+        """逐条产出 (项目, 记录)，days 按记录时间戳过滤；总是完整解析，不经过索引"""
+        since_hour = since_hour_for_days(days)
+        since_date = datetime.now() - timedelta(days=days) if days else None
+        for file_path in self.find_session_files(since_date):
+            project = self.project_of(file_path)
+            for record in self.parse_session_file(file_path):
+                if since_hour and (record.timestamp or '')[:13] < since_hour:
+                    continue
+                yield project, record
+
+    def aggregate_stats(self, records: Iterable[UsageRecord], bucket: Optional[str] = None,
+                        days: Optional[int] = None) -> Dict:
+        """聚合统计数据
+
+        bucket 为 'hour' / 'day' 时按本地时间分桶，返回 {period: {model: counters}}；
+        days 按每条记录的时间戳过滤。
+        """
+        return rollup_hourly(aggregate_hourly(records), bucket, since_hour_for_days(days))
+
+    def analyze(self, days: Optional[int] = None, bucket: Optional[str] = None) -> Dict:
+        """分析 API 使用统计
+
+        days 按记录时间戳过滤（小时粒度）；bucket 见 aggregate_stats。
+        """
+        since_hour = since_hour_for_days(days)
 
         print(f"Scanning session files...", file=sys.stderr)
+        if self.use_index:
+            return self._analyze_indexed(since_hour, bucket)
+
+        # 文件 mtime 早于起始时间的文件不可能包含更新的记录，直接跳过
+        since_date = datetime.now() - timedelta(days=days) if days else None
         files = self.find_session_files(since_date)
         print(f"Found {len(files)} session files", file=sys.stderr)
 
-        all_records = []
+        hourly = {}
+        tasks = [(str(file_path), 0) for file_path in files]
+        for _, _, partial in scan_session_files(tasks, self.jobs, self.prefilter):
+            merge_stats(hourly, partial)
+
+        total = sum(data['count'] for data in hourly.values())
+        print(f"Extracted {total} API records", file=sys.stderr)
+
+        return rollup_hourly(hourly, bucket, since_hour)
+
+    def _analyze_indexed(self, since_hour: str, bucket: Optional[str]) -> Dict:
+        """通过增量索引分析，只解析新增内容"""
+        index = self._synced_index()
+        if index is None:
+            return {}
+        try:
+            if bucket:
+                return rollup_hourly(index.hourly(since_hour), bucket)
+            return index.aggregate(since_hour)
+        finally:
+            index.close()
+
+    def _synced_index(self) -> Optional[UsageIndex]:
+        """打开并同步增量索引（调用方负责关闭）；没有 projects 目录时返回 None"""
+        if not self.projects_dir.is_dir():
+            return None
+
+        index = UsageIndex(self.index_path)
+        try:
+            # 全量同步，才能发现被删除的文件；时间过滤在汇总时进行
+            files = index.list_session_files(self.projects_dir)
+            print(f"Found {len(files)} session files", file=sys.stderr)
+            scanned, new_records = index.sync(files, jobs=self.jobs, prefilter=self.prefilter)
+        except BaseException:
+            index.close()
+            raise
+        print(f"Indexed {new_records} new API records from {scanned} changed files",
+              file=sys.stderr)
+        return index
+
+    def analyze_groups(self, days: Optional[int] = None,
+                       by: str = 'project') -> Tuple[Dict[str, Dict], Dict[str, str]]:
+        """按项目或 session 分组（by 为 'project' / 'session'），days 同 analyze
+
+        返回 ({分组: {(模型, 小时): counters}}, {分组: 所属项目})。
+        不同项目中出现同名 session 时，后出现的记为 "项目/session"。
+        """
+        since_hour = since_hour_for_days(days)
+        key_of = self.session_of if by == 'session' else self.project_of
+        groups: Dict[str, Dict] = {}
+        projects: Dict[str, str] = {}
+
+        def add(path: str, hourly: Dict):
+            file_path = Path(path)
+            key = key_of(file_path)
+            project = self.project_of(file_path)
+            if projects.setdefault(key, project) != project:
+                key = f"{project}/{key}"
+                projects[key] = project
+            merge_stats(groups.setdefault(key, {}), hourly)
+
+        print(f"Scanning session files...", file=sys.stderr)
+        if self.use_index:
+            index = self._synced_index()
+            if index is None:
+                return groups, projects
+            try:
+                for path, hourly in index.file_hourly(since_hour):
+                    add(path, hourly)
+            finally:
+                index.close()
+            return groups, projects
+
+        since_date = datetime.now() - timedelta(days=days) if days else None
+        tasks = [(str(file_path), 0) for file_path in self.find_session_files(since_date)]
+        print(f"Found {len(tasks)} session files", file=sys.stderr)
+        for path, _, partial in scan_session_files(tasks, self.jobs, self.prefilter):
+            partial = {key: data for key, data in partial.items() if key[1] >= since_hour}
+            if partial:
+                add(path, partial)
+        return groups, projects
+
+
+class LiveUsage:
+    """--watch 的内存状态
+
+    保存按 (模型, 小时) 的累计值和每个文件的 (inode, 已解析偏移)。
+    文件追加时只解析新增字节并折叠进累计值；文件被替换、截断或删除时重新加载。
+    """
+
+    def __init__(self, analyzer: APIStatsAnalyzer):
+        self.analyzer = analyzer
+        self.hourly: Dict = {}
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+
+    def load(self):
+        """建立基线：有索引时同步索引后直接读取，否则完整解析一遍"""
+        analyzer = self.analyzer
+        self.hourly = {}
+        self.offsets = {}
+        if analyzer.use_index:
+            index = analyzer._synced_index()
+            if index is not None:
+                try:
+                    self.hourly = index.hourly()
+                    self.offsets = index.offsets()
+                finally:
+                    index.close()
+            return
+
+        files = analyzer.find_session_files() if analyzer.projects_dir.is_dir() else []
+        inodes = {}
         for file_path in files:
-            records = self.parse_session_file(file_path)
-            all_records.extend(records)
+            try:
+                inodes[str(file_path)] = file_path.stat().st_ino
+            except OSError:
+                continue
+        tasks = [(path, 0) for path in inodes]
+        for path, offset, partial in scan_session_files(tasks, analyzer.jobs, analyzer.prefilter):
+            merge_stats(self.hourly, partial)
+            self.offsets[path] = (inodes[path], offset)
 
-        print(f"Extracted {len(all_records)} API records", file=sys.stderr)
+    def update(self, paths: Iterable[Path]) -> bool:
+        """解析变化文件的新增内容，返回统计是否有变化"""
+        changed = False
+        for file_path in paths:
+            key = str(file_path)
+            inode, offset = self.offsets.get(key, (None, 0))
+            try:
+                st = file_path.stat()
+            except OSError:
+                if inode is None:
+                    continue
+                self.load()
+                return True
+            if inode is not None and (inode != st.st_ino or st.st_size < offset):
+                self.load()
+                return True
+            if st.st_size == offset:
+                continue
+            reader = SessionFileReader(file_path, offset, prefilter=self.analyzer.prefilter)
+            partial = aggregate_hourly(reader, backend='dict')
+            self.offsets[key] = (st.st_ino, reader.offset)
+            if partial:
+                merge_stats(self.hourly, partial)
+                changed = True
+        return changed
 
-        return self.aggregate_stats(all_records)
+    def stats(self, since_hour: str = '', model: Optional[str] = None) -> Dict:
+        stats = rollup_hourly(self.hourly, since_hour=since_hour)
+        if model:
+            stats = {k: v for k, v in stats.items() if model.lower() in k.lower()}
+        return stats
 
 
 def format_number(n: int) -> str:
@@ -118,12 +967,41 @@ def format_tokens(n: int) -> str:
     return str(n)
 
 
-def print_stats_table(stats: Dict, title: str = "API Usage Statistics"):
-    """打印统计表格"""
-    if not stats:
-        print("No API usage data found.")
-        return
+def format_cost(nanos: int, model: Optional[str] = None) -> str:
+    """格式化费用（nano-USD）；给出 model 且价格表中没有该模型时显示 n/a"""
+    if model is not None and not nanos and not get_price_table().is_priced(model):
+        return "n/a"
+    usd = nanos / COST_UNIT
+    if 0 < abs(usd) < 0.01:
+        return "<$0.01" if usd > 0 else ">-$0.01"
+    return f"-${-usd:,.2f}" if usd < 0 else f"${usd:,.2f}"
+
+
+def cache_hit_ratio(data: Dict) -> float:
+    """缓存读取占全部提示 token（输入 + 缓存读写）的比例"""
+    prompt = data['input_tokens'] + data['cache_read_tokens'] + data['cache_creation_tokens']
+    return data['cache_read_tokens'] / prompt if prompt else 0.0
+
+
+def total_counters(stats: Dict) -> Dict:
+    """把 {key: counters} 加总为一组 counters"""
+    totals = _new_counters()
+    for data in stats.values():
+        for key in totals:
+            totals[key] += data[key]
+    return totals
+
+
+def json_ready(stats):
+    """JSON 输出：费用字段由 nano-USD 换算为 USD"""
+    if isinstance(stats, dict):
+        return {key: round(value / COST_UNIT, 6) if key in COST_FIELDS else json_ready(value)
+                for key, value in stats.items()}
+    return stats
 
+
+def build_stats_table(stats: Dict, title: str = "API Usage Statistics") -> 'Table':
+    """构建 rich 统计表格（需要 rich）"""
     # 按请求次数排序
     sorted_models = sorted(stats.items(), key=lambda x: x[1]['count'], reverse=True)
 
@@ -132,61 +1010,423 @@ def print_stats_table(stats: Dict, title: str = "API Usage Statistics"):
     total_output = 0
     total_cache_read = 0
     total_cache_creation = 0
+    total_cost = 0
+
+    table = Table(title=title, show_header=True, header_style="bold cyan")
+    table.add_column("Model", style="green", width=28)
+    table.add_column("Reqs", justify="right", style="yellow", width=6)
+    table.add_column("Input", justify="right", style="blue", width=9)
+    table.add_column("Output", justify="right", style="magenta", width=9)
+    table.add_column("Cache R", justify="right", style="cyan", width=9)
+    table.add_column("Cache C", justify="right", style="dim cyan", width=9)
+    table.add_column("Cost", justify="right", style="bold green", width=11)
+
+    for model, data in sorted_models:
+        table.add_row(
+            model,
+            format_number(data['count']),
+            format_tokens(data['input_tokens']),
+            format_tokens(data['output_tokens']),
+            format_tokens(data['cache_read_tokens']),
+            format_tokens(data['cache_creation_tokens']),
+            format_cost(data['cost'], model)
+        )
+        total_count += data['count']
+        total_input += data['input_tokens']
+        total_output += data['output_tokens']
+        total_cache_read += data['cache_read_tokens']
+        total_cache_creation += data['cache_creation_tokens']
+        total_cost += data['cost']
+
+    # 添加总计行
+    table.add_row(
+        "[bold]TOTAL[/bold]",
+        f"[bold]{format_number(total_count)}[/bold]",
+        f"[bold]{format_tokens(total_input)}[/bold]",
+        f"[bold]{format_tokens(total_output)}[/bold]",
+        f"[bold]{format_tokens(total_cache_read)}[/bold]",
+        f"[bold]{format_tokens(total_cache_creation)}[/bold]",
+        f"[bold]{format_cost(total_cost)}[/bold]"
+    )
+    return table
+
+
+def print_stats_table(stats: Dict, title: str = "API Usage Statistics"):
+    """打印统计表格"""
+    if not stats:
+        print("No API usage data found.")
+        return
+
+    if HAS_RICH:
+        Console().print(build_stats_table(stats, title))
+    else:
+        # 按请求次数排序
+        sorted_models = sorted(stats.items(), key=lambda x: x[1]['count'], reverse=True)
+        total_count = 0
+        total_input = 0
+        total_output = 0
+        total_cache = 0
+        total_cost = 0
+
+        # 简单表格格式
+        print("=" * 103)
+        print(f"{'Model':<30} {'Requests':>10} {'Input':>12} {'Output':>12} {'Cache':>12} {'Cost':>12}")
+        print("=" * 103)
+
+        for model, data in sorted_models:
+            print(f"{model:<30} {data['count']:>10} {format_tokens(data['input_tokens']):>12} "
+                  f"{format_tokens(data['output_tokens']):>12} {format_tokens(data['cache_read_tokens']):>12} "
+                  f"{format_cost(data['cost'], model):>12}")
+            total_count += data['count']
+            total_input += data['input_tokens']
+            total_output += data['output_tokens']
+            total_cache += data['cache_read_tokens']
+            total_cost += data['cost']
+
+        print("=" * 103)
+        print(f"{'TOTAL':<30} {total_count:>10} {format_tokens(total_input):>12} "
+              f"{format_tokens(total_output):>12} {format_tokens(total_cache):>12} {format_cost(total_cost):>12}")
+        print("=" * 103)
+
+
+def print_series_table(series: Dict, title: str = "API Usage by Period"):
+    """打印时间序列表格（每个时间段按模型分行）"""
+    if not series:
+        print("No API usage data found.")
+        return
+
+    rows = []
+    totals = _new_counters()
+    for period, models in series.items():
+        for model, data in sorted(models.items(), key=lambda x: x[1]['count'], reverse=True):
+            rows.append((period, model, data))
+            for key in totals:
+                totals[key] += data[key]
 
     if HAS_RICH:
         console = Console()
         table = Table(title=title, show_header=True, header_style="bold cyan")
+        table.add_column("Period", style="white", width=16)
         table.add_column("Model", style="green", width=28)
         table.add_column("Reqs", justify="right", style="yellow", width=6)
         table.add_column("Input", justify="right", style="blue", width=9)
         table.add_column("Output", justify="right", style="magenta", width=9)
         table.add_column("Cache R", justify="right", style="cyan", width=9)
         table.add_column("Cache C", justify="right", style="dim cyan", width=9)
+        table.add_column("Cost", justify="right", style="bold green", width=11)
 
-        for model, data in sorted_models:
+        last_period = None
+        for period, model, data in rows:
             table.add_row(
+                period if period != last_period else "",
                 model,
                 format_number(data['count']),
                 format_tokens(data['input_tokens']),
                 format_tokens(data['output_tokens']),
                 format_tokens(data['cache_read_tokens']),
-                format_tokens(data['cache_creation_tokens'])
+                format_tokens(data['cache_creation_tokens']),
+                format_cost(data['cost'], model)
             )
-            total_count += data['count']
-            total_input += data['input_tokens']
-            total_output += data['output_tokens']
-            total_cache_read += data['cache_read_tokens']
-            total_cache_creation += data['cache_creation_tokens']
+            last_period = period
 
-        # 添加总计行
         table.add_row(
             "[bold]TOTAL[/bold]",
-            f"[bold]{format_number(total_count)}[/bold]",
-            f"[bold]{format_tokens(total_input)}[/bold]",
-            f"[bold]{format_tokens(total_output)}[/bold]",
-            f"[bold]{format_tokens(total_cache_read)}[/bold]",
-            f"[bold]{format_tokens(total_cache_creation)}[/bold]"
+            "",
+            f"[bold]{format_number(totals['count'])}[/bold]",
+            f"[bold]{format_tokens(totals['input_tokens'])}[/bold]",
+            f"[bold]{format_tokens(totals['output_tokens'])}[/bold]",
+            f"[bold]{format_tokens(totals['cache_read_tokens'])}[/bold]",
+            f"[bold]{format_tokens(totals['cache_creation_tokens'])}[/bold]",
+            f"[bold]{format_cost(totals['cost'])}[/bold]"
         )
 
         console.print(table)
     else:
-        # 简单表格格式
-        print("=" * 90)
-        print(f"{'Model':<30} {'Requests':>10} {'Input':>12} {'Output':>12} {'Cache':>12}")
-        print("=" * 90)
+        print("=" * 121)
+        print(f"{'Period':<17} {'Model':<30} {'Requests':>10} {'Input':>12} {'Output':>12} {'Cache':>12} "
+              f"{'Cost':>12}")
+        print("=" * 121)
 
-        for model, data in sorted_models:
-            print(f"{model:<30} {data['count']:>10} {format_tokens(data['input_tokens']):>12} "
-                  f"{format_tokens(data['output_tokens']):>12} {format_tokens(data['cache_read_tokens']):>12}")
-            total_count += data['count']
-            total_input += data['input_tokens']
-            total_output += data['output_tokens']
-            total_cache += data['cache_read_tokens']
+        last_period = None
+        for period, model, data in rows:
+            label = period if period != last_period else ""
+            print(f"{label:<17} {model:<30} {data['count']:>10} {format_tokens(data['input_tokens']):>12} "
+                  f"{format_tokens(data['output_tokens']):>12} {format_tokens(data['cache_read_tokens']):>12} "
+                  f"{format_cost(data['cost'], model):>12}")
+            last_period = period
 
-        print("=" * 90)
-        print(f"{'TOTAL':<30} {total_count:>10} {format_tokens(total_input):>12} "
-              f"{format_tokens(total_output):>12} {format_tokens(total_cache):>12}")
-        print("=" * 90)
+        print("=" * 121)
+        print(f"{'TOTAL':<17} {'':<30} {totals['count']:>10} {format_tokens(totals['input_tokens']):>12} "
+              f"{format_tokens(totals['output_tokens']):>12} {format_tokens(totals['cache_read_tokens']):>12} "
+              f"{format_cost(totals['cost']):>12}")
+        print("=" * 121)
+
+
+def print_percentiles_table(percentiles: Dict, title: str = "Tokens per Request"):
+    """打印每个模型单次请求 token 数的分位数"""
+    if not percentiles:
+        print("No API usage data found.")
+        return
+
+    if HAS_RICH:
+        console = Console()
+        table = Table(title=title, show_header=True, header_style="bold cyan")
+        table.add_column("Model", style="green", width=28)
+        table.add_column("p50", justify="right", style="blue", width=9)
+        table.add_column("p95", justify="right", style="magenta", width=9)
+        table.add_column("p99", justify="right", style="cyan", width=9)
+        for model, data in sorted(percentiles.items()):
+            table.add_row(model, format_tokens(data['p50']), format_tokens(data['p95']),
+                          format_tokens(data['p99']))
+        console.print(table)
+    else:
+        print("=" * 66)
+        print(f"{'Model':<30} {'p50':>10} {'p95':>10} {'p99':>10}")
+        print("=" * 66)
+        for model, data in sorted(percentiles.items()):
+            print(f"{model:<30} {format_tokens(data['p50']):>10} {format_tokens(data['p95']):>10} "
+                  f"{format_tokens(data['p99']):>10}")
+        print("=" * 66)
+
+
+def cost_report(projects: Dict[str, Dict], model: Optional[str] = None) -> Dict:
+    """由按项目的 (模型, 小时) 汇总生成费用报告：按模型、按本地日期、按项目，以及总计"""
+    if model:
+        projects = {project: {key: data for key, data in hourly.items()
+                              if model.lower() in key[0].lower()}
+                    for project, hourly in projects.items()}
+    hourly: Dict = {}
+    for partial in projects.values():
+        merge_stats(hourly, partial)
+    by_model = rollup_hourly(hourly)
+    return {
+        'by_model': by_model,
+        'by_day': {day: total_counters(models)
+                   for day, models in rollup_hourly(hourly, 'day').items()},
+        'by_project': {project: total_counters(rollup_hourly(partial))
+                       for project, partial in projects.items() if partial},
+        'total': total_counters(by_model),
+    }
+
+
+def summarize_groups(groups: Dict[str, Dict], projects: Dict[str, str],
+                     model: Optional[str] = None) -> Dict:
+    """把按项目/session 的 (模型, 小时) 汇总折叠为每组一行，按费用（其次 token 总数）降序
+
+    每行包含 counters、用量最多的模型、所属项目和首次/最后活跃时间（本地小时）。
+    """
+    result = []
+    for key, hourly in groups.items():
+        if model:
+            hourly = {k: v for k, v in hourly.items() if model.lower() in k[0].lower()}
+        if not hourly:
+            continue
+        by_model = rollup_hourly(hourly)
+        data = total_counters(by_model)
+        data['top_model'] = max(by_model, key=lambda m: by_model[m]['count'])
+        data['project'] = projects.get(key, key)
+        hours = [hour for _, hour in hourly if hour]
+        data['first_active'] = _local_period(min(hours), 'hour') if hours else 'unknown'
+        data['last_active'] = _local_period(max(hours), 'hour') if hours else 'unknown'
+        result.append((key, data))
+    result.sort(key=lambda x: (x[1]['cost'], sum(x[1][k] for k in USAGE_FIELDS)), reverse=True)
+    return dict(result)
+
+
+def print_group_table(summary: Dict, title: str, label: str, top: int = 0):
+    """打印按项目/session 的用量表（summarize_groups 的结果，已按费用排序）"""
+    if not summary:
+        print("No API usage data found.")
+        return
+
+    totals = total_counters(summary)
+    rows = list(summary.items())
+    hidden = len(rows) - top if top and len(rows) > top else 0
+    if hidden:
+        rows = rows[:top]
+    show_project = label != 'Project'
+
+    if HAS_RICH:
+        table = Table(title=title, show_header=True, header_style="bold cyan")
+        table.add_column(label, style="green", width=36 if show_project else 40, overflow="fold")
+        if show_project:
+            table.add_column("Project", style="white", width=24, overflow="ellipsis")
+        table.add_column("Reqs", justify="right", style="yellow", width=7)
+        table.add_column("Input", justify="right", style="blue", width=9)
+        table.add_column("Output", justify="right", style="magenta", width=9)
+        table.add_column("Cache R", justify="right", style="cyan", width=9)
+        table.add_column("Cost", justify="right", style="bold green", width=11)
+        table.add_column("Last Active", style="white", width=16)
+        for key, data in rows:
+            cells = [key] + ([data['project']] if show_project else []) + [
+                format_number(data['count']),
+                format_tokens(data['input_tokens']),
+                format_tokens(data['output_tokens']),
+                format_tokens(data['cache_read_tokens']),
+                format_cost(data['cost']),
+                data['last_active'],
+            ]
+            table.add_row(*cells)
+        if hidden:
+            table.add_row(f"[dim]... {hidden} more[/dim]", *[""] * (len(table.columns) - 1))
+        table.add_row("[bold]TOTAL[/bold]", *([""] if show_project else []),
+                      f"[bold]{format_number(totals['count'])}[/bold]",
+                      f"[bold]{format_tokens(totals['input_tokens'])}[/bold]",
+                      f"[bold]{format_tokens(totals['output_tokens'])}[/bold]",
+                      f"[bold]{format_tokens(totals['cache_read_tokens'])}[/bold]",
+                      f"[bold]{format_cost(totals['cost'])}[/bold]", "")
+        Console().print(table)
+    else:
+        width = 123 if show_project else 98
+        print("=" * width)
+        print(f"{label:<38} " + (f"{'Project':<24} " if show_project else "") +
+              f"{'Requests':>8} {'Input':>9} {'Output':>9} {'Cache':>9} {'Cost':>11}  {'Last Active':<16}")
+        print("=" * width)
+        for key, data in rows:
+            project = f"{data['project'][:24]:<24} " if show_project else ""
+            print(f"{key:<38} {project}{data['count']:>8} {format_tokens(data['input_tokens']):>9} "
+                  f"{format_tokens(data['output_tokens']):>9} {format_tokens(data['cache_read_tokens']):>9} "
+                  f"{format_cost(data['cost']):>11}  {data['last_active']:<16}")
+        if hidden:
+            print(f"... {hidden} more")
+        print("=" * width)
+        print(f"{'TOTAL':<38} " + (" " * 25 if show_project else "") +
+              f"{totals['count']:>8} {format_tokens(totals['input_tokens']):>9} "
+              f"{format_tokens(totals['output_tokens']):>9} {format_tokens(totals['cache_read_tokens']):>9} "
+              f"{format_cost(totals['cost']):>11}")
+        print("=" * width)
+
+
+def print_cost_table(rows: Dict, title: str, label: str, sort_by_cost: bool = True):
+    """打印费用表：请求数、费用、缓存命中率、缓存节省"""
+    items = list(rows.items())
+    if sort_by_cost:
+        items.sort(key=lambda x: x[1]['cost'], reverse=True)
+    totals = total_counters(rows)
+    is_model = label == 'Model'
+
+    if HAS_RICH:
+        table = Table(title=title, show_header=True, header_style="bold cyan")
+        table.add_column(label, style="green", width=28)
+        table.add_column("Reqs", justify="right", style="yellow", width=8)
+        table.add_column("Cost", justify="right", style="bold green", width=11)
+        table.add_column("Cache Hit", justify="right", style="cyan", width=9)
+        table.add_column("Saved", justify="right", style="magenta", width=11)
+        for key, data in items:
+            table.add_row(key, format_number(data['count']),
+                          format_cost(data['cost'], key if is_model else None),
+                          f"{cache_hit_ratio(data):.1%}", format_cost(data['savings']))
+        table.add_row("[bold]TOTAL[/bold]", f"[bold]{format_number(totals['count'])}[/bold]",
+                      f"[bold]{format_cost(totals['cost'])}[/bold]",
+                      f"[bold]{cache_hit_ratio(totals):.1%}[/bold]",
+                      f"[bold]{format_cost(totals['savings'])}[/bold]")
+        Console().print(table)
+    else:
+        print(title)
+        print("=" * 80)
+        print(f"{label:<30} {'Requests':>10} {'Cost':>12} {'Cache Hit':>10} {'Saved':>12}")
+        print("=" * 80)
+        for key, data in items:
+            print(f"{key:<30} {data['count']:>10} {format_cost(data['cost'], key if is_model else None):>12} "
+                  f"{cache_hit_ratio(data):>10.1%} {format_cost(data['savings']):>12}")
+        print("=" * 80)
+        print(f"{'TOTAL':<30} {totals['count']:>10} {format_cost(totals['cost']):>12} "
+              f"{cache_hit_ratio(totals):>10.1%} {format_cost(totals['savings']):>12}")
+        print("=" * 80)
+
+
+def print_cost_report(report: Dict, period: str):
+    if not report['by_model']:
+        print("No API usage data found.")
+        return
+    print_cost_table(report['by_model'], f"Cost by Model ({period})", 'Model')
+    print()
+    print_cost_table(report['by_day'], f"Cost by Day ({period})", 'Day', sort_by_cost=False)
+    print()
+    print_cost_table(report['by_project'], f"Cost by Project ({period})", 'Project')
+    unpriced = sorted(model for model in report['by_model'] if not get_price_table().is_priced(model))
+    if unpriced:
+        print(f"\nNo price for: {', '.join(unpriced)} (add them to ~/.claude/api_stats_prices.json)",
+              file=sys.stderr)
+
+
+def watch_usage(analyzer: APIStatsAnalyzer, days: Optional[int] = None, model: Optional[str] = None,
+                refresh: float = 1.0, as_json: bool = False):
+    """持续显示按模型的统计，直到 Ctrl-C
+
+    监听 session 目录（inotify，不可用时轮询），只解析追加的字节；
+    变化的文件先攒起来，每 refresh 秒最多解析并重绘一次。日志没有写入时阻塞等待，不占 CPU。
+    """
+    from session_watch import open_watcher
+
+    # 先开始监听再建立基线，基线之后追加的内容不会漏掉；已计入的部分由偏移保证不会重复
+    watcher = open_watcher(analyzer.projects_dir, poll_interval=max(refresh, 1.0))
+    print(f"Scanning session files...", file=sys.stderr)
+    usage = LiveUsage(analyzer)
+    usage.load()
+    print(f"Watching {analyzer.projects_dir} ({watcher.kind}), Ctrl-C to stop", file=sys.stderr)
+
+    period = f"Last {days} days" if days else "All Time"
+    live = None
+    if HAS_RICH and not as_json:
+        live = Live(auto_refresh=False)
+        live.start()
+    clear = not as_json and not HAS_RICH and sys.stdout.isatty()
+
+    def render(since_hour: str):
+        stats = usage.stats(since_hour, model)
+        if as_json:
+            print(json.dumps(json_ready(stats)), flush=True)
+            return
+        title = f"API Usage Statistics ({period}, updated {datetime.now():%H:%M:%S})"
+        if live is not None:
+            live.update(build_stats_table(stats, title) if stats else "No API usage data found.",
+                        refresh=True)
+            return
+        if clear:
+            print("\033[H\033[2J", end='')
+        print_stats_table(stats, title=title)
+        sys.stdout.flush()
+
+    pending = set()
+    reload = False
+    since_hour = since_hour_for_days(days)
+    last_render = time.monotonic()
+    render(since_hour)
+    try:
+        while True:
+            if pending or reload:
+                timeout = max(0.0, refresh - (time.monotonic() - last_render))
+            else:
+                # 只有 --days 窗口需要随时间滑动，否则一直阻塞到有写入
+                timeout = 60.0 if days else None
+            changed = watcher.wait(timeout)
+            if changed is None:
+                reload = True
+            else:
+                pending |= changed
+
+            if time.monotonic() - last_render < refresh:
+                continue
+            dirty = False
+            if reload:
+                usage.load()
+                dirty = True
+            elif pending:
+                dirty = usage.update(sorted(pending))
+            pending.clear()
+            reload = False
+            hour = since_hour_for_days(days)
+            if dirty or hour != since_hour:
+                since_hour = hour
+                last_render = time.monotonic()
+                render(since_hour)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if live is not None:
+            live.stop()
 
 
 def main():
@@ -194,24 +1434,108 @@ def main():
     parser.add_argument('--days', type=int, help='Only analyze last N days')
     parser.add_argument('--json', action='store_true', help='Output as JSON')
     parser.add_argument('--model', type=str, help='Filter by model name')
+    parser.add_argument('--by', choices=['model', 'hour', 'day', 'project', 'session'], default='model',
+                        help='Group by model (default), local hour/day per model, project or session')
+    parser.add_argument('--top', type=int, default=20, metavar='N',
+                        help='With --by project|session, show the N most expensive rows (0 = all)')
+    parser.add_argument('--no-index', action='store_true',
+                        help='Ignore the incremental index and rescan all session files')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Parse session files with N worker processes')
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help='JSON-parse every line instead of skipping non-usage lines first')
+    parser.add_argument('--percentiles', action='store_true',
+                        help='Show p50/p95/p99 tokens per request for each model (full scan)')
+    parser.add_argument('--export', type=Path, metavar='FILE',
+                        help='Write every usage record to a columnar file instead of a report')
+    parser.add_argument('--export-format', choices=['auto', 'parquet', 'binary'], default='auto',
+                        help='Export format: Parquet if pyarrow is installed (auto), or packed binary')
+    parser.add_argument('--cost', action='store_true',
+                        help='Cost report by model, day and project with cache hit ratio and savings')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep a live per-model table updated as session logs grow (Ctrl-C to stop)')
+    parser.add_argument('--refresh', type=float, default=1.0, metavar='SECONDS',
+                        help='Minimum interval between --watch redraws (default: 1)')
 
     args = parser.parse_args()
 
-    analyzer = APIStatsAnalyzer()
-    stats = analyzer.analyze(days=args.days)
+    analyzer = APIStatsAnalyzer(use_index=not args.no_index, jobs=args.jobs,
+                                prefilter=not args.no_prefilter)
+
+    if args.watch:
+        watch_usage(analyzer, days=args.days, model=args.model,
+                    refresh=max(args.refresh, 0.1), as_json=args.json)
+        return
+
+    if args.cost:
+        projects, _ = analyzer.analyze_groups(days=args.days, by='project')
+        report = cost_report(projects, model=args.model)
+        if args.json:
+            print(json.dumps(json_ready(report), indent=2))
+        else:
+            print_cost_report(report, f"Last {args.days} days" if args.days else "All Time")
+        return
+
+    if args.export or args.percentiles:
+        records = analyzer.iter_records(days=args.days)
+        if args.model:
+            records = ((project, record) for project, record in records
+                       if args.model.lower() in record.model.lower())
+
+    if args.percentiles:
+        percentiles = token_percentiles(record for _, record in records)
+        if args.json:
+            print(json.dumps(percentiles, indent=2))
+        else:
+            period = f"Last {args.days} days" if args.days else "All Time"
+            print_percentiles_table(percentiles, title=f"Tokens per Request ({period})")
+        return
+
+    if args.export:
+        from usage_export import export_usage
+
+        try:
+            rows, fmt = export_usage(records, args.export, args.export_format)
+        except RuntimeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Exported {rows:,} usage records to {args.export} ({fmt})", file=sys.stderr)
+        return
+
+    if args.by in ('project', 'session'):
+        groups, projects = analyzer.analyze_groups(days=args.days, by=args.by)
+        summary = summarize_groups(groups, projects, model=args.model)
+        if args.json:
+            print(json.dumps(json_ready(summary), indent=2))
+        else:
+            period = f"Last {args.days} days" if args.days else "All Time"
+            print_group_table(summary, f"API Usage by {args.by} ({period})",
+                              args.by.capitalize(), top=args.top)
+        return
+
+    bucket = args.by if args.by in ('hour', 'day') else None
+    stats = analyzer.analyze(days=args.days, bucket=bucket)
 
     # 按模型过滤
     if args.model:
-        stats = {k: v for k, v in stats.items() if args.model.lower() in k.lower()}
+        if bucket:
+            stats = {period: {k: v for k, v in models.items() if args.model.lower() in k.lower()}
+                     for period, models in stats.items()}
+            stats = {period: models for period, models in stats.items() if models}
+        else:
+            stats = {k: v for k, v in stats.items() if args.model.lower() in k.lower()}
 
     if args.json:
-        print(json.dumps(stats, indent=2))
+        print(json.dumps(json_ready(stats), indent=2))
     else:
         if args.days:
             title = f"API Usage Statistics (Last {args.days} days)"
         else:
             title = "API Usage Statistics (All Time)"
-        print_stats_table(stats, title=title)
+        if bucket:
+            print_series_table(stats, title=f"{title} by {bucket}")
+        else:
+            print_stats_table(stats, title=title)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,6 @@
+"""api-stats-tool 测试的公共配置"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,60 @@
+"""Tests for StatsDatabase.compact in proxy_stats.py."""
+
+import sqlite3
+
+from proxy_stats import StatsDatabase
+
+
+def fill(db_path, rows: int, timestamp: int):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "WITH RECURSIVE r(v) AS (SELECT 1 UNION ALL SELECT v + 1 FROM r WHERE v < ?) "
+        "INSERT INTO connections (timestamp, target_host, target_port, client_ip, connect_time, "
+        "bytes_up, bytes_down, duration) "
+        "SELECT ?, 'host' || v || '.example.com', 443, '127.0.0.1', 0, 0, 0, 0 FROM r",
+        (rows, timestamp))
+    conn.commit()
+    conn.close()
+
+
+def pragma(db_path, name: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class TestCompact:
+    """保留期清理与空闲页回收"""
+
+    def test_reclaims_free_pages_without_retention(self, tmp_path) -> None:
+        db_path = tmp_path / "proxy_stats.db"
+        db = StatsDatabase(db_path)
+        db.enable_incremental_vacuum()
+        fill(db_path, 20000, 0)
+        conn = sqlite3.connect(db_path)
+        conn.execute("DELETE FROM connections")
+        conn.commit()
+        conn.close()
+        assert pragma(db_path, "freelist_count") > 0
+
+        result = db.compact()
+        db.close()
+        assert result["deleted"] == 0
+        assert result["freed_bytes"] > 0
+        assert pragma(db_path, "freelist_count") == 0
+
+    def test_prunes_only_records_past_retention(self, tmp_path) -> None:
+        db_path = tmp_path / "proxy_stats.db"
+        db = StatsDatabase(db_path)
+        db.enable_incremental_vacuum()
+        fill(db_path, 3000, 0)
+        fill(db_path, 10, 2 ** 40)
+
+        result = db.compact(7, batch_size=1000, pause=0)
+        db.close()
+        assert result["deleted"] == 3000
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM connections").fetchone()[0] == 10
+        conn.close()
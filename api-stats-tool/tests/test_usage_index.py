@@ -0,0 +1,137 @@
+"""Tests for the incremental session index in stats.py."""
+
+import json
+import threading
+
+import stats
+from stats import UsageIndex
+
+
+def usage_line(input_tokens: int = 10, model: str = "claude-sonnet-4",
+               timestamp: str = "2026-10-17T10:00:00Z") -> str:
+    return json.dumps({
+        "type": "assistant", "timestamp": timestamp, "sessionId": "s1",
+        "message": {"model": model, "usage": {
+            "input_tokens": input_tokens, "output_tokens": 5,
+            "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}},
+    }) + "\n"
+
+
+def append(path, *lines: str):
+    with open(path, "a") as f:
+        f.writelines(lines)
+
+
+def total(index: UsageIndex, field: str = "count") -> int:
+    return sum(data[field] for data in index.aggregate().values())
+
+
+class TestSync:
+    """增量同步"""
+
+    def test_initial_sync_and_append(self, tmp_path) -> None:
+        session = tmp_path / "session.jsonl"
+        append(session, usage_line(), '{"type": "user"}\n', usage_line())
+        index = UsageIndex(tmp_path / "index.db")
+        assert index.sync([session]) == (1, 2)
+        append(session, usage_line(input_tokens=7))
+        assert index.sync([session]) == (1, 1)
+        assert total(index) == 3
+        assert total(index, "input_tokens") == 27
+        index.close()
+
+    def test_unchanged_file_is_not_reparsed(self, tmp_path) -> None:
+        session = tmp_path / "session.jsonl"
+        append(session, usage_line())
+        index = UsageIndex(tmp_path / "index.db")
+        index.sync([session])
+        assert index.sync([session]) == (0, 0)
+        assert total(index) == 1
+        index.close()
+
+    def test_partial_line_is_parsed_once_complete(self, tmp_path) -> None:
+        session = tmp_path / "session.jsonl"
+        line = usage_line()
+        append(session, usage_line(), line[:20])
+        index = UsageIndex(tmp_path / "index.db")
+        index.sync([session])
+        append(session, line[20:])
+        index.sync([session])
+        assert total(index) == 2
+        index.close()
+
+    def test_truncated_file_is_reindexed(self, tmp_path) -> None:
+        session = tmp_path / "session.jsonl"
+        append(session, usage_line(), usage_line(), usage_line())
+        index = UsageIndex(tmp_path / "index.db")
+        index.sync([session])
+        session.write_text(usage_line())
+        index.sync([session])
+        assert total(index) == 1
+        index.close()
+
+    def test_deleted_file_is_dropped(self, tmp_path) -> None:
+        kept, removed = tmp_path / "a.jsonl", tmp_path / "b.jsonl"
+        append(kept, usage_line())
+        append(removed, usage_line(), usage_line())
+        index = UsageIndex(tmp_path / "index.db")
+        index.sync([kept, removed])
+        removed.unlink()
+        index.sync([kept])
+        assert total(index) == 1
+        assert set(index.offsets()) == {str(kept)}
+        index.close()
+
+
+class TestConcurrentSync:
+    """两个 stats.py 同时运行"""
+
+    def test_overlapping_syncs_count_appended_records_once(self, tmp_path, monkeypatch) -> None:
+        session = tmp_path / "session.jsonl"
+        db = tmp_path / "index.db"
+        append(session, usage_line())
+        first = UsageIndex(db)
+        first.sync([session])
+        append(session, usage_line(), usage_line())
+
+        # 第一个 sync 解析完之后、写入之前，另一个进程完成了同一段内容的同步
+        scan = stats.scan_session_files
+
+        def interleaved(tasks, jobs=1, prefilter=True):
+            results = list(scan(tasks, jobs, prefilter))
+            monkeypatch.setattr(stats, "scan_session_files", scan)
+            other = UsageIndex(db)
+            other.sync([session])
+            other.close()
+            return iter(results)
+
+        monkeypatch.setattr(stats, "scan_session_files", interleaved)
+        first.sync([session])
+
+        assert total(first) == 3
+        append(session, usage_line())
+        first.sync([session])
+        assert total(first) == 4
+        first.close()
+
+    def test_threaded_syncs(self, tmp_path) -> None:
+        files = [tmp_path / f"s{i}.jsonl" for i in range(20)]
+        for path in files:
+            append(path, *(usage_line() for _ in range(50)))
+        db = tmp_path / "index.db"
+        UsageIndex(db).close()
+
+        def run():
+            index = UsageIndex(db)
+            index.sync(files)
+            index.close()
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        index = UsageIndex(db)
+        assert total(index) == 1000
+        index.close()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+使用记录列式导出
+把每条 API 使用记录（模型、时间、token、项目、session）写成列式文件，
+供 pandas / polars / DuckDB 等工具批量分析，不必重新解析 JSONL。
+
+- 安装了 pyarrow 时写 Parquet
+- 否则写本模块定义的紧凑二进制格式（见 BinaryUsageWriter），可用 read_usage_export 读回
+"""
+
+import array
+import json
+import struct
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 可选依赖：pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+COLUMNS = ('model', 'timestamp', 'input_tokens', 'output_tokens',
+           'cache_read_tokens', 'cache_creation_tokens', 'project', 'session_id')
+# 字符串列按字典编码
+DICT_COLUMNS = ('model', 'project', 'session_id')
+INT_COLUMNS = ('timestamp', 'input_tokens', 'output_tokens',
+               'cache_read_tokens', 'cache_creation_tokens')
+
+ROW_GROUP_SIZE = 1 << 20
+
+BINARY_MAGIC = b'APIUSE01'
+
+
+def timestamp_ms(timestamp: Optional[str]) -> int:
+    """ISO 8601 时间戳转换为 Unix 毫秒，无法解析时为 0"""
+    if not timestamp:
+        return 0
+    try:
+        return int(datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp() * 1000)
+    except ValueError:
+        return 0
+
+
+class BinaryUsageWriter:
+    """紧凑列式二进制格式
+
+    文件布局（小端）：
+        magic 'APIUSE01'
+        row group 0: 每列一段连续数组，按 8 字节对齐
+            model / project / session_id  uint32 字典编码
+            timestamp                     int64 Unix 毫秒（0 表示未知）
+            *_tokens                      int64
+        row group 1 ...
+        footer: UTF-8 JSON {"version", "rows", "columns", "dictionaries", "row_groups"}
+        uint64 footer 长度
+        magic 'APIUSE01'
+
+    row_groups 中记录每组的行数和各列的 (偏移, 字节数)，可以直接
+    numpy.frombuffer / mmap 按列读取。内存中最多保留一个 row group。
+    """
+
+    format = 'binary'
+
+    def __init__(self, path: Path, row_group_size: int = ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self._file = open(path, 'wb')
+        self._file.write(BINARY_MAGIC)
+        self._dictionaries: Dict[str, Dict[str, int]] = {name: {} for name in DICT_COLUMNS}
+        self._row_groups: List[dict] = []
+        self._reset()
+
+    def _reset(self):
+        self._columns = {name: array.array('I') for name in DICT_COLUMNS}
+        self._columns.update({name: array.array('q') for name in INT_COLUMNS})
+        self._pending = 0
+
+    def _code(self, column: str, value: Optional[str]) -> int:
+        codes = self._dictionaries[column]
+        value = value or ''
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def write(self, project: str, record):
+        columns = self._columns
+        columns['model'].append(self._code('model', record.model))
+        columns['project'].append(self._code('project', project))
+        columns['session_id'].append(self._code('session_id', record.session_id))
+        columns['timestamp'].append(timestamp_ms(record.timestamp))
+        columns['input_tokens'].append(record.input_tokens)
+        columns['output_tokens'].append(record.output_tokens)
+        columns['cache_read_tokens'].append(record.cache_read_tokens)
+        columns['cache_creation_tokens'].append(record.cache_creation_tokens)
+        self._pending += 1
+        if self._pending >= self.row_group_size:
+            self._flush_group()
+
+    def _flush_group(self):
+        if not self._pending:
+            return
+        group = {'rows': self._pending, 'columns': {}}
+        for name in COLUMNS:
+            data = self._columns[name]
+            if sys.byteorder != 'little':
+                data.byteswap()
+            offset = self._file.tell()
+            padding = -offset % 8
+            if padding:
+                self._file.write(b'\0' * padding)
+                offset += padding
+            self._file.write(data.tobytes())
+            group['columns'][name] = [offset, len(data) * data.itemsize]
+        self._row_groups.append(group)
+        self.rows += self._pending
+        self._reset()
+
+    def close(self):
+        self._flush_group()
+        footer = json.dumps({
+            'version': 1,
+            'rows': self.rows,
+            'columns': {name: ('uint32' if name in DICT_COLUMNS else 'int64') for name in COLUMNS},
+            'dictionaries': {name: list(codes) for name, codes in self._dictionaries.items()},
+            'row_groups': self._row_groups,
+        }, ensure_ascii=False).encode('utf-8')
+        self._file.write(footer)
+        self._file.write(struct.pack('<Q', len(footer)))
+        self._file.write(BINARY_MAGIC)
+        self._file.close()
+
+
+class ParquetUsageWriter:
+    """pyarrow Parquet 写入，字符串列使用字典编码，按 row group 分批写出"""
+
+    format = 'parquet'
+
+    def __init__(self, path: Path, row_group_size: int = ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self.schema = pa.schema([
+            ('model', pa.string()),
+            ('timestamp', pa.timestamp('ms', tz='UTC')),
+            ('input_tokens', pa.int64()),
+            ('output_tokens', pa.int64()),
+            ('cache_read_tokens', pa.int64()),
+            ('cache_creation_tokens', pa.int64()),
+            ('project', pa.string()),
+            ('session_id', pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(str(path), self.schema, compression='zstd',
+                                        use_dictionary=list(DICT_COLUMNS))
+        self._reset()
+
+    def _reset(self):
+        self._columns: Dict[str, list] = {name: [] for name in COLUMNS}
+
+    def write(self, project: str, record):
+        columns = self._columns
+        columns['model'].append(record.model)
+        ms = timestamp_ms(record.timestamp)
+        columns['timestamp'].append(ms if ms else None)
+        columns['input_tokens'].append(record.input_tokens)
+        columns['output_tokens'].append(record.output_tokens)
+        columns['cache_read_tokens'].append(record.cache_read_tokens)
+        columns['cache_creation_tokens'].append(record.cache_creation_tokens)
+        columns['project'].append(project)
+        columns['session_id'].append(record.session_id)
+        if len(columns['model']) >= self.row_group_size:
+            self._flush_group()
+
+    def _flush_group(self):
+        if not self._columns['model']:
+            return
+        batch = pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+        self._reset()
+
+    def close(self):
+        self._flush_group()
+        self._writer.close()
+
+
+def open_usage_writer(path: Path, fmt: str = 'auto'):
+    """按格式创建写入器；auto 在有 pyarrow 时用 Parquet，否则用二进制格式"""
+    if fmt == 'auto':
+        fmt = 'parquet' if HAS_PYARROW else 'binary'
+    if fmt == 'parquet':
+        if not HAS_PYARROW:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        return ParquetUsageWriter(path)
+    return BinaryUsageWriter(path)
+
+
+def export_usage(records: Iterable[Tuple[str, object]], path: Path, fmt: str = 'auto') -> Tuple[int, str]:
+    """把 (项目, UsageRecord) 流写入列式文件，返回 (行数, 实际格式)"""
+    writer = open_usage_writer(path, fmt)
+    try:
+        for project, record in records:
+            writer.write(project, record)
+    finally:
+        writer.close()
+    return writer.rows, writer.format
+
+
+def _read_binary(path: Path) -> Tuple[bytes, dict]:
+    """读取二进制导出文件，返回 (文件内容, footer)；不是二进制导出格式时返回 (b'', {})"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(BINARY_MAGIC):
+        return b'', {}
+    trailer = len(BINARY_MAGIC) + 8
+    if data[-len(BINARY_MAGIC):] != BINARY_MAGIC:
+        raise ValueError(f"{path}: truncated usage export")
+    footer_len, = struct.unpack('<Q', data[-trailer:-len(BINARY_MAGIC)])
+    return data, json.loads(data[-trailer - footer_len:-trailer])
+
+
+def load_columns(path: Path) -> Tuple[Dict[str, List[str]], Dict[str, object]]:
+    """以 NumPy 数组读取二进制导出文件（各 row group 拼接），返回 (字典, {列名: ndarray})"""
+    import numpy as np
+
+    data, footer = _read_binary(path)
+    if not footer:
+        raise ValueError(f"{path} is not a binary usage export")
+    columns = {}
+    for name in COLUMNS:
+        dtype = np.dtype('<u4' if name in DICT_COLUMNS else '<i8')
+        parts = [np.frombuffer(data, dtype=dtype, count=length // dtype.itemsize, offset=offset)
+                 for offset, length in (group['columns'][name] for group in footer['row_groups'])]
+        columns[name] = np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+    return footer['dictionaries'], columns
+
+
+def read_usage_export(path: Path) -> Dict[str, list]:
+    """读回导出文件，返回 {列名: 值列表}（字符串列已解码）"""
+    data, footer = _read_binary(path)
+    if not footer:
+        if not HAS_PYARROW:
+            raise RuntimeError(f"{path} is not a binary usage export and pyarrow is not installed")
+        return pq.read_table(str(path)).to_pydict()
+
+    result: Dict[str, list] = {name: [] for name in COLUMNS}
+    for group in footer['row_groups']:
+        for name, (offset, length) in group['columns'].items():
+            column = array.array('I' if name in DICT_COLUMNS else 'q')
+            column.frombytes(data[offset:offset + length])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            if name in DICT_COLUMNS:
+                values = footer['dictionaries'][name]
+                result[name].extend(values[code] for code in column)
+            else:
+                result[name].extend(column)
+    return result
@@ -0,0 +1,19 @@
+"""rnb-narrative 工具测试的公共配置"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent / "tools"
+sys.path.insert(0, str(TOOLS_DIR))
+
+
+@pytest.fixture(scope="session")
+def pipeline():
+    """narrative-pipeline.py 文件名带连字符，按路径加载"""
+    spec = importlib.util.spec_from_file_location("narrative_pipeline", TOOLS_DIR / "narrative-pipeline.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,298 @@
+"""Tests for ModelClient against the local stub server."""
+
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+from model_client import ModelAPIError, ModelClient, ModelProvider, provider_config
+from response_cache import ResponseCache
+from stub_model_server import DEFAULT_REPLY, StubModelServer
+
+REPLY = json.dumps(DEFAULT_REPLY, ensure_ascii=False)
+
+
+class FlakyStubServer(StubModelServer):
+    """前 failures 个请求返回 status，之后正常回复"""
+
+    def __init__(self, reply: str, failures: int, status: int = 503, **kwargs):
+        super().__init__(reply, **kwargs)
+        self.failures = failures
+        self.status = status
+
+    async def respond(self, writer, method, path, body):
+        if self.failures > 0:
+            self.failures -= 1
+            self.requests += 1
+            self.errors += 1
+            self._write(writer, self.status, {"error": {"type": "overloaded_error"}},
+                        {"Retry-After": "0"} if self.status == 429 else None)
+            return True
+        return await super().respond(writer, method, path, body)
+
+
+@asynccontextmanager
+async def running(server: StubModelServer, cache: ResponseCache = None, **overrides):
+    """在随机端口启动 stub 服务，返回指向它的 ModelClient"""
+    srv = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = srv.sockets[0].getsockname()[1]
+    settings = dict(base_url=f"http://127.0.0.1:{port}", api_key="test",
+                    requests_per_second=1000.0, burst=1000, backoff_base=0.001, backoff_max=0.01)
+    settings.update(overrides)
+    configs = {provider: provider_config(provider, **settings) for provider in ModelProvider}
+    client = ModelClient(configs, cache=cache)
+    try:
+        yield client
+    finally:
+        await client.close()
+        srv.close()
+        await srv.wait_closed()
+
+
+class TestComplete:
+    """非流式请求"""
+
+    @pytest.mark.parametrize("provider", [ModelProvider.CLAUDE, ModelProvider.DEEPSEEK])
+    def test_returns_reply_text(self, provider) -> None:
+        async def run():
+            async with running(StubModelServer(REPLY)) as client:
+                return await client.complete(provider, "prompt"), client.stats[provider]
+
+        text, stats = asyncio.run(run())
+        assert text == REPLY
+        assert stats.succeeded == 1
+        assert stats.output_tokens > 0
+
+    @pytest.mark.parametrize("status", [429, 503, 529])
+    def test_retries_retryable_status(self, status) -> None:
+        server = FlakyStubServer(REPLY, failures=2, status=status)
+
+        async def run():
+            async with running(server) as client:
+                return await client.complete(ModelProvider.CLAUDE, "prompt"), client.stats[ModelProvider.CLAUDE]
+
+        text, stats = asyncio.run(run())
+        assert text == REPLY
+        assert stats.retries == 2
+        assert stats.failed == 0
+        assert server.requests == 3
+
+    def test_gives_up_after_max_retries(self) -> None:
+        server = FlakyStubServer(REPLY, failures=10)
+
+        async def run():
+            async with running(server, max_retries=2) as client:
+                await client.complete(ModelProvider.CLAUDE, "prompt")
+
+        with pytest.raises(ModelAPIError) as info:
+            asyncio.run(run())
+        assert info.value.status == 503
+        assert server.requests == 3
+
+    def test_does_not_retry_client_error(self) -> None:
+        server = FlakyStubServer(REPLY, failures=1, status=400)
+
+        async def run():
+            async with running(server) as client:
+                await client.complete(ModelProvider.CLAUDE, "prompt")
+
+        with pytest.raises(ModelAPIError) as info:
+            asyncio.run(run())
+        assert info.value.status == 400
+        assert not info.value.retryable
+        assert server.requests == 1
+
+
+class TestKeepAlive:
+    """连接复用"""
+
+    def test_sequential_requests_reuse_one_connection(self) -> None:
+        server = StubModelServer(REPLY)
+
+        async def run():
+            async with running(server) as client:
+                for i in range(5):
+                    await client.complete(ModelProvider.CLAUDE, f"prompt {i}")
+                return client.pool.connections_reused
+
+        reused = asyncio.run(run())
+        assert server.connections == 1
+        assert server.requests == 5
+        assert reused == 4
+
+    def test_error_responses_keep_connection(self) -> None:
+        server = FlakyStubServer(REPLY, failures=2)
+
+        async def run():
+            async with running(server) as client:
+                await client.complete(ModelProvider.CLAUDE, "prompt")
+
+        asyncio.run(run())
+        assert server.connections == 1
+
+    def test_timeout_on_reused_connection_closes_it(self) -> None:
+        server = StubModelServer(REPLY)
+
+        async def run():
+            async with running(server, timeout=0.05, max_retries=0) as client:
+                await client.complete(ModelProvider.CLAUDE, "prompt")
+                [(_reader, writer)] = [conn for conns in client.pool._idle.values() for conn in conns]
+                server.latency = 0.5
+                with pytest.raises(ModelAPIError):
+                    await client.complete(ModelProvider.CLAUDE, "prompt 2")
+                return writer.is_closing()
+
+        assert asyncio.run(run())
+        assert server.connections == 1
+
+    def test_concurrent_requests_are_all_answered(self) -> None:
+        server = StubModelServer(REPLY, latency=0.01)
+
+        async def run():
+            async with running(server) as client:
+                return await asyncio.gather(*(
+                    client.complete(ModelProvider.DEEPSEEK, f"prompt {i}") for i in range(20)))
+
+        assert asyncio.run(run()) == [REPLY] * 20
+        assert server.max_active > 1
+        assert server.connections <= 20
+
+
+class SlowStartStubServer(StubModelServer):
+    """前 slow 个请求延迟 delay 秒，之后立即回复；arrivals 为各请求到达的时间"""
+
+    def __init__(self, reply: str, slow: int, delay: float, **kwargs):
+        super().__init__(reply, **kwargs)
+        self.slow = slow
+        self.delay = delay
+        self.arrivals = []
+
+    async def respond(self, writer, method, path, body):
+        self.arrivals.append(time.monotonic())
+        if self.slow > 0:
+            self.slow -= 1
+            await asyncio.sleep(self.delay)
+        return await super().respond(writer, method, path, body)
+
+
+class TestRateLimit:
+    """限速与并发上限"""
+
+    def test_no_burst_when_concurrency_slots_free_up(self) -> None:
+        # 4 个慢请求占满并发名额期间，排队的请求不能预先拿到令牌，名额空出后仍按 rps 发出
+        server = SlowStartStubServer(REPLY, slow=4, delay=0.5)
+
+        async def run():
+            async with running(server, requests_per_second=20.0, burst=1, max_concurrency=4) as client:
+                await asyncio.gather(*(client.complete(ModelProvider.CLAUDE, f"prompt {i}") for i in range(10)))
+
+        asyncio.run(run())
+        released = server.arrivals[4:]
+        assert len(released) == 6
+        gaps = [later - earlier for earlier, later in zip(released, released[1:])]
+        assert min(gaps) > 0.03
+
+    def test_rate_is_respected(self) -> None:
+        server = StubModelServer(REPLY)
+
+        async def run():
+            async with running(server, requests_per_second=50.0, burst=1) as client:
+                await asyncio.gather(*(client.complete(ModelProvider.CLAUDE, f"prompt {i}") for i in range(11)))
+
+        asyncio.run(run())
+        assert server.request_times[-1] - server.request_times[0] >= 0.18
+
+
+class TestStreaming:
+    """SSE 流式输出"""
+
+    @pytest.mark.parametrize("provider", [ModelProvider.CLAUDE, ModelProvider.GPT])
+    def test_stream_yields_reply_in_chunks(self, provider) -> None:
+        server = StubModelServer(REPLY, chunk_size=8)
+
+        async def run():
+            async with running(server) as client:
+                return [delta async for delta in client.stream(provider, "prompt")], client.stats[provider]
+
+        deltas, stats = asyncio.run(run())
+        assert len(deltas) > 1
+        assert "".join(deltas) == REPLY
+        assert stats.output_tokens == len(REPLY) // 4
+
+    def test_on_text_receives_every_delta(self) -> None:
+        received = []
+
+        async def run():
+            async with running(StubModelServer(REPLY, chunk_size=8)) as client:
+                return await client.complete(ModelProvider.CLAUDE, "prompt", on_text=received.append)
+
+        assert asyncio.run(run()) == REPLY
+        assert "".join(received) == REPLY
+
+    def test_stream_retries_before_first_delta(self) -> None:
+        server = FlakyStubServer(REPLY, failures=1, status=529)
+
+        async def run():
+            async with running(server) as client:
+                return "".join([d async for d in client.stream(ModelProvider.CLAUDE, "prompt")])
+
+        assert asyncio.run(run()) == REPLY
+        assert server.requests == 2
+
+    def test_connection_reused_after_stream(self) -> None:
+        server = StubModelServer(REPLY)
+
+        async def run():
+            async with running(server) as client:
+                for _ in range(3):
+                    async for _delta in client.stream(ModelProvider.CLAUDE, "prompt"):
+                        pass
+
+        asyncio.run(run())
+        assert server.connections == 1
+
+
+class TestCachedClient:
+    """启用回复缓存时的行为"""
+
+    def test_repeated_prompt_hits_cache(self, tmp_path) -> None:
+        server = StubModelServer(REPLY)
+        cache = ResponseCache(tmp_path / "cache.db")
+
+        async def run():
+            async with running(server, cache=cache) as client:
+                first = await client.complete(ModelProvider.CLAUDE, "prompt")
+                second = await client.complete(ModelProvider.CLAUDE, "prompt")
+                return first, second, cache.stats()
+
+        first, second, stats = asyncio.run(run())
+        assert first == second == REPLY
+        assert server.requests == 1
+        assert stats["hits"] == 1
+
+    def test_concurrent_identical_prompts_share_one_request(self, tmp_path) -> None:
+        server = StubModelServer(REPLY, latency=0.05)
+        cache = ResponseCache(tmp_path / "cache.db")
+
+        async def run():
+            async with running(server, cache=cache) as client:
+                return await asyncio.gather(*(
+                    client.complete(ModelProvider.CLAUDE, "prompt") for _ in range(5)))
+
+        assert asyncio.run(run()) == [REPLY] * 5
+        assert server.requests == 1
+
+    def test_forget_drops_cached_reply(self, tmp_path) -> None:
+        server = StubModelServer(REPLY)
+        cache = ResponseCache(tmp_path / "cache.db")
+
+        async def run():
+            async with running(server, cache=cache) as client:
+                await client.complete(ModelProvider.CLAUDE, "prompt")
+                client.forget(ModelProvider.CLAUDE, "prompt")
+                await client.complete(ModelProvider.CLAUDE, "prompt")
+
+        asyncio.run(run())
+        assert server.requests == 2
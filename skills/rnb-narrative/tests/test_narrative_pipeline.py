@@ -0,0 +1,116 @@
+"""Tests for batch generation and resume in narrative-pipeline.py."""
+
+import asyncio
+import json
+
+from model_client import ModelProvider
+from stub_model_server import DEFAULT_REPLY
+
+
+class FakeClient:
+    """直接返回固定回复的 ModelClient 替身"""
+
+    def __init__(self, reply: str = json.dumps(DEFAULT_REPLY, ensure_ascii=False)):
+        self.reply = reply
+        self.prompts = []
+
+    async def complete(self, provider, prompt, system=None, max_tokens=None, temperature=None, on_text=None):
+        self.prompts.append(prompt)
+        return self.reply
+
+    def forget(self, provider, prompt, system=None, max_tokens=None, temperature=None):
+        pass
+
+
+def write_lines(path, text: str):
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+
+class TestCompletedTriggerIds:
+    """续跑时读取已完成的 trigger"""
+
+    def test_missing_file(self, pipeline, tmp_path) -> None:
+        assert pipeline._completed_trigger_ids(str(tmp_path / "none.jsonl")) == set()
+
+    def test_failed_records_are_not_done(self, pipeline, tmp_path) -> None:
+        path = write_lines(tmp_path / "out.jsonl",
+                           json.dumps({"id": "a", "events": []}) + "\n" +
+                           json.dumps({"id": "b", "error": "HTTP 529"}) + "\n" +
+                           json.dumps({"id": 3, "events": []}) + "\n")
+        assert pipeline._completed_trigger_ids(path) == {"a", "3"}
+
+    def test_partial_last_line_is_truncated(self, pipeline, tmp_path) -> None:
+        complete = json.dumps({"id": "a", "events": []}) + "\n"
+        path = write_lines(tmp_path / "out.jsonl", complete + '{"id": "b", "ev')
+        assert pipeline._completed_trigger_ids(path) == {"a"}
+        with open(path, "rb") as f:
+            assert f.read() == complete.encode("utf-8")
+
+    def test_malformed_lines_are_skipped(self, pipeline, tmp_path) -> None:
+        path = write_lines(tmp_path / "out.jsonl",
+                           "not json\n[1, 2]\n\"text\"\nnull\n{\"events\": []}\n"
+                           "{\"id\": null}\n" + json.dumps({"id": "ok"}) + "\n")
+        assert pipeline._completed_trigger_ids(path) == {"ok"}
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestEventChainBatch:
+    """批量生成"""
+
+    def run_batch(self, pipeline, batch_file, output_file, client):
+        return asyncio.run(pipeline.run_event_chain_batch(
+            str(batch_file), str(output_file), ModelProvider.CLAUDE, client, concurrency=2))
+
+    def test_corrupt_trigger_line_does_not_stop_batch(self, pipeline, tmp_path) -> None:
+        batch = tmp_path / "triggers.jsonl"
+        batch.write_text(json.dumps({"id": "a", "trigger": "选秀"}) + "\n"
+                         "{not json\n"
+                         "[1, 2]\n"
+                         + json.dumps({"id": "b", "trigger": "绯闻"}) + "\n")
+        output = tmp_path / "chains.jsonl"
+        stats = self.run_batch(pipeline, batch, output, FakeClient())
+        assert (stats.completed, stats.failed) == (2, 2)
+        records = {record["id"]: record for record in read_records(output)}
+        assert set(records) == {"a", "b", "2", "3"}
+        assert "line 2" in records["2"]["error"]
+        assert len(records["a"]["events"]) == 2
+
+        # 续跑时已完成的跳过，坏行再次记为失败而不是中断
+        client = FakeClient()
+        stats = self.run_batch(pipeline, batch, output, client)
+        assert (stats.completed, stats.failed, stats.skipped) == (0, 2, 2)
+        assert client.prompts == []
+
+    def test_failed_chain_is_retried_on_resume(self, pipeline, tmp_path) -> None:
+        batch = tmp_path / "triggers.jsonl"
+        batch.write_text(json.dumps({"id": "a", "trigger": "选秀"}) + "\n")
+        output = tmp_path / "chains.jsonl"
+        stats = self.run_batch(pipeline, batch, output, FakeClient("not json"))
+        assert stats.failed == 1
+        stats = self.run_batch(pipeline, batch, output, FakeClient())
+        assert stats.completed == 1
+        assert pipeline._completed_trigger_ids(str(output)) == {"a"}
+
+
+class TestBatchStats:
+    """延迟百分位"""
+
+    def test_nearest_rank_percentile(self, pipeline) -> None:
+        stats = pipeline.BatchStats(latencies=[float(i) for i in range(1, 101)])
+        assert stats.percentile(50) == 50.0
+        assert stats.percentile(95) == 95.0
+        assert stats.percentile(99) == 99.0
+        assert stats.percentile(100) == 100.0
+        assert stats.percentile(0) == 1.0
+
+    def test_small_samples(self, pipeline) -> None:
+        stats = pipeline.BatchStats(latencies=[3.0, 1.0, 2.0, 4.0])
+        assert stats.percentile(50) == 2.0
+        assert stats.percentile(75) == 3.0
+        assert stats.percentile(99) == 4.0
+        assert pipeline.BatchStats().percentile(50) == 0.0
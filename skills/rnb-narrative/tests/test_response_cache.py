@@ -0,0 +1,77 @@
+"""Tests for the SQLite response cache."""
+
+import time
+
+from response_cache import ResponseCache, cache_key
+
+
+class TestCacheKey:
+    """缓存键"""
+
+    def test_independent_of_argument_order(self) -> None:
+        assert cache_key(model="m", prompt="p") == cache_key(prompt="p", model="m")
+
+    def test_differs_by_any_parameter(self) -> None:
+        base = cache_key(model="m", prompt="p", temperature=None)
+        assert cache_key(model="m", prompt="p", temperature=0.5) != base
+        assert cache_key(model="m2", prompt="p", temperature=None) != base
+
+
+class TestResponseCache:
+    """命中、淘汰与删除"""
+
+    def test_miss_then_hit(self, tmp_path) -> None:
+        cache = ResponseCache(tmp_path / "cache.db")
+        assert cache.get("k") is None
+        cache.put("k", "回复")
+        assert cache.get("k") == "回复"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+        assert stats["bytes"] == len("回复".encode("utf-8"))
+        cache.close()
+
+    def test_persists_across_instances(self, tmp_path) -> None:
+        cache = ResponseCache(tmp_path / "cache.db")
+        cache.put("k", "value")
+        cache.close()
+        reopened = ResponseCache(tmp_path / "cache.db")
+        assert reopened.get("k") == "value"
+        assert reopened.total_bytes == 5
+        reopened.close()
+
+    def test_replace_updates_size(self, tmp_path) -> None:
+        cache = ResponseCache(tmp_path / "cache.db")
+        cache.put("k", "x" * 10)
+        cache.put("k", "x" * 4)
+        assert cache.total_bytes == 4
+        cache.close()
+
+    def test_evicts_least_recently_used(self, tmp_path) -> None:
+        cache = ResponseCache(tmp_path / "cache.db", max_bytes=300)
+        for key in ("a", "b", "c"):
+            cache.put(key, "x" * 100)
+            time.sleep(0.01)
+        cache.get("a")
+        cache.put("d", "x" * 100)
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("d") is not None
+        assert cache.total_bytes <= 270
+        assert cache.evicted >= 1
+        cache.close()
+
+    def test_oversized_response_is_not_stored(self, tmp_path) -> None:
+        cache = ResponseCache(tmp_path / "cache.db", max_bytes=10)
+        cache.put("k", "x" * 11)
+        assert cache.get("k") is None
+        assert cache.total_bytes == 0
+        cache.close()
+
+    def test_discard(self, tmp_path) -> None:
+        cache = ResponseCache(tmp_path / "cache.db")
+        cache.put("k", "value")
+        cache.discard("k")
+        cache.discard("missing")
+        assert cache.get("k") is None
+        assert cache.total_bytes == 0
+        cache.close()
@@ -0,0 +1,128 @@
+"""Tests for world state loading and SQLite snapshots."""
+
+import json
+import sqlite3
+import sys
+
+import pytest
+
+from world_state import CharacterState, SnapshotCharacters, build_snapshot, is_snapshot, open_world_state
+
+WORLD = {
+    "date": "2005-03-01",
+    "global_trends": ["选秀热"],
+    "industry_events": ["金曲奖"],
+    "character_states": {
+        f"char_{i:03d}": {
+            "character_id": f"char_{i:03d}", "fame": i, "wealth": i * 10, "stress": 5,
+            "relationships": {f"char_{(i + 1) % 50:03d}": 20},
+            "tags": ["singer", "rookie"],
+        }
+        for i in range(50)
+    },
+}
+
+
+@pytest.fixture
+def world_json(tmp_path):
+    path = tmp_path / "world.json"
+    path.write_text(json.dumps(WORLD, ensure_ascii=False))
+    return str(path)
+
+
+@pytest.fixture
+def world_db(tmp_path, world_json):
+    path = tmp_path / "world.db"
+    build_snapshot(world_json, str(path))
+    return str(path)
+
+
+class TestCharacterState:
+    """__slots__ 角色状态"""
+
+    def test_has_no_instance_dict(self) -> None:
+        state = CharacterState.from_dict(WORLD["character_states"]["char_001"])
+        assert not hasattr(state, "__dict__")
+        with pytest.raises(AttributeError):
+            state.nickname = "x"
+
+    def test_from_dict_defaults_and_round_trip(self) -> None:
+        state = CharacterState.from_dict({}, "char_999")
+        assert (state.fame, state.wealth, state.stress) == (0, 0, 0)
+        assert state.relationships == {} and state.tags == []
+        data = WORLD["character_states"]["char_001"]
+        assert CharacterState.from_dict(data).to_dict() == data
+
+    def test_ids_and_tags_are_interned(self) -> None:
+        a = CharacterState.from_dict(WORLD["character_states"]["char_001"])
+        b = CharacterState.from_dict(json.loads(json.dumps(WORLD["character_states"]["char_002"])))
+        assert a.tags[0] is b.tags[0]
+        assert a.tags[0] is sys.intern("singer")
+
+
+class TestSnapshot:
+    """SQLite 快照往返"""
+
+    def test_round_trip_matches_json(self, world_json, world_db) -> None:
+        assert is_snapshot(world_db) and not is_snapshot(world_json)
+        with open_world_state(world_json) as from_json, open_world_state(world_db) as from_db:
+            assert isinstance(from_db.character_states, SnapshotCharacters)
+            assert (from_db.date, from_db.global_trends, from_db.industry_events) == \
+                (from_json.date, from_json.global_trends, from_json.industry_events)
+            assert len(from_db.character_states) == 50
+            assert list(from_db.character_states) == sorted(from_json.character_states)
+            for cid, state in from_json.character_states.items():
+                assert from_db.character_states[cid] == state
+
+    def test_missing_character(self, world_db) -> None:
+        with open_world_state(world_db) as state:
+            assert "char_999" not in state.character_states
+            assert state.character_states.get("char_999") is None
+            with pytest.raises(KeyError):
+                state.character_states["char_999"]
+
+    def test_lru_cache_is_bounded(self, world_db) -> None:
+        conn = sqlite3.connect(world_db)
+        characters = SnapshotCharacters(conn, cache_size=4)
+        first = characters["char_000"]
+        for i in range(1, 10):
+            characters[f"char_{i:03d}"]
+        assert len(characters._cache) == 4
+        assert "char_000" not in characters._cache
+        assert characters["char_000"] == first
+        characters.close()
+
+    def test_get_characters_uses_one_lookup(self, world_json, world_db) -> None:
+        ids = ["char_001", "char_999", "char_042"]
+        with open_world_state(world_json) as from_json, open_world_state(world_db) as from_db:
+            expected = from_json.get_characters(ids)
+            assert set(expected) == {"char_001", "char_042"}
+            assert from_db.get_characters(ids) == expected
+            assert set(from_db.character_states._cache) == {"char_001", "char_042"}
+
+    def test_close_releases_connection(self, world_db) -> None:
+        state = open_world_state(world_db)
+        state.close()
+        with pytest.raises(sqlite3.ProgrammingError):
+            state.character_states["char_001"]
+
+    def test_rejects_other_snapshot_version(self, world_db) -> None:
+        conn = sqlite3.connect(world_db)
+        conn.execute("UPDATE meta SET value = '0' WHERE key = 'version'")
+        conn.commit()
+        conn.close()
+        with pytest.raises(ValueError):
+            open_world_state(world_db)
+
+
+class TestEventChainPrompt:
+    """prompt 中的角色描述"""
+
+    def test_prompt_describes_participants_from_snapshot(self, pipeline, world_db) -> None:
+        gen = pipeline.NarrativeGenerator(client=object())
+        with open_world_state(world_db) as state:
+            gen.world_state = state
+            prompt = gen._build_event_chain_prompt("选秀", {}, ["char_007", "char_999"], 3)
+        assert "- char_007: char_007, 知名度:7, 财富:70" in prompt
+        assert "- char_999: char_999" in prompt
+        assert "2005-03-01" in prompt
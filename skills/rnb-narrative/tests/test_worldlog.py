@@ -0,0 +1,68 @@
+"""Tests for the append-only WorldLog format and converters."""
+
+import json
+
+import pytest
+
+from worldlog import HEADER, WorldLogWriter, convert_to_json, convert_to_jsonl, iter_worldlog, write_worldlog_json
+
+EVENTS = [
+    {"id": "evt_001", "timestamp": "2005-03-01", "type": "audition", "participants": ["char_001"],
+     "payload": {"description": "参加选秀海选", "consequences": {"char_001": {"fame": 5}}}},
+    {"id": "evt_002", "timestamp": "2005-04-15", "type": "scandal", "participants": [],
+     "payload": {"nested": [1, 2.5, None, True, {"empty": {}}, []]}},
+]
+
+
+def legacy_json(events, version="1.0") -> str:
+    return json.dumps({"version": version, "events": events}, indent=2, ensure_ascii=False)
+
+
+class TestWriteWorldlogJson:
+    """旧格式输出与 json.dump(indent=2) 逐字节相同"""
+
+    @pytest.mark.parametrize("events", [[], EVENTS[:1], EVENTS])
+    def test_byte_identical_to_json_dump(self, tmp_path, events) -> None:
+        path = tmp_path / "worldlog.json"
+        write_worldlog_json(str(path), iter(events))
+        assert path.read_text() == legacy_json(events)
+
+
+class TestWorldLogWriter:
+    """追加写入"""
+
+    def test_writes_header_and_events(self, tmp_path) -> None:
+        path = tmp_path / "log.jsonl"
+        with WorldLogWriter(str(path)) as writer:
+            writer.append(EVENTS)
+        lines = path.read_text().splitlines()
+        assert json.loads(lines[0]) == HEADER
+        assert list(iter_worldlog(str(path))) == EVENTS
+
+    def test_reopen_appends_after_partial_line(self, tmp_path) -> None:
+        path = tmp_path / "log.jsonl"
+        with WorldLogWriter(str(path)) as writer:
+            writer.append(EVENTS[:1])
+        with open(path, "ab") as f:
+            f.write(b'{"id": "evt_half"')
+        with WorldLogWriter(str(path)) as writer:
+            writer.append(EVENTS[1:])
+        assert list(iter_worldlog(str(path))) == EVENTS
+
+    def test_refuses_legacy_document(self, tmp_path) -> None:
+        path = tmp_path / "worldlog.json"
+        path.write_text(legacy_json(EVENTS))
+        with pytest.raises(ValueError):
+            WorldLogWriter(str(path))
+        assert path.read_text() == legacy_json(EVENTS)
+
+
+class TestConverters:
+    """两种格式之间的转换"""
+
+    def test_round_trip(self, tmp_path) -> None:
+        legacy = tmp_path / "worldlog.json"
+        legacy.write_text(legacy_json(EVENTS))
+        assert convert_to_jsonl(str(legacy), str(tmp_path / "log.jsonl")) == 2
+        assert convert_to_json(str(tmp_path / "log.jsonl"), str(tmp_path / "back.json")) == 2
+        assert (tmp_path / "back.json").read_text() == legacy.read_text()
@@ -0,0 +1,688 @@
+#!/usr/bin/env python3
+"""
+RNB 模型客户端
+按 ModelProvider 区分的异步模型调用（Claude Messages API / OpenAI 兼容的 Chat Completions）
+
+- 所有请求共享一个 HTTP/1.1 keep-alive 连接池（纯标准库 asyncio 实现，无外部依赖）
+- 每个 provider 独立的令牌桶限速和并发上限
+- 429 / 5xx / 连接错误按指数退避 + 全抖动重试，遵守 Retry-After
+- 支持 SSE 流式输出
+- 给出 ResponseCache 时 complete() 先查本地缓存，相同请求同时只发出一次
+- base URL 可通过环境变量 RNB_<PROVIDER>_BASE_URL 或 ProviderConfig 指定，
+  便于对接本地 stub 服务（见 stub_model_server.py）
+"""
+
+import asyncio
+import json
+import os
+import random
+import ssl
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from response_cache import ResponseCache, cache_key
+
+
+class ModelProvider(Enum):
+    CLAUDE = "claude"
+    DEEPSEEK = "deepseek"
+    GPT = "gpt"
+
+
+# 可重试的 HTTP 状态：限流、服务端错误、Anthropic 过载
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class ModelAPIError(Exception):
+    """模型 API 调用失败"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = False,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+@dataclass
+class ProviderConfig:
+    """单个 provider 的接入与限流配置"""
+    base_url: str
+    api: str                        # "anthropic" / "openai"
+    model: str
+    api_key_env: str
+    requests_per_second: float = 5.0
+    burst: int = 10
+    max_concurrency: int = 16
+    max_tokens: int = 4096
+    timeout: float = 300.0          # 单次请求总超时（流式时为相邻两块数据之间的超时）
+    max_retries: int = 4
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    api_key: Optional[str] = None   # 未指定时从 api_key_env 读取
+
+    def resolved_api_key(self) -> str:
+        return self.api_key if self.api_key is not None else os.environ.get(self.api_key_env, "")
+
+
+DEFAULT_PROVIDERS: Dict[ModelProvider, ProviderConfig] = {
+    ModelProvider.CLAUDE: ProviderConfig(
+        base_url="https://api.anthropic.com", api="anthropic",
+        model="claude-opus-4-5", api_key_env="ANTHROPIC_API_KEY"),
+    ModelProvider.DEEPSEEK: ProviderConfig(
+        base_url="https://api.deepseek.com", api="openai",
+        model="deepseek-chat", api_key_env="DEEPSEEK_API_KEY",
+        requests_per_second=10.0, burst=20, max_concurrency=64),
+    ModelProvider.GPT: ProviderConfig(
+        base_url="https://api.openai.com/v1", api="openai",
+        model="gpt-5.2", api_key_env="OPENAI_API_KEY"),
+}
+
+
+def provider_config(provider: ModelProvider, **overrides) -> ProviderConfig:
+    """默认配置 + 环境变量 RNB_<PROVIDER>_BASE_URL / _MODEL / _RPS / _CONCURRENCY + 显式参数"""
+    base = DEFAULT_PROVIDERS[provider]
+    prefix = f"RNB_{provider.name}_"
+    env = {
+        "base_url": os.environ.get(prefix + "BASE_URL"),
+        "model": os.environ.get(prefix + "MODEL"),
+        "requests_per_second": os.environ.get(prefix + "RPS"),
+        "max_concurrency": os.environ.get(prefix + "CONCURRENCY"),
+    }
+    values = dict(base.__dict__)
+    for key, value in env.items():
+        if value:
+            values[key] = type(values[key])(value)
+    values.update({k: v for k, v in overrides.items() if v is not None})
+    return ProviderConfig(**values)
+
+
+# ---------------------------------------------------------------------------
+# HTTP 连接池
+# ---------------------------------------------------------------------------
+
+class HTTPResponse:
+    """HTTP/1.1 响应；body 按需读取，读完后连接归还连接池"""
+
+    def __init__(self, pool: "HTTPConnectionPool", key: Tuple, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]):
+        self._pool = pool
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self.status = status
+        self.headers = headers
+        self._done = False
+
+    def _keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+    async def iter_chunks(self, idle_timeout: Optional[float] = None) -> AsyncIterator[bytes]:
+        """逐块产出 body（支持 Content-Length / chunked / 读到连接关闭）"""
+        reader = self._reader
+
+        async def read(coro):
+            return await asyncio.wait_for(coro, idle_timeout) if idle_timeout else await coro
+
+        try:
+            if "chunked" in self.headers.get("transfer-encoding", "").lower():
+                while True:
+                    size_line = await read(reader.readline())
+                    size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                    if size == 0:
+                        # trailer 直到空行
+                        while (await read(reader.readline())).strip():
+                            pass
+                        break
+                    data = await read(reader.readexactly(size))
+                    await read(reader.readexactly(2))
+                    yield data
+            elif "content-length" in self.headers:
+                remaining = int(self.headers["content-length"])
+                while remaining > 0:
+                    data = await read(reader.read(min(remaining, 65536)))
+                    if not data:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    remaining -= len(data)
+                    yield data
+            else:
+                while True:
+                    data = await read(reader.read(65536))
+                    if not data:
+                        break
+                    yield data
+                self.headers["connection"] = "close"
+        except BaseException:
+            self.close()
+            raise
+        self._done = True
+        self.release()
+
+    async def read(self, idle_timeout: Optional[float] = None) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks(idle_timeout)])
+
+    async def iter_lines(self, idle_timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """按行产出 body（用于 SSE）"""
+        buffer = b""
+        async for chunk in self.iter_chunks(idle_timeout):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line.rstrip(b"\r").decode("utf-8", errors="replace")
+        if buffer:
+            yield buffer.rstrip(b"\r").decode("utf-8", errors="replace")
+
+    def release(self):
+        """body 已读完且可以复用时归还连接，否则关闭"""
+        if self._writer is None:
+            return
+        if self._done and self._keep_alive():
+            self._pool._put(self._key, self._reader, self._writer)
+            self._writer = None
+        else:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._pool._discard(self._key)
+
+
+class HTTPConnectionPool:
+    """按 (scheme, host, port) 复用 keep-alive 连接
+
+    每个主机最多 max_per_host 条连接（使用中 + 空闲），超出的请求排队等待。
+    """
+
+    def __init__(self, max_per_host: int = 64, connect_timeout: float = 10.0):
+        self.max_per_host = max_per_host
+        self.connect_timeout = connect_timeout
+        self._idle: Dict[Tuple, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        self._slots: Dict[Tuple, asyncio.Semaphore] = {}
+        self._ssl = ssl.create_default_context()
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def _slot(self, key: Tuple) -> asyncio.Semaphore:
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = asyncio.Semaphore(self.max_per_host)
+        return slot
+
+    def _put(self, key: Tuple, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._idle.setdefault(key, []).append((reader, writer))
+        self._slot(key).release()
+
+    def _discard(self, key: Tuple):
+        self._slot(key).release()
+
+    async def _connect(self, key: Tuple):
+        scheme, host, port = key
+        self.connections_opened += 1
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl if scheme == "https" else None,
+                                    server_hostname=host if scheme == "https" else None),
+            self.connect_timeout)
+
+    async def request(self, method: str, url: str, headers: Dict[str, str], body: bytes = b"",
+                      timeout: Optional[float] = None) -> HTTPResponse:
+        """发送请求并读取到响应头；调用方需要读完 body 或调用 close()"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}",
+                 f"Content-Length: {len(body)}", "Connection: keep-alive"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+        await self._slot(key).acquire()
+        try:
+            idle = self._idle.get(key)
+            while idle:
+                reader, writer = idle.pop()
+                if writer.is_closing() or reader.at_eof():
+                    writer.close()
+                    continue
+                try:
+                    # 服务端可能已关闭空闲连接：还没收到任何响应时换新连接重发
+                    response = await self._send(key, reader, writer, payload, timeout)
+                except (ConnectionError, asyncio.IncompleteReadError, _EmptyResponse):
+                    writer.close()
+                    continue
+                except BaseException:
+                    # 超时、取消等：连接状态未知，不能放回空闲池
+                    writer.close()
+                    raise
+                self.connections_reused += 1
+                return response
+            reader, writer = await self._connect(key)
+            try:
+                return await self._send(key, reader, writer, payload, timeout)
+            except _EmptyResponse:
+                writer.close()
+                raise ConnectionResetError("connection closed before response")
+            except BaseException:
+                writer.close()
+                raise
+        except BaseException:
+            self._slot(key).release()
+            raise
+
+    async def _send(self, key: Tuple, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                    payload: bytes, timeout: Optional[float]) -> HTTPResponse:
+        writer.write(payload)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        if not status_line:
+            raise _EmptyResponse()
+        try:
+            status = int(status_line.split(None, 2)[1])
+        except (IndexError, ValueError):
+            raise ConnectionError(f"malformed status line: {status_line[:80]!r}")
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return HTTPResponse(self, key, reader, writer, status, headers)
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+class _EmptyResponse(Exception):
+    """连接在返回状态行之前被关闭"""
+
+
+# ---------------------------------------------------------------------------
+# 限速
+# ---------------------------------------------------------------------------
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多突发 capacity 个；rate <= 0 表示不限速"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # 持锁等待，保证按到达顺序发放
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ---------------------------------------------------------------------------
+# Provider 协议适配
+# ---------------------------------------------------------------------------
+
+class _AnthropicAPI:
+    path = "/v1/messages"
+
+    @staticmethod
+    def headers(api_key: str) -> Dict[str, str]:
+        return {"x-api-key": api_key, "anthropic-version": "2023-06-01",
+                "content-type": "application/json"}
+
+    @staticmethod
+    def body(model: str, prompt: str, system: Optional[str], max_tokens: int,
+             temperature: Optional[float], stream: bool) -> Dict:
+        body = {"model": model, "max_tokens": max_tokens, "stream": stream,
+                "messages": [{"role": "user", "content": prompt}]}
+        if system:
+            body["system"] = system
+        if temperature is not None:
+            body["temperature"] = temperature
+        return body
+
+    @staticmethod
+    def parse(data: Dict) -> Tuple[str, Dict]:
+        text = "".join(block.get("text", "") for block in data.get("content", [])
+                       if block.get("type") == "text")
+        usage = data.get("usage", {})
+        return text, {"input_tokens": usage.get("input_tokens", 0),
+                      "output_tokens": usage.get("output_tokens", 0)}
+
+    @staticmethod
+    def parse_event(data: Dict) -> Tuple[str, Dict]:
+        kind = data.get("type")
+        if kind == "content_block_delta":
+            return data.get("delta", {}).get("text", ""), {}
+        if kind == "message_start":
+            usage = data.get("message", {}).get("usage", {})
+            return "", {"input_tokens": usage.get("input_tokens", 0)}
+        if kind == "message_delta":
+            return "", {"output_tokens": data.get("usage", {}).get("output_tokens", 0)}
+        if kind == "error":
+            error = data.get("error", {})
+            raise ModelAPIError(f"stream error: {error.get('message', error)}",
+                                retryable=error.get("type") == "overloaded_error")
+        return "", {}
+
+
+class _OpenAIAPI:
+    path = "/chat/completions"
+
+    @staticmethod
+    def headers(api_key: str) -> Dict[str, str]:
+        return {"authorization": f"Bearer {api_key}", "content-type": "application/json"}
+
+    @staticmethod
+    def body(model: str, prompt: str, system: Optional[str], max_tokens: int,
+             temperature: Optional[float], stream: bool) -> Dict:
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.append({"role": "user", "content": prompt})
+        body = {"model": model, "messages": messages, "stream": stream}
+        # 新一代 OpenAI 模型只接受 max_completion_tokens
+        body["max_completion_tokens" if model.startswith("gpt-5") else "max_tokens"] = max_tokens
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        if temperature is not None:
+            body["temperature"] = temperature
+        return body
+
+    @staticmethod
+    def parse(data: Dict) -> Tuple[str, Dict]:
+        choices = data.get("choices") or [{}]
+        text = choices[0].get("message", {}).get("content") or ""
+        usage = data.get("usage") or {}
+        return text, {"input_tokens": usage.get("prompt_tokens", 0),
+                      "output_tokens": usage.get("completion_tokens", 0)}
+
+    @staticmethod
+    def parse_event(data: Dict) -> Tuple[str, Dict]:
+        usage = data.get("usage") or {}
+        choices = data.get("choices") or [{}]
+        text = choices[0].get("delta", {}).get("content") or ""
+        if usage:
+            return text, {"input_tokens": usage.get("prompt_tokens", 0),
+                          "output_tokens": usage.get("completion_tokens", 0)}
+        return text, {}
+
+
+APIS = {"anthropic": _AnthropicAPI, "openai": _OpenAIAPI}
+
+
+# ---------------------------------------------------------------------------
+# 客户端
+# ---------------------------------------------------------------------------
+
+@dataclass
+class ProviderStats:
+    """单个 provider 的调用统计"""
+    requests: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    retries: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+    def add_usage(self, usage: Dict):
+        self.input_tokens += usage.get("input_tokens", 0)
+        self.output_tokens += usage.get("output_tokens", 0)
+
+
+class ModelClient:
+    """多 provider 异步模型客户端
+
+    用法:
+        async with ModelClient() as client:
+            text = await client.complete(ModelProvider.CLAUDE, prompt)
+            async for delta in client.stream(ModelProvider.DEEPSEEK, prompt):
+                ...
+    """
+
+    def __init__(self, configs: Optional[Dict[ModelProvider, ProviderConfig]] = None,
+                 max_connections_per_host: int = 64, cache: Optional[ResponseCache] = None):
+        self.configs = {provider: provider_config(provider) for provider in ModelProvider}
+        self.configs.update(configs or {})
+        self.pool = HTTPConnectionPool(max_per_host=max_connections_per_host)
+        self.cache = cache
+        self.stats: Dict[ModelProvider, ProviderStats] = {p: ProviderStats() for p in ModelProvider}
+        self._buckets: Dict[ModelProvider, TokenBucket] = {}
+        self._limits: Dict[ModelProvider, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def __aenter__(self) -> "ModelClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.pool.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _limiters(self, provider: ModelProvider) -> Tuple[TokenBucket, asyncio.Semaphore]:
+        # 在事件循环中按需创建
+        if provider not in self._buckets:
+            config = self.configs[provider]
+            self._buckets[provider] = TokenBucket(config.requests_per_second, config.burst)
+            self._limits[provider] = asyncio.Semaphore(config.max_concurrency)
+        return self._buckets[provider], self._limits[provider]
+
+    async def complete(self, provider: ModelProvider, prompt: str, system: Optional[str] = None,
+                       max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                       on_text: Optional[Callable[[str], None]] = None) -> str:
+        """返回完整回复文本；给出 on_text 时以流式请求，每收到一段文本回调一次
+
+        启用缓存时命中直接返回（on_text 收到完整文本一次）；同一个键已有请求在途时等待其结果。
+        """
+        if self.cache is None:
+            return await self._complete(provider, prompt, system, max_tokens, temperature, on_text)
+
+        key = self.cache_key(provider, prompt, system, max_tokens, temperature)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            text = await asyncio.shield(inflight)
+            self.cache.hits += 1
+        else:
+            text = self.cache.get(key)
+            if text is None:
+                future = self._inflight[key] = asyncio.get_running_loop().create_future()
+                try:
+                    text = await self._complete(provider, prompt, system, max_tokens, temperature, on_text)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except BaseException as e:
+                    future.set_exception(e)
+                    # 没有其他等待者时避免 "exception was never retrieved"
+                    future.exception()
+                    raise
+                finally:
+                    del self._inflight[key]
+                future.set_result(text)
+                self.cache.put(key, text)
+                return text
+        if on_text is not None:
+            on_text(text)
+        return text
+
+    def cache_key(self, provider: ModelProvider, prompt: str, system: Optional[str] = None,
+                  max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> str:
+        config = self.configs[provider]
+        return cache_key(provider=provider.value, base_url=config.base_url, model=config.model,
+                         prompt=prompt, system=system, max_tokens=max_tokens or config.max_tokens,
+                         temperature=temperature)
+
+    def forget(self, provider: ModelProvider, prompt: str, system: Optional[str] = None,
+               max_tokens: Optional[int] = None, temperature: Optional[float] = None):
+        """从缓存中删除一条回复（例如回复无法解析时，避免下次命中同样的坏结果）"""
+        if self.cache is not None:
+            self.cache.discard(self.cache_key(provider, prompt, system, max_tokens, temperature))
+
+    async def _complete(self, provider: ModelProvider, prompt: str, system: Optional[str],
+                        max_tokens: Optional[int], temperature: Optional[float],
+                        on_text: Optional[Callable[[str], None]]) -> str:
+        if on_text is not None:
+            parts = []
+            async for delta in self.stream(provider, prompt, system, max_tokens, temperature):
+                parts.append(delta)
+                on_text(delta)
+            return "".join(parts)
+
+        config = self.configs[provider]
+        api = APIS[config.api]
+
+        async def attempt() -> str:
+            response = await self._open(provider, prompt, system, max_tokens, temperature, False)
+            try:
+                body = await asyncio.wait_for(response.read(), config.timeout)
+            except asyncio.TimeoutError:
+                raise ModelAPIError("response body timed out", retryable=True)
+            text, usage = api.parse(json.loads(body))
+            self.stats[provider].add_usage(usage)
+            return text
+
+        return await self._with_retries(provider, attempt)
+
+    async def stream(self, provider: ModelProvider, prompt: str, system: Optional[str] = None,
+                     max_tokens: Optional[int] = None,
+                     temperature: Optional[float] = None) -> AsyncIterator[str]:
+        """以 SSE 流式请求，逐段产出文本
+
+        只有在还没有产出任何文本时才会重试，已经输出的部分不会重复。
+        """
+        config = self.configs[provider]
+        api = APIS[config.api]
+        stats = self.stats[provider]
+        bucket, limit = self._limiters(provider)
+        attempt_no = 0
+        while True:
+            emitted = False
+            started = time.monotonic()
+            stats.requests += 1
+            try:
+                async with limit:
+                    # 拿到并发名额后再取令牌：排队等名额的请求不预先占用令牌，名额空出时不会集中突发
+                    await bucket.acquire()
+                    response = await self._open(provider, prompt, system, max_tokens, temperature, True)
+                    try:
+                        data_lines = []
+                        async for line in response.iter_lines(idle_timeout=config.timeout):
+                            if line.startswith("data:"):
+                                data_lines.append(line[5:].strip())
+                                continue
+                            if line or not data_lines:
+                                continue
+                            payload = "\n".join(data_lines)
+                            data_lines = []
+                            if payload == "[DONE]":
+                                continue
+                            text, usage = api.parse_event(json.loads(payload))
+                            stats.add_usage(usage)
+                            if text:
+                                emitted = True
+                                yield text
+                    finally:
+                        response.close()
+                stats.succeeded += 1
+                stats.latencies.append(time.monotonic() - started)
+                return
+            except (ModelAPIError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                error = _as_api_error(e)
+                if emitted or not error.retryable or attempt_no >= config.max_retries:
+                    stats.failed += 1
+                    raise error from e
+            attempt_no += 1
+            stats.retries += 1
+            await asyncio.sleep(self._backoff(config, attempt_no, error.retry_after))
+
+    async def _with_retries(self, provider: ModelProvider, attempt) -> str:
+        config = self.configs[provider]
+        stats = self.stats[provider]
+        bucket, limit = self._limiters(provider)
+        attempt_no = 0
+        while True:
+            started = time.monotonic()
+            stats.requests += 1
+            try:
+                async with limit:
+                    await bucket.acquire()
+                    result = await attempt()
+                stats.succeeded += 1
+                stats.latencies.append(time.monotonic() - started)
+                return result
+            except (ModelAPIError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                error = _as_api_error(e)
+                if not error.retryable or attempt_no >= config.max_retries:
+                    stats.failed += 1
+                    raise error from e
+            attempt_no += 1
+            stats.retries += 1
+            await asyncio.sleep(self._backoff(config, attempt_no, error.retry_after))
+
+    @staticmethod
+    def _backoff(config: ProviderConfig, attempt: int, retry_after: Optional[float]) -> float:
+        """指数退避 + 全抖动；服务端给出 Retry-After 时至少等待该时长"""
+        delay = random.uniform(0, min(config.backoff_max, config.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, config.backoff_max))
+        return delay
+
+    async def _open(self, provider: ModelProvider, prompt: str, system: Optional[str],
+                    max_tokens: Optional[int], temperature: Optional[float],
+                    stream: bool) -> HTTPResponse:
+        """发送请求，非 2xx 时读取错误信息并抛出 ModelAPIError"""
+        config = self.configs[provider]
+        api = APIS[config.api]
+        body = json.dumps(api.body(config.model, prompt, system, max_tokens or config.max_tokens,
+                                   temperature, stream), ensure_ascii=False).encode("utf-8")
+        headers = api.headers(config.resolved_api_key())
+        if stream:
+            headers["accept"] = "text/event-stream"
+        response = await self.pool.request("POST", config.base_url.rstrip("/") + api.path,
+                                           headers, body, timeout=config.timeout)
+        if 200 <= response.status < 300:
+            return response
+        try:
+            detail = (await asyncio.wait_for(response.read(), config.timeout))[:500]
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            detail = b""
+        raise ModelAPIError(
+            f"{provider.value} HTTP {response.status}: {detail.decode('utf-8', errors='replace')}",
+            status=response.status, retryable=response.status in RETRYABLE_STATUS,
+            retry_after=_retry_after(response.headers.get("retry-after")))
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def _as_api_error(error: BaseException) -> ModelAPIError:
+    """网络层错误视为可重试"""
+    if isinstance(error, ModelAPIError):
+        return error
+    if isinstance(error, asyncio.TimeoutError):
+        return ModelAPIError("request timed out", retryable=True)
+    return ModelAPIError(f"connection error: {error!r}", retryable=True)
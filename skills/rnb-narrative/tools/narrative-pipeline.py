@@ -6,32 +6,16 @@ RNB Narrative Generation Pipeline
 
 import json
 import asyncio
-from dataclasses import dataclass
-from typing import List, Dict, Optional
-from enum import Enum
+import math
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Dict, Optional, Set, Tuple
 
-class ModelProvider(Enum):
-    CLAUDE = "claude"
-    DEEPSEEK = "deepseek"
-    GPT = "gpt"
-
-@dataclass
-class CharacterState:
-    """角色状态快照"""
-    character_id: str
-    fame: int
-    wealth: int
-    stress: int
-    relationships: Dict[str, int]  # char_id -> affinity
-    tags: List[str]
-
-@dataclass
-class WorldState:
-    """世界状态快照"""
-    date: str
-    global_trends: List[str]
-    industry_events: List[str]
-    character_states: Dict[str, CharacterState]
+from model_client import ModelClient, ModelProvider, provider_config
+from response_cache import ResponseCache
+from worldlog import WorldLogWriter, write_worldlog_json
+from world_state import CharacterState, WorldState, open_world_state
 
 @dataclass
 class GameEvent:
@@ -46,16 +30,22 @@ class GameEvent:
 class NarrativeGenerator:
     """叙事生成器"""
 
-    def __init__(self, model_provider: ModelProvider = ModelProvider.CLAUDE):
+    def __init__(self, model_provider: ModelProvider = ModelProvider.CLAUDE,
+                 client: Optional[ModelClient] = None,
+                 on_text: Optional[Callable[[str], None]] = None,
+                 worldlog: Optional[WorldLogWriter] = None):
         self.model = model_provider
+        # 多个生成器共享同一个 client，才能共享连接池和限速
+        self.client = client or ModelClient()
+        self.on_text = on_text
+        # 给出 worldlog 时事件校验后直接追加到日志，不在 generated_events 中累积
+        self.worldlog = worldlog
         self.world_state: Optional[WorldState] = None
         self.generated_events: List[GameEvent] = []
 
     async def load_world_state(self, state_file: str):
-        """从 rnb-engine 加载世界状态"""
-        with open(state_file, 'r') as f:
-            data = json.load(f)
-            self.world_state = WorldState(**data)
+        """从 rnb-engine 加载世界状态（JSON 文件或 world_state.py 生成的 SQLite 快照）"""
+        self.world_state = open_world_state(state_file)
 
     async def generate_event_chain(
         self,
@@ -82,11 +72,17 @@ class NarrativeGenerator:
 
         # 解析为 GameEvents
         events = self._parse_events(response)
+        if not events:
+            # 无法解析的回复不留在缓存里，下次重新生成
+            self.client.forget(self.model, prompt)
 
         # 因果一致性检查（模拟 Arbiter 功能）
         validated_events = self._validate_causality(events)
 
-        self.generated_events.extend(validated_events)
+        if self.worldlog is not None:
+            self.worldlog.append(_worldlog_entry(evt) for evt in validated_events)
+        else:
+            self.generated_events.extend(validated_events)
         return validated_events
 
     def _build_event_chain_prompt(
@@ -97,8 +93,10 @@ class NarrativeGenerator:
         max_events: int
     ) -> str:
         """构建事件链生成 prompt"""
+        # 快照中的角色一次查询取回，不逐个访问
+        characters = self.world_state.get_characters(participants) if self.world_state else {}
         char_desc = "\n".join([
-            f"- {pid}: {self._get_character_desc(pid)}"
+            f"- {pid}: {self._get_character_desc(pid, characters.get(pid))}"
             for pid in participants
         ])
 
@@ -123,22 +121,20 @@ class NarrativeGenerator:
 请生成因果一致的事件链，输出 JSON 格式。
 """
 
-    def _get_character_desc(self, char_id: str) -> str:
+    def _get_character_desc(self, char_id: str, char: Optional[CharacterState]) -> str:
         """获取角色描述"""
-        if self.world_state and char_id in self.world_state.character_states:
-            char = self.world_state.character_states[char_id]
+        if char is not None:
             return f"{char.character_id}, 知名度:{char.fame}, 财富:{char.wealth}"
         return char_id
 
     async def _call_model(self, prompt: str) -> str:
-        """调用 AI 模型（占位实现）"""
-        # 实际实现需要接入 Claude/GPT/DeepSeek API
-        pass
+        """调用 AI 模型（限速、重试见 model_client）"""
+        return await self.client.complete(self.model, prompt, on_text=self.on_text)
 
     def _parse_events(self, response: str) -> List[GameEvent]:
-        """解析 AI 响应为 GameEvents"""
+        """解析 AI 响应为 GameEvents；回复不是 JSON 或结构不对时返回空列表"""
         try:
-            data = json.loads(response)
+            data = json.loads(_strip_code_fence(response))
             events = []
             for evt_data in data.get("events", []):
                 events.append(GameEvent(
@@ -150,7 +146,8 @@ class NarrativeGenerator:
                     consequences=evt_data.get("consequences", {})
                 ))
             return events
-        except json.JSONDecodeError:
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # json.JSONDecodeError 是 ValueError 的子类；其余来自顶层不是对象、缺字段等
             return []
 
     def _validate_causality(self, events: List[GameEvent]) -> List[GameEvent]:
@@ -178,32 +175,41 @@ class NarrativeGenerator:
         return True
 
     async def export_to_worldlog(self, output_file: str):
-        """导出到 WorldLog 格式"""
-        worldlog_data = {
-            "version": "1.0",
-            "events": [
-                {
-                    "id": evt.id,
-                    "timestamp": evt.timestamp,
-                    "type": evt.event_type,
-                    "participants": evt.participants,
-                    "payload": {
-                        "description": evt.description,
-                        "consequences": evt.consequences
-                    }
-                }
-                for evt in self.generated_events
-            ]
+        """导出到 WorldLog 格式
+
+        *.jsonl 追加到追加式 WorldLog，其他文件写出 {"version", "events": [...]} 文档。
+        """
+        entries = (_worldlog_entry(evt) for evt in self.generated_events)
+        if output_file.endswith(".jsonl"):
+            with WorldLogWriter(output_file) as log:
+                log.append(entries)
+        else:
+            write_worldlog_json(output_file, entries)
+
+
+def _worldlog_entry(evt: GameEvent) -> Dict:
+    """GameEvent -> WorldLog 事件记录"""
+    return {
+        "id": evt.id,
+        "timestamp": evt.timestamp,
+        "type": evt.event_type,
+        "participants": evt.participants,
+        "payload": {
+            "description": evt.description,
+            "consequences": evt.consequences
         }
-        with open(output_file, 'w') as f:
-            json.dump(worldlog_data, f, indent=2, ensure_ascii=False)
+    }
 
 
 class CharacterArcDesigner:
     """角色弧线设计师"""
 
-    def __init__(self, model_provider: ModelProvider = ModelProvider.CLAUDE):
+    def __init__(self, model_provider: ModelProvider = ModelProvider.CLAUDE,
+                 client: Optional[ModelClient] = None,
+                 on_text: Optional[Callable[[str], None]] = None):
         self.model = model_provider
+        self.client = client or ModelClient()
+        self.on_text = on_text
 
     async def design_arc(
         self,
@@ -231,11 +237,182 @@ class CharacterArcDesigner:
 输出 JSON 格式，包含 phases, overall_trajectory, fate_points。
 """
         response = await self._call_model(prompt)
-        return json.loads(response)
+        try:
+            arc = json.loads(_strip_code_fence(response))
+            if not isinstance(arc, dict):
+                raise ValueError(f"expected a JSON object, got {type(arc).__name__}")
+            return arc
+        except ValueError:
+            # 无法解析的回复不留在缓存里，下次重新生成
+            self.client.forget(self.model, prompt)
+            raise
 
     async def _call_model(self, prompt: str) -> str:
         """调用 AI 模型"""
-        pass
+        return await self.client.complete(self.model, prompt, on_text=self.on_text)
+
+
+def _strip_code_fence(text: str) -> str:
+    """去掉模型回复中包裹 JSON 的 ```json ... ``` 代码块标记"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text
+
+
+@dataclass
+class BatchStats:
+    """批量生成统计"""
+    completed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    events: int = 0
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+
+    def percentile(self, q: float) -> float:
+        """最近秩（nearest-rank）百分位"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        rank = math.ceil(q / 100 * len(ordered))
+        return ordered[min(len(ordered) - 1, max(0, rank - 1))]
+
+    def summary(self) -> str:
+        rate = self.completed / self.elapsed if self.elapsed else 0.0
+        return (f"Completed {self.completed} chains ({self.events} events), "
+                f"{self.failed} failed, {self.skipped} skipped in {self.elapsed:.1f}s "
+                f"({rate:.2f} chains/s)\n"
+                f"Latency p50 {self.percentile(50):.2f}s  p95 {self.percentile(95):.2f}s  "
+                f"p99 {self.percentile(99):.2f}s  max {max(self.latencies, default=0.0):.2f}s")
+
+
+def _completed_trigger_ids(output_file: str) -> Set[str]:
+    """读取已有的批量输出，返回成功完成的 trigger id
+
+    中断时最后一行可能只写了一半：截掉不完整的尾部，续写时不会拼出坏行。
+    失败记录不算完成，续跑时会重试；不是 JSON 对象或缺少 id 的行跳过。
+    """
+    done: Set[str] = set()
+    try:
+        f = open(output_file, 'rb+')
+    except FileNotFoundError:
+        return done
+    with f:
+        valid_end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            valid_end += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "error" not in record and record.get("id") is not None:
+                done.add(str(record["id"]))
+        f.truncate(valid_end)
+    return done
+
+
+def _iter_triggers(batch_file: str) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """逐行读取 trigger（JSONL），产出 (id, 配置, 错误)，缺少 id 时以行号作为 id
+
+    无法解析的行产出 (行号, None, 错误信息)，不中断整个批次。
+    """
+    with open(batch_file, 'r') as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                config = json.loads(line)
+            except ValueError as e:
+                yield str(lineno), None, f"invalid trigger on line {lineno}: {e}"
+                continue
+            if not isinstance(config, dict):
+                yield str(lineno), None, f"invalid trigger on line {lineno}: expected a JSON object"
+                continue
+            yield str(config.get("id", lineno)), config, None
+
+
+async def run_event_chain_batch(
+    batch_file: str,
+    output_file: str,
+    model: ModelProvider,
+    client: ModelClient,
+    concurrency: int,
+    world_state: Optional[WorldState] = None
+) -> BatchStats:
+    """
+    批量生成事件链
+
+    - trigger 从 JSONL 流式读取，经有界队列分发给 concurrency 个 worker
+    - 每条完成后立即追加一行到 output_file（JSONL），崩溃后重跑会跳过已完成的 trigger id
+    """
+    stats = BatchStats()
+    done = _completed_trigger_ids(output_file)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    started = time.monotonic()
+
+    with open(output_file, 'a') as out:
+
+        def write(record: Dict):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                trigger_id, config = item
+                # 每个 trigger 用独立的生成器，避免 generated_events 在整个批次中累积
+                gen = NarrativeGenerator(model, client)
+                gen.world_state = world_state
+                t0 = time.monotonic()
+                try:
+                    events = await gen.generate_event_chain(
+                        trigger=config["trigger"],
+                        target_state=config.get("target_state", {}),
+                        participants=config.get("participants", []),
+                        max_events=config.get("max_events", 5)
+                    )
+                    if not events:
+                        raise ValueError("model response contained no events")
+                except Exception as e:
+                    stats.failed += 1
+                    write({"id": trigger_id, "error": f"{type(e).__name__}: {e}"})
+                    continue
+                latency = time.monotonic() - t0
+                stats.completed += 1
+                stats.events += len(events)
+                stats.latencies.append(latency)
+                write({"id": trigger_id, "latency": round(latency, 3),
+                       "events": [_worldlog_entry(evt) for evt in events]})
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            seen: Set[str] = set()
+            for trigger_id, config, error in _iter_triggers(batch_file):
+                if trigger_id in done or trigger_id in seen:
+                    stats.skipped += 1
+                    continue
+                seen.add(trigger_id)
+                if error is not None:
+                    stats.failed += 1
+                    write({"id": trigger_id, "error": error})
+                    continue
+                await queue.put((trigger_id, config))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    stats.elapsed = time.monotonic() - started
+    return stats
 
 
 # CLI 接口
@@ -244,31 +421,84 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="RNB Narrative Generator")
     parser.add_argument("command", choices=["event-chain", "character-arc"])
-    parser.add_argument("--config", required=True, help="配置文件路径")
-    parser.add_argument("--output", required=True, help="输出文件路径")
+    parser.add_argument("--config", help="配置文件路径")
+    parser.add_argument("--batch", help="event-chain 批量模式：每行一个 trigger 配置的 JSONL 文件")
+    parser.add_argument("--world-state", help="世界状态 JSON 文件或 SQLite 快照（world_state.py snapshot）")
+    parser.add_argument("--output", required=True,
+                        help="输出文件路径（*.jsonl 为追加式 WorldLog；批量模式为 JSONL 结果，可续跑）")
     parser.add_argument("--model", default="claude", choices=["claude", "deepseek", "gpt"])
+    parser.add_argument("--base-url", help="覆盖模型 API 地址（如本地 stub 服务）")
+    parser.add_argument("--model-name", help="覆盖具体模型名")
+    parser.add_argument("--rps", type=float, help="每秒请求数上限")
+    parser.add_argument("--concurrency", type=int, help="最大并发请求数")
+    parser.add_argument("--stream", action="store_true", help="流式请求，把模型输出实时打印到 stderr")
+    parser.add_argument("--no-cache", action="store_true", help="不使用本地回复缓存")
+    parser.add_argument("--cache-path", help="回复缓存文件（默认 ~/.claude/rnb_narrative_cache.db）")
+    parser.add_argument("--cache-max-mb", type=int, default=256, help="回复缓存大小上限（MB）")
 
     args = parser.parse_args()
+    if args.batch and args.command != "event-chain":
+        parser.error("--batch is only supported for event-chain")
+    if not args.batch and not args.config:
+        parser.error("--config is required")
 
     async def main():
-        with open(args.config, 'r') as f:
-            config = json.load(f)
+        config = {}
+        if args.config:
+            with open(args.config, 'r') as f:
+                config = json.load(f)
 
         model = ModelProvider(args.model)
+        cache = None if args.no_cache else ResponseCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+        client = ModelClient({model: provider_config(
+            model, base_url=args.base_url, model=args.model_name,
+            requests_per_second=args.rps, max_concurrency=args.concurrency)}, cache=cache)
+        on_text = (lambda text: print(text, end="", file=sys.stderr, flush=True)) if args.stream else None
 
-        if args.command == "event-chain":
-            gen = NarrativeGenerator(model)
-            events = await gen.generate_event_chain(
-                trigger=config["trigger"],
-                target_state=config["target_state"],
-                participants=config["participants"],
-                max_events=config.get("max_events", 5)
+        world_state = open_world_state(args.world_state) if args.world_state else None
+        try:
+            async with client:
+                await run(config, model, client, on_text, world_state)
+                if cache is not None:
+                    print(cache.summary(), file=sys.stderr)
+        finally:
+            if world_state is not None:
+                world_state.close()
+
+    async def run(config, model, client, on_text, world_state):
+
+        if args.batch:
+            stats = await run_event_chain_batch(
+                args.batch, args.output, model, client,
+                concurrency=client.configs[model].max_concurrency,
+                world_state=world_state
             )
-            await gen.export_to_worldlog(args.output)
+            print(stats.summary())
+            usage = client.stats[model]
+            print(f"Requests {usage.requests} ({usage.retries} retries), "
+                  f"tokens in {usage.input_tokens:,} / out {usage.output_tokens:,}")
+
+        elif args.command == "event-chain":
+            # *.jsonl 为追加式 WorldLog：事件校验后立即追加
+            log = WorldLogWriter(args.output) if args.output.endswith(".jsonl") else None
+            try:
+                gen = NarrativeGenerator(model, client, on_text, worldlog=log)
+                gen.world_state = world_state
+                events = await gen.generate_event_chain(
+                    trigger=config["trigger"],
+                    target_state=config["target_state"],
+                    participants=config["participants"],
+                    max_events=config.get("max_events", 5)
+                )
+            finally:
+                if log is not None:
+                    log.close()
+            if log is None:
+                await gen.export_to_worldlog(args.output)
             print(f"Generated {len(events)} events")
 
         elif args.command == "character-arc":
-            designer = CharacterArcDesigner(model)
+            designer = CharacterArcDesigner(model, client, on_text)
             arc = await designer.design_arc(
                 character_id=config["character_id"],
                 arc_type=config["arc_type"],
@@ -279,4 +509,11 @@ if __name__ == "__main__":
                 json.dump(arc, f, indent=2, ensure_ascii=False)
             print(f"Character arc designed")
 
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        if not args.batch:
+            raise
+        print(f"Interrupted; completed chains are in {args.output}, rerun the same command to resume",
+              file=sys.stderr)
+        sys.exit(130)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+模型回复缓存
+以 (provider, API 地址, 模型, prompt, 参数) 的 SHA-256 为键，把回复文本保存在本地 SQLite 中。
+同样的配置重复运行时直接返回缓存结果，不再调用模型。
+
+- 默认位置 ~/.claude/rnb_narrative_cache.db，RNB_CACHE_PATH 环境变量可覆盖
+- 总大小超过上限时按最近使用时间（LRU）淘汰，直到降到上限的 90%
+- WAL 模式，多个进程可以共用同一个缓存文件
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+CACHE_PATH = Path(os.environ.get("RNB_CACHE_PATH", Path.home() / ".claude" / "rnb_narrative_cache.db"))
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def cache_key(**params) -> str:
+    """参数的规范 JSON 的 SHA-256"""
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """内容寻址的回复缓存，带命中统计"""
+
+    def __init__(self, path: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path or CACHE_PATH)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, response: str):
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?)", (key, response, size, now, now))
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+
+    def _evict(self, target: int):
+        """按 last_used 从旧到新删除，直到总大小不超过 target"""
+        # 其他进程也可能写入，以库中实际大小为准
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if self.total_bytes <= target:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.evicted += len(doomed)
+
+    def discard(self, key: str):
+        with self.conn:
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= row[0]
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "entries": entries,
+            "bytes": self.total_bytes,
+        }
+
+    def summary(self) -> str:
+        s = self.stats()
+        return (f"Cache: {s['hits']} hits / {s['misses']} misses ({s['hit_rate']:.1%} hit rate), "
+                f"{s['entries']} entries, {s['bytes'] / 1024 / 1024:.1f} MB, {s['evicted']} evicted")
+
+    def close(self):
+        self.conn.close()
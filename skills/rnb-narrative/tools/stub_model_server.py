@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+本地模型 API stub 服务
+模拟 Claude Messages API（/v1/messages）和 OpenAI 兼容的 Chat Completions（/chat/completions、
+/v1/chat/completions），用于在不消耗额度的情况下测试 model_client 的并发、限速、重试和流式输出。
+
+    python3 stub_model_server.py --port 8765 --latency 0.2 --error-rate 0.1
+    RNB_CLAUDE_BASE_URL=http://127.0.0.1:8765 python3 narrative-pipeline.py event-chain ...
+
+- 支持 HTTP/1.1 keep-alive，流式响应以 chunked 编码发送 SSE
+- --error-rate 按比例返回 429（带 Retry-After）/ 503 / 529，用于验证重试
+- 回复内容为固定的事件链 JSON（--reply 可指定文件）
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, Optional
+
+DEFAULT_REPLY = {
+    "events": [
+        {"id": "evt_001", "timestamp": "2005-03-01", "type": "audition",
+         "participants": ["char_001"], "description": "参加选秀海选",
+         "consequences": {"char_001": {"fame": 5}}},
+        {"id": "evt_002", "timestamp": "2005-04-15", "type": "scandal",
+         "participants": ["char_001", "char_002"], "description": "绯闻登上娱乐版头条",
+         "consequences": {"char_001": {"fame": 10, "stress": 15}}},
+    ]
+}
+
+ROUTES = {"/v1/messages": "anthropic", "/chat/completions": "openai", "/v1/chat/completions": "openai"}
+
+
+class StubModelServer:
+    """stub 服务，带请求 / 连接计数"""
+
+    def __init__(self, reply: str, latency: float = 0.0, error_rate: float = 0.0,
+                 chunk_size: int = 16, chunk_delay: float = 0.0):
+        self.reply = reply
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0
+        self.request_times = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                if not await self.respond(writer, method, path, body):
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, method: str, path: str, body: bytes) -> bool:
+        """返回 False 时关闭连接"""
+        self.requests += 1
+        self.request_times.append(time.monotonic())
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if method != "POST" or path not in ROUTES:
+                self._write(writer, 404, {"error": "not found"})
+                return True
+            if self.error_rate and random.random() < self.error_rate:
+                self.errors += 1
+                status = random.choice([429, 503, 529])
+                extra = {"Retry-After": "0"} if status == 429 else {}
+                self._write(writer, status, {"error": {"type": "rate_limit_error" if status == 429
+                                                       else "overloaded_error"}}, extra)
+                return True
+            request = json.loads(body)
+            anthropic = ROUTES[path] == "anthropic"
+            if request.get("stream"):
+                await self._stream(writer, request, anthropic)
+            elif anthropic:
+                self._write(writer, 200, {
+                    "type": "message", "model": request["model"], "role": "assistant",
+                    "content": [{"type": "text", "text": self.reply}],
+                    "usage": {"input_tokens": len(body) // 4, "output_tokens": len(self.reply) // 4}})
+            else:
+                self._write(writer, 200, {
+                    "object": "chat.completion", "model": request["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": self.reply},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(self.reply) // 4}})
+            return True
+        finally:
+            self.active -= 1
+
+    def _write(self, writer: asyncio.StreamWriter, status: int, payload: Dict,
+               extra: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = [f"HTTP/1.1 {status} X", "Content-Type: application/json",
+                f"Content-Length: {len(data)}"]
+        head += [f"{k}: {v}" for k, v in (extra or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+
+    async def _stream(self, writer: asyncio.StreamWriter, request: Dict, anthropic: bool):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n")
+
+        def send(event: Dict, name: Optional[str] = None):
+            text = (f"event: {name}\n" if name else "") + "data: " + json.dumps(event, ensure_ascii=False) + "\n\n"
+            data = text.encode("utf-8")
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        pieces = [self.reply[i:i + self.chunk_size] for i in range(0, len(self.reply), self.chunk_size)]
+        if anthropic:
+            send({"type": "message_start", "message": {"usage": {"input_tokens": 100}}}, "message_start")
+        for piece in pieces:
+            if anthropic:
+                send({"type": "content_block_delta", "index": 0,
+                      "delta": {"type": "text_delta", "text": piece}}, "content_block_delta")
+            else:
+                send({"choices": [{"index": 0, "delta": {"content": piece}}]})
+            if self.chunk_delay:
+                await writer.drain()
+                await asyncio.sleep(self.chunk_delay)
+        if anthropic:
+            send({"type": "message_delta", "usage": {"output_tokens": len(self.reply) // 4}}, "message_delta")
+            send({"type": "message_stop"}, "message_stop")
+        else:
+            send({"choices": [], "usage": {"prompt_tokens": 100, "completion_tokens": len(self.reply) // 4}})
+            data = b"data: [DONE]\n\n"
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        writer.write(b"0\r\n\r\n")
+
+
+async def serve(host: str, port: int, server: StubModelServer):
+    srv = await asyncio.start_server(server.handle, host, port)
+    print(f"Stub model server listening on http://{host}:{port}")
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RNB model API stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 429/503/529 的比例")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="流式输出每块之间的延迟（秒）")
+    parser.add_argument("--reply", help="回复内容文件（默认为示例事件链 JSON）")
+    args = parser.parse_args()
+
+    if args.reply:
+        with open(args.reply, 'r') as f:
+            reply = f.read()
+    else:
+        reply = json.dumps(DEFAULT_REPLY, ensure_ascii=False)
+
+    try:
+        asyncio.run(serve(args.host, args.port, StubModelServer(
+            reply, args.latency, args.error_rate, chunk_delay=args.chunk_delay)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+rnb-engine 世界状态
+CharacterState / WorldState 数据结构与加载。
+
+- JSON 状态文件整体解析，角色转换为 __slots__ 的 CharacterState，标签和关系表中的角色 id 做 intern
+- 大世界可先转换为 SQLite 快照（角色 id 为主键），打开快照只读取全局字段，
+  角色在首次访问时按 id 查询并解析，生成只涉及几个角色的 prompt 不必解析全部角色
+
+    python3 world_state.py snapshot world.json world.db
+    python3 narrative-pipeline.py event-chain --world-state world.db ...
+"""
+
+import json
+import sqlite3
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Mapping
+
+SNAPSHOT_VERSION = 1
+
+
+@dataclass
+class CharacterState:
+    """角色状态快照"""
+    __slots__ = ("character_id", "fame", "wealth", "stress", "relationships", "tags")
+    character_id: str
+    fame: int
+    wealth: int
+    stress: int
+    relationships: Dict[str, int]  # char_id -> affinity
+    tags: List[str]
+
+    @classmethod
+    def from_dict(cls, data: Dict, character_id: str = None) -> "CharacterState":
+        """从 rnb-engine 的角色字典构造；标签和关系中的角色 id 做 intern，大量角色之间共享字符串"""
+        intern = sys.intern
+        return cls(
+            character_id=intern(character_id or data["character_id"]),
+            fame=data.get("fame", 0),
+            wealth=data.get("wealth", 0),
+            stress=data.get("stress", 0),
+            relationships={intern(k): v for k, v in data.get("relationships", {}).items()},
+            tags=[intern(tag) for tag in data.get("tags", [])],
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "character_id": self.character_id,
+            "fame": self.fame,
+            "wealth": self.wealth,
+            "stress": self.stress,
+            "relationships": self.relationships,
+            "tags": self.tags,
+        }
+
+
+@dataclass
+class WorldState:
+    """世界状态快照"""
+    date: str
+    global_trends: List[str]
+    industry_events: List[str]
+    character_states: Mapping[str, CharacterState]
+
+    def get_characters(self, character_ids: Iterable[str]) -> Dict[str, CharacterState]:
+        """按 id 取多个角色，不存在的 id 忽略；快照中未缓存的角色一次查询取回"""
+        states = self.character_states
+        if isinstance(states, SnapshotCharacters):
+            return states.get_many(character_ids)
+        return {cid: states[cid] for cid in character_ids if cid in states}
+
+    def close(self):
+        """关闭快照的 SQLite 连接；JSON 加载的状态没有需要释放的资源"""
+        if isinstance(self.character_states, SnapshotCharacters):
+            self.character_states.close()
+
+    def __enter__(self) -> "WorldState":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotCharacters(Mapping):
+    """SQLite 快照中的角色表，按 id 懒加载，最近使用的 cache_size 个角色保留在内存中"""
+
+    def __init__(self, conn: sqlite3.Connection, cache_size: int = 4096):
+        self.conn = conn
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, CharacterState]" = OrderedDict()
+        self._len = None
+
+    def __getitem__(self, character_id: str) -> CharacterState:
+        state = self._cache.get(character_id)
+        if state is not None:
+            self._cache.move_to_end(character_id)
+            return state
+        row = self.conn.execute(
+            "SELECT data FROM characters WHERE character_id = ?", (character_id,)).fetchone()
+        if row is None:
+            raise KeyError(character_id)
+        return self._remember(CharacterState.from_dict(json.loads(row[0]), character_id))
+
+    def _remember(self, state: CharacterState) -> CharacterState:
+        self._cache[state.character_id] = state
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return state
+
+    def __contains__(self, character_id) -> bool:
+        if character_id in self._cache:
+            return True
+        return self.conn.execute(
+            "SELECT 1 FROM characters WHERE character_id = ?", (character_id,)).fetchone() is not None
+
+    def get_many(self, character_ids: Iterable[str]) -> Dict[str, CharacterState]:
+        """一次查询取多个角色，不存在的 id 忽略"""
+        result = {}
+        missing = []
+        for character_id in character_ids:
+            if character_id in self._cache:
+                result[character_id] = self[character_id]
+            else:
+                missing.append(character_id)
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT character_id, data FROM characters WHERE character_id IN "
+                f"({','.join('?' * len(chunk))})", chunk)
+            for character_id, data in rows:
+                result[character_id] = self._remember(
+                    CharacterState.from_dict(json.loads(data), character_id))
+        return result
+
+    def __iter__(self) -> Iterator[str]:
+        for (character_id,) in self.conn.execute(
+                "SELECT character_id FROM characters ORDER BY character_id"):
+            yield character_id
+
+    def __len__(self) -> int:
+        if self._len is None:
+            self._len = self.conn.execute("SELECT COUNT(*) FROM characters").fetchone()[0]
+        return self._len
+
+    def close(self):
+        self.conn.close()
+
+
+def _from_json(data: Dict) -> WorldState:
+    characters = {
+        cid: CharacterState.from_dict(state, cid)
+        for cid, state in data.get("character_states", {}).items()
+    }
+    return WorldState(
+        date=data["date"],
+        global_trends=data.get("global_trends", []),
+        industry_events=data.get("industry_events", []),
+        character_states=characters,
+    )
+
+
+def is_snapshot(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(16) == b"SQLite format 3\x00"
+
+
+def open_world_state(path: str) -> WorldState:
+    """加载世界状态：SQLite 快照懒加载角色，JSON 文件整体解析
+
+    快照保持一个只读连接，用完后调用 close()，或 with open_world_state(path) as state。
+    """
+    if is_snapshot(path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if int(meta.get("version", 0)) != SNAPSHOT_VERSION:
+            conn.close()
+            raise ValueError(f"{path}: unsupported snapshot version {meta.get('version')}, "
+                             f"rebuild it with: world_state.py snapshot")
+        return WorldState(
+            date=json.loads(meta["date"]),
+            global_trends=json.loads(meta["global_trends"]),
+            industry_events=json.loads(meta["industry_events"]),
+            character_states=SnapshotCharacters(conn),
+        )
+    with open(path, "r") as f:
+        return _from_json(json.load(f))
+
+
+def build_snapshot(src: str, dst: str) -> int:
+    """JSON 状态文件 -> SQLite 快照（覆盖 dst），返回角色数"""
+    with open(src, "r") as f:
+        data = json.load(f)
+    characters = data.pop("character_states", {})
+    open(dst, "wb").close()
+    conn = sqlite3.connect(dst)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("CREATE TABLE characters (character_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        meta = {"version": str(SNAPSHOT_VERSION)}
+        meta.update({key: json.dumps(data.get(key, [] if key != "date" else None), ensure_ascii=False)
+                     for key in ("date", "global_trends", "industry_events")})
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        conn.executemany(
+            "INSERT INTO characters VALUES (?, ?)",
+            ((cid, json.dumps(state, ensure_ascii=False, separators=(",", ":")))
+             for cid, state in characters.items()))
+        conn.commit()
+    finally:
+        conn.close()
+    return len(characters)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="rnb-engine world state snapshot builder")
+    parser.add_argument("command", choices=["snapshot"])
+    parser.add_argument("src", help="世界状态 JSON 文件")
+    parser.add_argument("dst", help="输出 SQLite 快照")
+    args = parser.parse_args()
+
+    print(f"Snapshot written with {build_snapshot(args.src, args.dst)} characters")
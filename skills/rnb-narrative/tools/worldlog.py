@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+WorldLog 读写
+追加式 WorldLog 格式（JSONL）：第一行是文件头，之后每行一个事件，事件结构与旧的
+{"version": "1.0", "events": [...]} 文档中的元素相同。
+
+    {"format": "rnb-worldlog", "version": "1.0"}
+    {"id": "evt_001", "timestamp": "...", "type": "...", "participants": [...], "payload": {...}}
+
+- 事件通过校验后逐条追加，不需要在内存中保留全部事件，也不会重写整个文件
+- 写入中断留下的半行在下次打开时截掉；读取时同样忽略
+- iter_worldlog() 流式读取两种格式；to-jsonl / to-json 在两种格式之间转换
+
+    python3 worldlog.py to-jsonl worldlog.json worldlog.jsonl
+    python3 worldlog.py to-json worldlog.jsonl worldlog.json
+"""
+
+import json
+import os
+from typing import Dict, Iterable, Iterator, Optional
+
+FORMAT = "rnb-worldlog"
+VERSION = "1.0"
+HEADER = {"format": FORMAT, "version": VERSION}
+
+
+def _truncate_partial_tail(f) -> int:
+    """截掉文件末尾没有换行结束的半行，返回截断后的大小"""
+    size = f.seek(0, os.SEEK_END)
+    end = size
+    while end > 0:
+        start = max(0, end - 65536)
+        f.seek(start)
+        block = f.read(end - start)
+        if end == size and block.endswith(b"\n"):
+            return size
+        pos = block.rfind(b"\n")
+        if pos >= 0:
+            end = start + pos + 1
+            break
+        end = start
+    f.truncate(end)
+    return end
+
+
+class WorldLogWriter:
+    """追加式 WorldLog 写入器
+
+    文件不存在或为空时写入文件头；已有文件必须是同一格式。每次 append 后 flush，
+    fsync=True 时同时落盘。
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.count = 0
+        self._file = open(path, "ab+")
+        try:
+            self._file.seek(0)
+            first = self._file.readline()
+            # 先确认文件头再截断，不会误伤旧格式的 JSON 文档
+            if first and (not first.endswith(b"\n") or _parse_header(first) is None):
+                raise ValueError(f"{path} is not an append-only WorldLog "
+                                 f"(convert it with: worldlog.py to-jsonl)")
+            if _truncate_partial_tail(self._file) == 0:
+                self._write_line(HEADER)
+                self._file.flush()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _write_line(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def append(self, entries: Iterable[Dict]):
+        """追加一批事件（WorldLog 事件字典）"""
+        for entry in entries:
+            self._write_line(entry)
+            self.count += 1
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self) -> "WorldLogWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _parse_header(line: bytes) -> Optional[Dict]:
+    try:
+        header = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(header, dict) and header.get("format") == FORMAT:
+        return header
+    return None
+
+
+def iter_worldlog(path: str) -> Iterator[Dict]:
+    """逐条产出事件；追加式格式流式读取，旧的 JSON 文档整体解析"""
+    with open(path, "rb") as f:
+        header = _parse_header(f.readline())
+        if header is None:
+            f.seek(0)
+            yield from json.load(f).get("events", [])
+            return
+        for line in f:
+            if not line.endswith(b"\n"):
+                break   # 写入中断留下的半行
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_worldlog_json(path: str, entries: Iterable[Dict], version: str = VERSION):
+    """以旧格式写出 {"version", "events": [...]}，逐条写入，不在内存中构造整个文档
+
+    输出与 json.dump(..., indent=2, ensure_ascii=False) 逐字节相同。
+    """
+    with open(path, "w") as f:
+        f.write('{\n  "version": ' + json.dumps(version) + ',\n  "events": [')
+        first = True
+        for entry in entries:
+            text = json.dumps(entry, indent=2, ensure_ascii=False).replace("\n", "\n    ")
+            f.write(("\n    " if first else ",\n    ") + text)
+            first = False
+        f.write("]\n}" if first else "\n  ]\n}")
+
+
+def convert_to_jsonl(src: str, dst: str) -> int:
+    """旧 JSON 文档（或追加式文件）-> 新的追加式文件（覆盖 dst），返回事件数"""
+    open(dst, "wb").close()
+    with WorldLogWriter(dst) as writer:
+        writer.append(iter_worldlog(src))
+        return writer.count
+
+
+def convert_to_json(src: str, dst: str) -> int:
+    """追加式文件 -> 旧 JSON 文档，返回事件数"""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for entry in iter_worldlog(src):
+            count += 1
+            yield entry
+
+    write_worldlog_json(dst, counted())
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="WorldLog format converter")
+    parser.add_argument("command", choices=["to-jsonl", "to-json"])
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.src) == os.path.abspath(args.dst):
+        parser.error("src and dst must be different files")
+    if args.command == "to-jsonl":
+        n = convert_to_jsonl(args.src, args.dst)
+    else:
+        n = convert_to_json(args.src, args.dst)
+    print(f"Converted {n} events")